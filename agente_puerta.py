@@ -0,0 +1,259 @@
+"""
+Agente de barrera del Sistema de Estacionamiento
+
+Permite que una barrera siga registrando ingresos y egresos aunque se corte
+la conexión con el servidor central (app.py). El agente mantiene una réplica
+local del estado (vehículos dentro, tarifas y abonos) en un Estacionamiento
+propio, valida y cobra cada evento contra esa réplica y lo guarda en una cola
+durable en disco.
+
+Cuando hay conexión, la cola se envía a /api/lote en el orden en que se
+registró. Cada evento lleva una clave de idempotencia (id_evento), así que
+reenviar eventos que el servidor ya aplicó (por ejemplo, si la conexión se
+cortó antes de recibir la respuesta) no repite ingresos ni cobra dos veces.
+
+Ante un conflicto manda el servidor central: si un evento no puede aplicarse
+allí (la placa ya entró o ya salió por otra barrera), se saca de la cola y
+se anota en 'conflictos.jsonl' con el mensaje del servidor para revisarlo.
+Con la cola vacía, la réplica se vuelve a copiar del servidor, lo que requiere
+el token de administración del servidor (--token o ESTACIONAMIENTO_TOKEN_ADMIN).
+
+Uso:
+    python agente_puerta.py --central http://localhost:8080 --nombre puerta-norte --token SECRETO
+"""
+
+import argparse
+from datetime import datetime
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+import uuid
+
+from estacionamiento import Estacionamiento
+from persistencia import DiarioEventos
+
+EVENTOS_POR_ENVIO = 500  # Eventos por solicitud a /api/lote
+
+
+class ColaEventos:
+    """Cola de eventos pendientes de enviar, persistida en un diario JSONL"""
+
+    def __init__(self, ruta):
+        """
+        Inicializa la cola con los eventos que quedaron en el archivo
+
+        Args:
+            ruta (str): Archivo de la cola
+        """
+        self.diario = DiarioEventos(ruta)
+        self.pendientes = [datos for _, _, datos in self.diario.leer()]
+        self._lock = threading.Lock()
+
+    def agregar(self, evento):
+        """Agrega un evento al final de la cola (con fsync)"""
+        with self._lock:
+            self.diario.anexar(len(self.pendientes), evento['tipo'], evento)
+            self.pendientes.append(evento)
+
+    def primeros(self, cantidad):
+        """Primeros eventos de la cola, sin quitarlos"""
+        with self._lock:
+            return self.pendientes[:cantidad]
+
+    def confirmar(self, cantidad):
+        """Quita de la cola los primeros eventos, ya procesados por el servidor"""
+        with self._lock:
+            self.pendientes = self.pendientes[cantidad:]
+            self.diario.reescribir([(i, evento['tipo'], evento) for i, evento in enumerate(self.pendientes)])
+
+    def __len__(self):
+        return len(self.pendientes)
+
+
+class AgentePuerta:
+    """Barrera que opera sobre una réplica local y sincroniza con el servidor central"""
+
+    def __init__(self, url_central, nombre="puerta", directorio="agente_puerta", tiempo_espera=5,
+                 token=None):
+        """
+        Inicializa el agente
+
+        Args:
+            url_central (str): URL base del servidor central
+            nombre (str): Nombre de la barrera; prefija las claves de idempotencia
+            directorio (str): Directorio de la réplica, la cola y los conflictos
+            tiempo_espera (float): Segundos máximos de espera por el servidor
+            token (str): Token de administración del servidor, para copiar su estado
+        """
+        self.url_central = url_central.rstrip('/')
+        self.token = token
+        self.nombre = nombre
+        self.tiempo_espera = tiempo_espera
+        self.en_linea = False
+
+        os.makedirs(directorio, exist_ok=True)
+        self.replica = Estacionamiento(nombre=f"Réplica {nombre}",
+                                       archivo_datos=os.path.join(directorio, 'replica.json'),
+                                       modo_persistencia="diario")
+        self.cola = ColaEventos(os.path.join(directorio, 'cola.jsonl'))
+        self.ruta_conflictos = os.path.join(directorio, 'conflictos.jsonl')
+
+        self._lock_envio = threading.Lock()
+        self._despertar = threading.Event()
+
+    def registrar_ingreso(self, placa, tipo_vehiculo, propietario=""):
+        """
+        Registra un ingreso en la réplica y lo encola para el servidor
+
+        Returns:
+            tuple: (éxito, mensaje, espacio_asignado)
+        """
+        return self._registrar({
+            'tipo': 'ingreso',
+            'placa': placa.upper().strip(),
+            'tipo_vehiculo': tipo_vehiculo,
+            'propietario': propietario
+        })
+
+    def registrar_egreso(self, placa):
+        """
+        Registra un egreso en la réplica y lo encola para el servidor
+
+        Returns:
+            tuple: (éxito, mensaje, tarifa_a_pagar)
+        """
+        return self._registrar({'tipo': 'egreso', 'placa': placa.upper().strip()})
+
+    def _registrar(self, evento):
+        evento['id_evento'] = f"{self.nombre}-{uuid.uuid4().hex}"
+        evento['momento'] = datetime.now().isoformat()
+
+        # La cola se escribe antes que la réplica: ante una caída el evento
+        # llega igual al servidor, que es quien manda
+        with self.replica.lote():
+            exito, mensaje, valor = self.replica.procesar_lote([evento])[0]
+            if exito:
+                self.cola.agregar(evento)
+
+        if exito:
+            self._despertar.set()
+        return exito, mensaje, valor
+
+    def _solicitar(self, ruta, datos=None):
+        """Envía una solicitud JSON al servidor central y devuelve la respuesta"""
+        cuerpo = json.dumps(datos).encode('utf-8') if datos is not None else None
+        encabezados = {'Content-Type': 'application/json'}
+        if self.token:
+            encabezados['Authorization'] = f'Bearer {self.token}'
+        solicitud = urllib.request.Request(self.url_central + ruta, data=cuerpo, headers=encabezados)
+        with urllib.request.urlopen(solicitud, timeout=self.tiempo_espera) as respuesta:
+            return json.loads(respuesta.read().decode('utf-8'))
+
+    def _registrar_conflicto(self, evento, mensaje):
+        with open(self.ruta_conflictos, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'evento': evento, 'mensaje': mensaje,
+                                'detectado': datetime.now().isoformat()}, ensure_ascii=False) + '\n')
+
+    def sincronizar(self):
+        """
+        Envía la cola al servidor y, si queda vacía, actualiza la réplica
+
+        Returns:
+            bool: True si se pudo comunicar con el servidor
+        """
+        with self._lock_envio:
+            try:
+                while True:
+                    eventos = self.cola.primeros(EVENTOS_POR_ENVIO)
+                    if not eventos:
+                        break
+                    respuesta = self._solicitar('/api/lote', {'eventos': eventos})
+                    for evento, resultado in zip(eventos, respuesta['resultados']):
+                        if not resultado['success']:
+                            self._registrar_conflicto(evento, resultado['message'])
+                    self.cola.confirmar(len(eventos))
+
+                estado = self._solicitar('/api/replica')
+            except (urllib.error.URLError, OSError, ValueError, KeyError) as e:
+                if self.en_linea:
+                    print(f"Error al sincronizar con {self.url_central}: {e}")
+                self.en_linea = False
+                return False
+
+            # Un evento registrado mientras tanto todavía no está en el servidor
+            with self.replica.lote():
+                if not len(self.cola):
+                    self.replica.reemplazar_estado(estado)
+
+            self.en_linea = True
+            return True
+
+    def iniciar(self, intervalo=5):
+        """
+        Sincroniza en segundo plano cada `intervalo` segundos y después de cada evento
+
+        Args:
+            intervalo (float): Segundos entre intentos
+        """
+        def bucle():
+            while True:
+                self.sincronizar()
+                self._despertar.wait(intervalo)
+                self._despertar.clear()
+
+        threading.Thread(target=bucle, daemon=True).start()
+
+    def cerrar(self):
+        """Intenta un último envío y cierra la réplica"""
+        self.sincronizar()
+        self.replica.cerrar()
+
+
+def main():
+    """Barrera interactiva por consola"""
+    parser = argparse.ArgumentParser(description="Agente de barrera del estacionamiento")
+    parser.add_argument('--central', default='http://localhost:8080', help="URL del servidor central")
+    parser.add_argument('--nombre', default='puerta', help="Nombre de la barrera")
+    parser.add_argument('--directorio', default=None, help="Directorio de datos locales")
+    parser.add_argument('--token', default=os.environ.get('ESTACIONAMIENTO_TOKEN_ADMIN'),
+                        help="Token de administración del servidor central")
+    args = parser.parse_args()
+
+    agente = AgentePuerta(args.central, args.nombre, args.directorio or f"agente_{args.nombre}",
+                          token=args.token)
+    agente.iniciar()
+
+    print(f"🚧 Barrera {args.nombre} conectada a {args.central}")
+    print("Comandos: i PLACA [TIPO] | e PLACA | estado | salir")
+
+    while True:
+        try:
+            partes = input("> ").split()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if not partes:
+            continue
+
+        comando = partes[0].lower()
+        if comando == 'salir':
+            break
+        elif comando == 'estado':
+            print(f"{'En línea' if agente.en_linea else 'Sin conexión'} | "
+                  f"Pendientes: {len(agente.cola)} | "
+                  f"Vehículos: {len(agente.replica.vehiculos_actuales)}")
+        elif comando == 'i' and len(partes) >= 2:
+            exito, mensaje, _ = agente.registrar_ingreso(partes[1], partes[2] if len(partes) > 2 else 'auto')
+            print(f"{'✅' if exito else '❌'} {mensaje}")
+        elif comando == 'e' and len(partes) == 2:
+            exito, mensaje, _ = agente.registrar_egreso(partes[1])
+            print(f"{'✅' if exito else '❌'} {mensaje}")
+        else:
+            print("Comando no válido")
+
+    agente.cerrar()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,773 @@
+"""
+Backends de almacenamiento del Sistema de Estacionamiento
+
+Un backend recibe las mutaciones del estacionamiento como eventos
+('ingreso', 'egreso', 'tarifas', 'abono') y sabe reconstruir el estado al
+iniciar. El estado se intercambia siempre como diccionarios con el mismo
+formato del snapshot JSON, de modo que los backends no dependen de las
+clases del dominio.
+"""
+
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+import json
+import os
+import queue
+import sqlite3
+import threading
+
+from historial import ColumnasHistorial, HistorialSegmentado
+from persistencia import DiarioEventos, PoliticaDurabilidad, ProgramadorGrupal, escribir_atomico
+from snapshot_binario import escribir_snapshot, leer_snapshot
+
+FORMATOS_SNAPSHOT = ('json', 'binario')
+
+
+class Almacenamiento:
+    """Interfaz común de los backends de almacenamiento"""
+
+    def vincular(self, proveedor_estado):
+        """
+        Registra la función que devuelve el estado completo como diccionario
+
+        Args:
+            proveedor_estado (callable): Función sin argumentos que devuelve el snapshot
+        """
+        self.proveedor_estado = proveedor_estado
+
+    def cargar(self):
+        """
+        Lee el estado persistido
+
+        Returns:
+            tuple: (estado, eventos) donde estado es un diccionario con el formato
+            del snapshot (o None si no hay datos) y eventos es un iterable de
+            (secuencia, tipo, datos) posteriores al snapshot
+        """
+        raise NotImplementedError
+
+    def registrar_evento(self, secuencia, tipo, datos):
+        """Persiste una mutación del estado"""
+        raise NotImplementedError
+
+    def guardar_estado(self, estado):
+        """Persiste el estado completo"""
+        raise NotImplementedError
+
+    def consultar_historial(self, limite=20, antes_de=None):
+        """
+        Consulta el historial del más reciente al más antiguo
+
+        Returns:
+            tuple: (registros, cursor_siguiente) o None si el backend no
+            guarda el historial completo y debe usarse el de memoria
+        """
+        return None
+
+    def resumen_historial(self):
+        """
+        Returns:
+            tuple: (cantidad, total_recaudado) o None si el backend no lo soporta
+        """
+        return None
+
+    def columnas_historial(self):
+        """
+        Returns:
+            ColumnasHistorial: Columnas del historial completo para los reportes,
+            o None si el backend no guarda el historial completo
+        """
+        return None
+
+    def placas_historial(self):
+        """
+        Returns:
+            set: Placas de los registros del historial agregados desde la
+            llamada anterior (todas en la primera), o None si el backend no
+            guarda el historial completo
+        """
+        return None
+
+    def salidas_desde(self, desde, atraso_maximo):
+        """
+        Returns:
+            dict: placa -> hora de su última salida, para las placas que
+            salieron a partir de `desde` (ver HistorialSegmentado.salidas_desde),
+            o None si el backend no guarda el historial completo
+        """
+        return None
+
+    def transaccion(self):
+        """
+        Contexto exclusivo entre procesos para verificar y modificar el estado
+
+        Los eventos registrados dentro del contexto se confirman juntos al salir.
+        """
+        return nullcontext()
+
+    def lote(self):
+        """
+        Contexto que agrupa los eventos registrados dentro de él en una sola
+        escritura al salir
+
+        Por defecto cada evento se escribe al registrarse; los backends que
+        ya confirman juntos los eventos de una transacción no necesitan más.
+        """
+        return nullcontext()
+
+    def hay_cambios_externos(self):
+        """Indica si otro proceso modificó los datos desde la última consulta"""
+        return False
+
+    def eventos_desde(self, secuencia):
+        """
+        Eventos confirmados después de una secuencia, para ponerse al día sin
+        recargar todo el estado
+
+        Args:
+            secuencia (int): Último evento aplicado en memoria
+
+        Returns:
+            list: (secuencia, tipo, datos) en orden, o None si no se conservan
+            uno por uno y debe recargarse el estado completo con cargar()
+        """
+        return None
+
+    def cerrar(self):
+        """Libera los recursos del backend"""
+
+
+class AlmacenamientoJSON(Almacenamiento):
+    """
+    Snapshot JSON con diario de eventos opcional
+
+    El historial completo se guarda aparte, en un HistorialSegmentado, para que
+    el snapshot no crezca con la cantidad de egresos.
+    """
+
+    def __init__(self, archivo_datos="estacionamiento_datos.json", modo_persistencia="completo",
+                 durabilidad="siempre", intervalo_grupo_ms=50, formato_snapshot="json"):
+        """
+        Inicializa el backend JSON
+
+        Args:
+            archivo_datos (str): Archivo JSON donde se persisten los datos
+            modo_persistencia (str): 'completo' reescribe el archivo en cada cambio,
+                'diario' anexa cada cambio a un diario y compacta periódicamente
+            durabilidad (str): Política de fsync: 'siempre', 'grupo' o 'sistema'
+            intervalo_grupo_ms (int): Ventana de agrupación para la política 'grupo'
+            formato_snapshot (str): 'json', o 'binario' para guardar el snapshot
+                por columnas en '<archivo>.snapshot' (ver snapshot_binario.py); un
+                snapshot JSON existente se lee y se reemplaza en la próxima escritura
+        """
+        if formato_snapshot not in FORMATOS_SNAPSHOT:
+            raise ValueError(f"Formato de snapshot no válido. Opciones: {list(FORMATOS_SNAPSHOT)}")
+        self.archivo_datos = archivo_datos
+        self.archivo_binario = os.path.splitext(archivo_datos)[0] + ".snapshot"
+        self.formato_snapshot = formato_snapshot
+        self.modo_persistencia = modo_persistencia
+        self.durabilidad = PoliticaDurabilidad(durabilidad, intervalo_grupo_ms)
+        self.proveedor_estado = None
+
+        self.diario = None
+        if modo_persistencia == "diario":
+            self.diario = DiarioEventos(os.path.splitext(archivo_datos)[0] + ".diario.jsonl",
+                                        durabilidad=self.durabilidad)
+
+        # En modo 'completo' con política 'grupo' los snapshots se agrupan por ventana
+        self.programador_snapshots = None
+        if durabilidad == "grupo":
+            self.programador_snapshots = ProgramadorGrupal(intervalo_grupo_ms, self._guardar_snapshot)
+
+        self.historial = HistorialSegmentado(os.path.splitext(archivo_datos)[0] + "_historial",
+                                             durabilidad=self.durabilidad)
+        self._placas_leidas = 0  # Registros del historial ya entregados por placas_historial
+        self._lote = None  # Eventos retenidos por un lote en curso
+
+    def _guardar_snapshot(self):
+        self.guardar_estado(self.proveedor_estado())
+
+    @property
+    def ruta_snapshot(self):
+        """Archivo del snapshot que se lee al cargar"""
+        if self.formato_snapshot == 'binario' and (os.path.exists(self.archivo_binario)
+                                                   or not os.path.exists(self.archivo_datos)):
+            return self.archivo_binario
+        return self.archivo_datos
+
+    def cargar(self):
+        estado = None
+        ruta = self.ruta_snapshot
+        if ruta == self.archivo_binario:
+            if os.path.exists(ruta):
+                with open(ruta, 'rb') as f:
+                    estado = leer_snapshot(f.read())
+        elif os.path.exists(ruta):
+            with open(ruta, 'r', encoding='utf-8') as f:
+                estado = json.load(f)
+
+            # Migración: datos anteriores al historial segmentado
+            if self.historial.cantidad == 0:
+                for registro in estado.get('historial_resumido', []):
+                    self.historial.agregar(registro)
+
+        eventos = self._reconciliar(self.diario.leer()) if self.diario is not None else ()
+        return estado, eventos
+
+    def _reconciliar(self, eventos):
+        """
+        Completa el historial con los egresos del diario que no llegaron a él
+
+        Cada egreso del diario guarda en 'posicion_historial' la posición que
+        ocupa en el historial, así la reproducción nunca duplica registros.
+        """
+        for secuencia, tipo, datos in eventos:
+            if tipo == 'egreso' and datos.get('posicion_historial', self.historial.cantidad) >= self.historial.cantidad:
+                self.historial.agregar(datos)
+            yield secuencia, tipo, datos
+
+    def registrar_evento(self, secuencia, tipo, datos):
+        if self._lote is not None:
+            self._lote.append((secuencia, tipo, datos))
+            return
+        self._escribir_eventos([(secuencia, tipo, datos)])
+
+    @contextmanager
+    def lote(self):
+        if self._lote is not None:
+            yield
+            return
+        self._lote = []
+        try:
+            yield
+        finally:
+            # Lo ya aplicado en memoria se persiste aunque el lote se interrumpa
+            eventos, self._lote = self._lote, None
+            if eventos:
+                self._escribir_eventos(eventos)
+
+    def _escribir_eventos(self, eventos):
+        """Persiste eventos en orden con una escritura por archivo"""
+        registros = []
+        preparados = []
+        for secuencia, tipo, datos in eventos:
+            if tipo == 'egreso':
+                # El diario solo referencia la posición del registro en el historial
+                registros.append(datos)
+                datos = dict(datos, posicion_historial=self.historial.cantidad + len(registros) - 1)
+            preparados.append((secuencia, tipo, datos))
+
+        # El historial se escribe primero
+        if registros:
+            self.historial.agregar_varios(registros)
+
+        if self.diario is None:
+            if self.programador_snapshots is not None:
+                self.programador_snapshots.solicitar()
+            else:
+                self._guardar_snapshot()
+            return
+
+        if self.diario.anexar_varios(preparados):
+            self._guardar_snapshot()
+
+    def guardar_estado(self, estado):
+        # Escritura atómica: nunca deja el archivo truncado ante una caída
+        if self.formato_snapshot == 'binario':
+            escribir_atomico(self.archivo_binario, escribir_snapshot(estado),
+                             sincronizar=self.durabilidad.sincronizar_snapshots)
+            # El snapshot JSON anterior quedó desactualizado: no debe volver a leerse
+            if os.path.exists(self.archivo_datos):
+                os.replace(self.archivo_datos, self.archivo_datos + ".migrado")
+        else:
+            escribir_atomico(self.archivo_datos,
+                             json.dumps(estado, indent=2, ensure_ascii=False),
+                             sincronizar=self.durabilidad.sincronizar_snapshots)
+
+        # El snapshot ya contiene todos los eventos del diario
+        if self.diario is not None:
+            self.diario.truncar()
+
+    def consultar_historial(self, limite=20, antes_de=None):
+        return self.historial.pagina(limite, antes_de)
+
+    def resumen_historial(self):
+        return self.historial.cantidad, self.historial.total_recaudado
+
+    def columnas_historial(self):
+        return self.historial.columnas()
+
+    def placas_historial(self):
+        placas, self._placas_leidas = self.historial.placas(self._placas_leidas)
+        return placas
+
+    def salidas_desde(self, desde, atraso_maximo):
+        return self.historial.salidas_desde(desde, atraso_maximo)
+
+    def cerrar(self):
+        if self.programador_snapshots is not None:
+            self.programador_snapshots.forzar()
+        if self.diario is not None:
+            self.diario.cerrar()
+        self.historial.cerrar()
+        self.durabilidad.vaciar()
+
+
+class AlmacenamientoSQLite(Almacenamiento):
+    """
+    Backend SQLite en modo WAL
+
+    Cada evento es una transacción de pocas filas con sentencias parametrizadas
+    (el módulo sqlite3 las mantiene preparadas en su caché por conexión), y el
+    historial completo queda en disco con índices por placa y por hora.
+
+    Varios procesos pueden compartir la misma base: transaccion() toma el lock
+    de escritura de SQLite (BEGIN IMMEDIATE) y hay_cambios_externos() usa
+    PRAGMA data_version para detectar commits hechos por otras conexiones.
+    Cada evento queda además en la tabla eventos (los últimos
+    `eventos_retenidos`), de donde los otros procesos leen solo lo que les
+    falta, y la cantidad y el total del historial se acumulan en
+    resumen_historial en la misma transacción que cada egreso.
+    """
+
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS configuracion (
+            clave TEXT PRIMARY KEY,
+            valor TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS vehiculos_actuales (
+            placa TEXT PRIMARY KEY,
+            tipo_vehiculo TEXT NOT NULL,
+            propietario TEXT NOT NULL DEFAULT '',
+            hora_entrada TEXT,
+            espacio_asignado INTEGER,
+            version_tarifa INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_vehiculos_entrada ON vehiculos_actuales (hora_entrada);
+        CREATE TABLE IF NOT EXISTS historial (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            placa TEXT NOT NULL,
+            tipo_vehiculo TEXT NOT NULL,
+            propietario TEXT NOT NULL DEFAULT '',
+            hora_entrada TEXT,
+            hora_salida TEXT,
+            espacio_asignado INTEGER,
+            tarifa_pagada REAL NOT NULL DEFAULT 0,
+            version_tarifa INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_historial_placa ON historial (placa);
+        CREATE INDEX IF NOT EXISTS idx_historial_entrada ON historial (hora_entrada);
+        CREATE INDEX IF NOT EXISTS idx_historial_salida ON historial (hora_salida);
+        CREATE TABLE IF NOT EXISTS abonos_mensuales (
+            placa TEXT PRIMARY KEY,
+            propietario TEXT NOT NULL,
+            tipo_vehiculo TEXT NOT NULL,
+            telefono TEXT NOT NULL DEFAULT '',
+            email TEXT NOT NULL DEFAULT '',
+            fecha_inicio TEXT,
+            fecha_vencimiento TEXT,
+            activo INTEGER NOT NULL DEFAULT 1,
+            monto_pagado REAL NOT NULL DEFAULT 0,
+            descuento_aplicado REAL NOT NULL DEFAULT 10
+        );
+        CREATE INDEX IF NOT EXISTS idx_abonos_vencimiento ON abonos_mensuales (fecha_vencimiento);
+        CREATE TABLE IF NOT EXISTS claves_aplicadas (
+            id_evento TEXT PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            placa TEXT NOT NULL,
+            valor NUMERIC
+        );
+        CREATE TABLE IF NOT EXISTS eventos (
+            secuencia INTEGER PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            datos TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS resumen_historial (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            cantidad INTEGER NOT NULL,
+            total REAL NOT NULL
+        );
+    """
+
+    SQL_CONFIGURACION = "INSERT OR REPLACE INTO configuracion (clave, valor) VALUES (?, ?)"
+    SQL_INGRESO = ("INSERT OR REPLACE INTO vehiculos_actuales "
+                   "(placa, tipo_vehiculo, propietario, hora_entrada, espacio_asignado, version_tarifa) "
+                   "VALUES (:placa, :tipo_vehiculo, :propietario, :hora_entrada, :espacio_asignado, "
+                   ":version_tarifa)")
+    SQL_BORRAR_VEHICULO = "DELETE FROM vehiculos_actuales WHERE placa = ?"
+    SQL_HISTORIAL = ("INSERT INTO historial "
+                     "(placa, tipo_vehiculo, propietario, hora_entrada, hora_salida, espacio_asignado, "
+                     "tarifa_pagada, version_tarifa) "
+                     "VALUES (:placa, :tipo_vehiculo, :propietario, :hora_entrada, :hora_salida, "
+                     ":espacio_asignado, :tarifa_pagada, :version_tarifa)")
+    SQL_ABONO = ("INSERT OR REPLACE INTO abonos_mensuales "
+                 "(placa, propietario, tipo_vehiculo, telefono, email, fecha_inicio, fecha_vencimiento, "
+                 "activo, monto_pagado, descuento_aplicado) "
+                 "VALUES (:placa, :propietario, :tipo_vehiculo, :telefono, :email, :fecha_inicio, "
+                 ":fecha_vencimiento, :activo, :monto_pagado, :descuento_aplicado)")
+
+    SQL_CLAVE = "INSERT OR IGNORE INTO claves_aplicadas (id_evento, tipo, placa, valor) VALUES (?, ?, ?, ?)"
+    SQL_EVENTO = "INSERT OR REPLACE INTO eventos (secuencia, tipo, datos) VALUES (?, ?, ?)"
+    SQL_PODAR_EVENTOS = "DELETE FROM eventos WHERE secuencia <= ?"
+    SQL_ACUMULAR = "UPDATE resumen_historial SET cantidad = cantidad + 1, total = total + ? WHERE id = 1"
+    SQL_GENERACION = ("INSERT INTO configuracion (clave, valor) VALUES ('generacion', '1') "
+                      "ON CONFLICT (clave) DO UPDATE SET valor = valor + 1")
+
+    # Nivel de 'synchronous' de SQLite equivalente a cada política de durabilidad
+    SINCRONIZACION = {'siempre': 'FULL', 'grupo': 'NORMAL', 'sistema': 'OFF'}
+
+    def __init__(self, ruta="estacionamiento.db", durabilidad="siempre", historial_en_memoria=100,
+                 claves_en_memoria=10000, eventos_retenidos=10000):
+        """
+        Inicializa el backend SQLite
+
+        Args:
+            ruta (str): Archivo de la base de datos
+            durabilidad (str): 'siempre', 'grupo' o 'sistema'
+            historial_en_memoria (int): Registros recientes del historial que se
+                cargan en memoria al iniciar; el resto se consulta en disco
+            claves_en_memoria (int): Claves de idempotencia más recientes que se
+                cargan en memoria
+            eventos_retenidos (int): Eventos recientes que se conservan para que
+                los otros procesos se pongan al día sin recargar todo
+        """
+        self.ruta = ruta
+        self.historial_en_memoria = historial_en_memoria
+        self.claves_en_memoria = claves_en_memoria
+        self.eventos_retenidos = eventos_retenidos
+        self.proveedor_estado = None
+        self._lock = threading.RLock()
+        self._en_transaccion = False
+        self._version_vista = None  # Último PRAGMA data_version observado
+        self._generacion = None  # Reemplazos completos del estado (guardar_estado) ya vistos
+        self._columnas = ColumnasHistorial()  # Historial ya leído para los reportes
+        self._ultimo_id_columnas = 0
+        self._ultimo_id_placas = 0
+
+        self.conexion = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self.conexion.row_factory = sqlite3.Row
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.execute(f"PRAGMA synchronous={self.SINCRONIZACION[durabilidad]}")
+        self.conexion.executescript(self.ESQUEMA)
+        self._migrar()
+
+    def _migrar(self):
+        """Agrega a una base existente las columnas de versiones posteriores"""
+        for tabla in ('vehiculos_actuales', 'historial'):
+            columnas = {fila['name'] for fila in self.conexion.execute(f"PRAGMA table_info({tabla})")}
+            if 'version_tarifa' not in columnas:
+                self.conexion.execute(f"ALTER TABLE {tabla} ADD COLUMN version_tarifa INTEGER")
+        # El resumen del historial se cuenta una sola vez, en la primera apertura
+        self.conexion.execute(
+            "INSERT OR IGNORE INTO resumen_historial (id, cantidad, total) "
+            "SELECT 1, COUNT(*), COALESCE(SUM(tarifa_pagada), 0) FROM historial "
+            "WHERE NOT EXISTS (SELECT 1 FROM resumen_historial)")
+
+    @contextmanager
+    def transaccion(self):
+        with self._lock:
+            if self._en_transaccion:
+                yield
+                return
+            self.conexion.execute("BEGIN IMMEDIATE")
+            self._en_transaccion = True
+            try:
+                yield
+            except BaseException:
+                self._en_transaccion = False
+                self.conexion.execute("ROLLBACK")
+                raise
+            self._en_transaccion = False
+            self.conexion.execute("COMMIT")
+
+    @contextmanager
+    def _lectura(self):
+        """Contexto en que varias consultas ven la misma versión de la base"""
+        with self._lock:
+            if self._en_transaccion:
+                yield
+                return
+            self.conexion.execute("BEGIN")
+            try:
+                yield
+            finally:
+                self.conexion.execute("COMMIT")
+
+    def _transaccion(self, operaciones):
+        """Ejecuta una lista de (sql, parámetros) en una única transacción"""
+        with self.transaccion():
+            cursor = self.conexion.cursor()
+            for sql, parametros in operaciones:
+                cursor.execute(sql, parametros)
+
+    def hay_cambios_externos(self):
+        # Solo consulta: la versión vista avanza recién cuando cargar() relee el
+        # estado, así otro hilo no puede consumir el aviso antes de la recarga
+        with self._lock:
+            version = self.conexion.execute("PRAGMA data_version").fetchone()[0]
+            return version != self._version_vista
+
+    def eventos_desde(self, secuencia):
+        with self._lock:
+            version = self.conexion.execute("PRAGMA data_version").fetchone()[0]
+            with self._lectura():
+                configuracion = {fila['clave']: json.loads(fila['valor']) for fila in self.conexion.execute(
+                    "SELECT clave, valor FROM configuracion WHERE clave IN ('secuencia', 'generacion')")}
+                filas = self.conexion.execute(
+                    "SELECT secuencia, tipo, datos FROM eventos WHERE secuencia > ? ORDER BY secuencia",
+                    (secuencia,)).fetchall()
+
+            # Hubo un reemplazo completo o faltan eventos ya podados: se recarga todo
+            if configuracion.get('generacion') != self._generacion:
+                return None
+            if [fila['secuencia'] for fila in filas] != list(range(secuencia + 1,
+                                                                   configuracion.get('secuencia', 0) + 1)):
+                return None
+            self._version_vista = version
+            return [(fila['secuencia'], fila['tipo'], json.loads(fila['datos'])) for fila in filas]
+
+    def cargar(self):
+        with self._lock, self._lectura():
+            self._version_vista = self.conexion.execute("PRAGMA data_version").fetchone()[0]
+            configuracion = {fila['clave']: json.loads(fila['valor'])
+                             for fila in self.conexion.execute("SELECT clave, valor FROM configuracion")}
+            self._generacion = configuracion.pop('generacion', None)
+            vehiculos = {fila['placa']: dict(fila)
+                         for fila in self.conexion.execute("SELECT * FROM vehiculos_actuales")}
+            recientes = self.conexion.execute(
+                "SELECT * FROM historial ORDER BY id DESC LIMIT ?", (self.historial_en_memoria,)
+            ).fetchall()
+            abonos = {}
+            for fila in self.conexion.execute("SELECT * FROM abonos_mensuales"):
+                abono = dict(fila)
+                abono['activo'] = bool(abono['activo'])
+                abonos[abono['placa']] = abono
+            claves = self.conexion.execute(
+                "SELECT id_evento, tipo, placa, valor FROM claves_aplicadas ORDER BY rowid DESC LIMIT ?",
+                (self.claves_en_memoria,)
+            ).fetchall()
+
+        if not configuracion and not vehiculos and not recientes and not abonos:
+            return None, ()
+
+        estado = dict(configuracion)
+        estado['vehiculos_actuales'] = vehiculos
+        estado['historial_resumido'] = [self._fila_historial(fila) for fila in reversed(recientes)]
+        estado['abonos_mensuales'] = abonos
+        estado['claves_aplicadas'] = [list(fila) for fila in reversed(claves)]
+        return estado, ()
+
+    def registrar_evento(self, secuencia, tipo, datos):
+        operaciones = [(self.SQL_CONFIGURACION, ('secuencia', json.dumps(secuencia)))]
+
+        if tipo == 'ingreso':
+            operaciones.append((self.SQL_INGRESO, datos))
+        elif tipo == 'egreso':
+            operaciones.append((self.SQL_BORRAR_VEHICULO, (datos['placa'],)))
+            operaciones.append((self.SQL_HISTORIAL, datos))
+            operaciones.append((self.SQL_ACUMULAR, (datos.get('tarifa_pagada', 0),)))
+        elif tipo == 'tarifas':
+            operaciones.append((self.SQL_CONFIGURACION, ('versiones_tarifas', json.dumps(datos['versiones']))))
+        elif tipo == 'abono':
+            operaciones.append((self.SQL_ABONO, datos))
+
+        if datos.get('id_evento'):
+            valor = datos['tarifa_pagada'] if tipo == 'egreso' else datos.get('espacio_asignado')
+            operaciones.append((self.SQL_CLAVE, (datos['id_evento'], tipo, datos['placa'], valor)))
+
+        operaciones.append((self.SQL_EVENTO, (secuencia, tipo, json.dumps(datos))))
+        operaciones.append((self.SQL_PODAR_EVENTOS, (secuencia - self.eventos_retenidos,)))
+
+        self._transaccion(operaciones)
+
+    def guardar_estado(self, estado):
+        """Reemplaza todo el estado actual (el historial no se borra, solo se completa)"""
+        operaciones = [(self.SQL_CONFIGURACION, (clave, json.dumps(estado[clave])))
+                       for clave in ('nombre', 'capacidad_total', 'tarifas', 'versiones_tarifas', 'secuencia')
+                       if clave in estado]
+        operaciones.append(("DELETE FROM vehiculos_actuales", ()))
+        operaciones.extend((self.SQL_INGRESO, vehiculo) for vehiculo in estado['vehiculos_actuales'].values())
+        operaciones.extend((self.SQL_ABONO, abono) for abono in estado['abonos_mensuales'].values())
+        operaciones.extend((self.SQL_CLAVE, tuple(clave)) for clave in estado.get('claves_aplicadas', []))
+
+        with self._lock:
+            vacio = self.conexion.execute("SELECT COUNT(*) FROM historial").fetchone()[0] == 0
+        if vacio:
+            # Migración desde otro backend: se importa el historial disponible
+            for registro in estado.get('historial_resumido', []):
+                operaciones.append((self.SQL_HISTORIAL, {'version_tarifa': None, **registro}))
+                operaciones.append((self.SQL_ACUMULAR, (registro.get('tarifa_pagada', 0),)))
+
+        # Los otros procesos no pueden ponerse al día evento por evento: recargan todo
+        operaciones.append(("DELETE FROM eventos", ()))
+        operaciones.append((self.SQL_GENERACION, ()))
+
+        with self._lock:
+            self._transaccion(operaciones)
+            self._generacion = json.loads(self.conexion.execute(
+                "SELECT valor FROM configuracion WHERE clave = 'generacion'").fetchone()[0])
+
+    @staticmethod
+    def _fila_historial(fila):
+        registro = dict(fila)
+        registro.pop('id', None)
+        return registro
+
+    def consultar_historial(self, limite=20, antes_de=None):
+        with self._lock:
+            if antes_de is None:
+                filas = self.conexion.execute(
+                    "SELECT * FROM historial ORDER BY id DESC LIMIT ?", (limite,)).fetchall()
+            else:
+                filas = self.conexion.execute(
+                    "SELECT * FROM historial WHERE id < ? ORDER BY id DESC LIMIT ?", (antes_de, limite)).fetchall()
+
+        cursor_siguiente = filas[-1]['id'] if filas and len(filas) == limite else None
+        return [self._fila_historial(fila) for fila in filas], cursor_siguiente
+
+    def resumen_historial(self):
+        # Acumulado en cada egreso, en la misma transacción (ver SQL_ACUMULAR)
+        with self._lock:
+            return tuple(self.conexion.execute(
+                "SELECT cantidad, total FROM resumen_historial WHERE id = 1").fetchone())
+
+    def columnas_historial(self):
+        # Solo se leen las filas nuevas desde la consulta anterior
+        with self._lock:
+            filas = self.conexion.execute(
+                "SELECT id, hora_entrada, hora_salida, tipo_vehiculo, tarifa_pagada "
+                "FROM historial WHERE id > ? ORDER BY id", (self._ultimo_id_columnas,)).fetchall()
+            for fila in filas:
+                self._columnas.agregar(dict(fila))
+            if filas:
+                self._ultimo_id_columnas = filas[-1]['id']
+            return self._columnas.copia()
+
+    def placas_historial(self):
+        # Solo las filas nuevas desde la consulta anterior, incluidas las de otros procesos
+        with self._lock:
+            filas = self.conexion.execute(
+                "SELECT id, placa FROM historial WHERE id > ? ORDER BY id", (self._ultimo_id_placas,)).fetchall()
+            if filas:
+                self._ultimo_id_placas = filas[-1]['id']
+            return {fila['placa'] for fila in filas}
+
+    def salidas_desde(self, desde, atraso_maximo):
+        # El índice por hora de salida evita recorrer el historial
+        with self._lock:
+            filas = self.conexion.execute(
+                "SELECT placa, MAX(hora_salida) AS salida FROM historial WHERE hora_salida >= ? GROUP BY placa",
+                (desde.isoformat(),)).fetchall()
+        return {fila['placa']: datetime.fromisoformat(fila['salida']) for fila in filas}
+
+    def cerrar(self):
+        with self._lock:
+            self.conexion.close()
+
+
+class AlmacenamientoDiferido(Almacenamiento):
+    """
+    Envoltorio que escribe en segundo plano
+
+    registrar_evento y guardar_estado solo encolan la escritura; un hilo
+    escritor la hace después, agrupando en un lote del backend envuelto todos
+    los eventos que se acumularon mientras tanto. Quien modifica el estado no
+    espera al disco.
+
+    A cambio, lo confirmado en los últimos milisegundos puede perderse si el
+    proceso cae antes de que el escritor lo alcance, y no hay transacciones
+    entre procesos: se usa con un solo proceso (ver app_asgi.py).
+    """
+
+    def __init__(self, backend):
+        """
+        Inicializa el envoltorio y arranca el hilo escritor
+
+        Args:
+            backend (Almacenamiento): Backend que hace las escrituras
+        """
+        self.backend = backend
+        self._cola = queue.Queue()  # ('evento' | 'estado' | 'cerrar', datos)
+        self._cerrado = False
+        self._hilo = threading.Thread(target=self._escribir, name="escritor-estacionamiento", daemon=True)
+        self._hilo.start()
+
+    def _escribir(self):
+        while True:
+            pendientes = [self._cola.get()]
+            while True:
+                try:
+                    pendientes.append(self._cola.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._aplicar(pendientes)
+            except Exception as e:
+                print(f"Error al guardar datos: {e}")
+            finally:
+                for _ in pendientes:
+                    self._cola.task_done()
+
+            if pendientes[-1][0] == 'cerrar':
+                return
+
+    def _aplicar(self, pendientes):
+        """Escribe en orden; los eventos seguidos van juntos en un lote"""
+        i = 0
+        while i < len(pendientes):
+            clase, datos = pendientes[i]
+            if clase != 'evento':
+                if clase == 'estado':
+                    self.backend.guardar_estado(datos)
+                i += 1
+                continue
+            with self.backend.lote():
+                while i < len(pendientes) and pendientes[i][0] == 'evento':
+                    self.backend.registrar_evento(*pendientes[i][1])
+                    i += 1
+
+    def vaciar(self):
+        """Espera a que se escriba todo lo encolado"""
+        self._cola.join()
+
+    def vincular(self, proveedor_estado):
+        self.backend.vincular(proveedor_estado)
+
+    def cargar(self):
+        return self.backend.cargar()
+
+    def registrar_evento(self, secuencia, tipo, datos):
+        self._cola.put(('evento', (secuencia, tipo, datos)))
+
+    def guardar_estado(self, estado):
+        self._cola.put(('estado', estado))
+
+    def consultar_historial(self, limite=20, antes_de=None):
+        self.vaciar()  # Los egresos encolados también deben aparecer
+        return self.backend.consultar_historial(limite, antes_de)
+
+    def resumen_historial(self):
+        self.vaciar()
+        return self.backend.resumen_historial()
+
+    def columnas_historial(self):
+        self.vaciar()
+        return self.backend.columnas_historial()
+
+    def salidas_desde(self, desde, atraso_maximo):
+        self.vaciar()
+        return self.backend.salidas_desde(desde, atraso_maximo)
+
+    def placas_historial(self):
+        # Sin esperar la cola: las placas de los egresos encolados ya están en el
+        # índice en memoria del estacionamiento
+        return self.backend.placas_historial()
+
+    def cerrar(self):
+        if self._cerrado:
+            return
+        self._cerrado = True
+        self._cola.put(('cerrar', None))
+        self._hilo.join()
+        self.backend.cerrar()
@@ -0,0 +1,256 @@
+"""
+Analítica del historial del Sistema de Estacionamiento
+
+Reportes de recaudación, permanencia y ocupación calculados en bloque sobre
+las columnas del historial (ver historial.ColumnasHistorial). Cada columna
+es un arreglo contiguo que NumPy lee sin copiarlo, y los cálculos son
+operaciones vectorizadas: agrupar es un bincount y la ocupación en el tiempo
+sale de búsquedas binarias sobre las entradas y salidas ordenadas, sin
+recorrer registro por registro. Un historial de millones de registros se
+resume en décimas de segundo.
+
+Las horas son locales, igual que en el resto del sistema.
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from snapshot_binario import a_microsegundos, desde_microsegundos
+
+MICRO_SEGUNDO = 1_000_000
+MICRO_HORA = 3600 * MICRO_SEGUNDO
+MICRO_DIA = 24 * MICRO_HORA
+
+DIAS_SEMANA = ('lunes', 'martes', 'miércoles', 'jueves', 'viernes', 'sábado', 'domingo')
+_JUEVES = 3  # El 1 de enero de 1970 fue jueves
+
+_NULO = np.iinfo(np.int64).min  # Fecha ausente (ver snapshot_binario)
+
+
+def _arreglos(columnas):
+    """Vistas NumPy de las columnas, sin copiarlas"""
+    return (np.frombuffer(columnas.entrada, dtype=np.int64),
+            np.frombuffer(columnas.salida, dtype=np.int64),
+            np.frombuffer(columnas.tipo, dtype=np.uint8),
+            np.frombuffer(columnas.tarifa, dtype=np.float64))
+
+
+def _en_rango(valores, desde, hasta):
+    """Máscara de las fechas (en microsegundos) dentro de [desde, hasta)"""
+    mascara = valores != _NULO
+    if desde is not None:
+        mascara &= valores >= a_microsegundos(desde)
+    if hasta is not None:
+        mascara &= valores < a_microsegundos(hasta)
+    return mascara
+
+
+def _fecha_iso(microsegundos):
+    return desde_microsegundos(int(microsegundos)).isoformat()
+
+
+def recaudacion(columnas, desde=None, hasta=None):
+    """
+    Recaudación de los egresos entre dos fechas, por día, hora y tipo
+
+    Args:
+        columnas (ColumnasHistorial): Columnas del historial
+        desde (datetime): Primera salida incluida (None para el comienzo)
+        hasta (datetime): Salidas anteriores a esta fecha (None para todas)
+
+    Returns:
+        dict: Totales generales y agrupados, con la cantidad de egresos de cada grupo
+    """
+    entrada, salida, tipo, tarifa = _arreglos(columnas)
+    mascara = _en_rango(salida, desde, hasta) & (entrada != _NULO)
+    salida, tipo, tarifa = salida[mascara], tipo[mascara], tarifa[mascara]
+
+    dias = salida // MICRO_DIA
+    primer_dia = int(dias.min()) if len(dias) else 0
+    por_dia = np.bincount(dias - primer_dia, weights=tarifa)
+    egresos_dia = np.bincount(dias - primer_dia)
+    con_egresos = np.flatnonzero(egresos_dia)
+
+    horas = (salida // MICRO_HORA) % 24
+    por_hora = np.bincount(horas, weights=tarifa, minlength=24)
+    egresos_hora = np.bincount(horas, minlength=24)
+
+    tipos = columnas.tipos.textos
+    por_tipo = np.bincount(tipo, weights=tarifa, minlength=len(tipos))
+    egresos_tipo = np.bincount(tipo, minlength=len(tipos))
+
+    return {
+        'egresos': int(len(tarifa)),
+        'total': float(tarifa.sum()),
+        'por_dia': [{'fecha': desde_microsegundos((primer_dia + int(i)) * MICRO_DIA).date().isoformat(),
+                     'egresos': int(egresos_dia[i]), 'total': float(por_dia[i])}
+                    for i in con_egresos],
+        'por_hora': [{'hora': hora, 'egresos': int(egresos_hora[hora]), 'total': float(por_hora[hora])}
+                     for hora in range(24)],
+        'por_tipo': {nombre: {'egresos': int(egresos_tipo[i]), 'total': float(por_tipo[i])}
+                     for i, nombre in enumerate(tipos) if egresos_tipo[i]}
+    }
+
+
+def permanencia(columnas, desde=None, hasta=None):
+    """
+    Tiempo de permanencia de los vehículos que salieron entre dos fechas
+
+    Args:
+        columnas (ColumnasHistorial): Columnas del historial
+        desde (datetime): Primera salida incluida (None para el comienzo)
+        hasta (datetime): Salidas anteriores a esta fecha (None para todas)
+
+    Returns:
+        dict: Promedio, mediana, percentil 90 y máximo en minutos, y promedio por tipo
+    """
+    entrada, salida, tipo, _ = _arreglos(columnas)
+    mascara = _en_rango(salida, desde, hasta) & (entrada != _NULO)
+    minutos = (salida[mascara] - entrada[mascara]) / (60 * MICRO_SEGUNDO)
+    tipo = tipo[mascara]
+
+    if not len(minutos):
+        return {'egresos': 0, 'promedio_minutos': 0, 'mediana_minutos': 0,
+                'percentil_90_minutos': 0, 'maximo_minutos': 0, 'por_tipo': {}}
+
+    tipos = columnas.tipos.textos
+    suma_tipo = np.bincount(tipo, weights=minutos, minlength=len(tipos))
+    egresos_tipo = np.bincount(tipo, minlength=len(tipos))
+    mediana, percentil_90 = np.percentile(minutos, [50, 90])
+
+    return {
+        'egresos': int(len(minutos)),
+        'promedio_minutos': float(minutos.mean()),
+        'mediana_minutos': float(mediana),
+        'percentil_90_minutos': float(percentil_90),
+        'maximo_minutos': float(minutos.max()),
+        'por_tipo': {nombre: {'egresos': int(egresos_tipo[i]),
+                              'promedio_minutos': float(suma_tipo[i] / egresos_tipo[i])}
+                     for i, nombre in enumerate(tipos) if egresos_tipo[i]}
+    }
+
+
+def _ocupacion(columnas, inicio, intervalos, paso, entradas_actuales, ahora):
+    """
+    Ocupación al comienzo de cada intervalo y promedio dentro de él
+
+    Con las entradas y salidas ordenadas, la cantidad de vehículos presentes
+    en un instante t es (entradas antes de t) - (salidas antes de t), y el
+    tiempo-vehículo acumulado hasta t es
+        t·Ne(t) - ΣE(t) - t·Ns(t) + ΣS(t)
+    donde ΣE y ΣS suman las entradas y salidas anteriores a t. Ambas cosas
+    salen de búsquedas binarias y sumas acumuladas, para todos los bordes de
+    intervalo a la vez.
+
+    Args:
+        inicio (int): Comienzo del primer intervalo, en microsegundos
+        intervalos (int): Cantidad de intervalos
+        paso (int): Duración de cada intervalo, en microsegundos
+        entradas_actuales (iterable): Hora de entrada de los vehículos que siguen dentro
+        ahora (datetime): Salida supuesta de los vehículos que siguen dentro
+
+    Returns:
+        tuple: (presentes al comienzo, promedio) como arreglos de largo intervalos
+    """
+    entrada, salida, _, _ = _arreglos(columnas)
+    validos = (entrada != _NULO) & (salida != _NULO)
+    actuales = np.array([a_microsegundos(fecha) for fecha in entradas_actuales], dtype=np.int64)
+    entrada = np.concatenate([entrada[validos], actuales])
+    salida = np.concatenate([salida[validos], np.full(len(actuales), a_microsegundos(ahora), dtype=np.int64)])
+
+    # Solo cuentan las estadías que se superponen con el período
+    fin = inicio + intervalos * paso
+    superpuestas = (entrada < fin) & (salida > inicio)
+
+    # Segundos relativos al inicio: las sumas acumuladas no desbordan
+    entradas = np.sort((entrada[superpuestas] - inicio) / MICRO_SEGUNDO)
+    salidas = np.sort((salida[superpuestas] - inicio) / MICRO_SEGUNDO)
+    suma_entradas = np.concatenate([[0.0], np.cumsum(entradas)])
+    suma_salidas = np.concatenate([[0.0], np.cumsum(salidas)])
+
+    bordes = np.arange(intervalos + 1) * (paso / MICRO_SEGUNDO)
+    n_entradas = np.searchsorted(entradas, bordes)
+    n_salidas = np.searchsorted(salidas, bordes)
+
+    acumulado = (bordes * n_entradas - suma_entradas[n_entradas]
+                 - bordes * n_salidas + suma_salidas[n_salidas])
+    presentes = (n_entradas - n_salidas)[:-1]
+    promedio = np.diff(acumulado) / (paso / MICRO_SEGUNDO)
+    return presentes, promedio
+
+
+def ocupacion(columnas, desde, hasta, intervalo=timedelta(hours=1), entradas_actuales=(), ahora=None):
+    """
+    Curva de ocupación entre dos fechas
+
+    Args:
+        columnas (ColumnasHistorial): Columnas del historial
+        desde (datetime): Comienzo del período
+        hasta (datetime): Fin del período
+        intervalo (timedelta): Duración de cada punto de la curva
+        entradas_actuales (iterable): Hora de entrada de los vehículos que siguen dentro
+        ahora (datetime): Momento actual (por defecto, ahora)
+
+    Returns:
+        dict: Un punto por intervalo con los vehículos presentes al comienzo y
+        la ocupación promedio del intervalo
+    """
+    inicio = a_microsegundos(desde)
+    paso = intervalo // timedelta(microseconds=1)
+    intervalos = max(0, -(-(a_microsegundos(hasta) - inicio) // paso))
+    presentes, promedio = _ocupacion(columnas, inicio, intervalos, paso, entradas_actuales,
+                                     ahora or datetime.now())
+
+    return {
+        'desde': _fecha_iso(inicio),
+        'intervalo_minutos': paso / (60 * MICRO_SEGUNDO),
+        'maximo_promedio': float(promedio.max()) if intervalos else 0,
+        'puntos': [{'inicio': _fecha_iso(inicio + i * paso),
+                    'presentes': int(presentes[i]), 'promedio': round(float(promedio[i]), 2)}
+                   for i in range(intervalos)]
+    }
+
+
+
+def mapa_calor(columnas, desde, hasta, entradas_actuales=(), ahora=None):
+    """
+    Llegadas y ocupación promedio por día de la semana y hora del día
+
+    Args:
+        columnas (ColumnasHistorial): Columnas del historial
+        desde (datetime): Comienzo del período (se redondea a la hora)
+        hasta (datetime): Fin del período
+        entradas_actuales (iterable): Hora de entrada de los vehículos que siguen dentro
+        ahora (datetime): Momento actual (por defecto, ahora)
+
+    Returns:
+        dict: Matrices de 7 días (lunes primero) por 24 horas y la hora pico
+    """
+    inicio = a_microsegundos(desde) // MICRO_HORA * MICRO_HORA
+    intervalos = max(0, -(-(a_microsegundos(hasta) - inicio) // MICRO_HORA))
+    _, promedio = _ocupacion(columnas, inicio, intervalos, MICRO_HORA, entradas_actuales,
+                             ahora or datetime.now())
+
+    # Casilla (día de la semana, hora) de cada hora del período
+    horas = inicio // MICRO_HORA + np.arange(intervalos)
+    casillas = ((horas // 24 + _JUEVES) % 7) * 24 + horas % 24
+    horas_por_casilla = np.bincount(casillas, minlength=7 * 24)
+    ocupacion_casilla = np.bincount(casillas, weights=promedio, minlength=7 * 24)
+    ocupacion_casilla = np.divide(ocupacion_casilla, horas_por_casilla,
+                                  out=np.zeros(7 * 24), where=horas_por_casilla > 0)
+
+    entrada = np.concatenate([np.frombuffer(columnas.entrada, dtype=np.int64),
+                              np.array([a_microsegundos(fecha) for fecha in entradas_actuales],
+                                       dtype=np.int64)])
+    entrada = entrada[_en_rango(entrada, desde, hasta)] // MICRO_HORA
+    llegadas = np.bincount(((entrada // 24 + _JUEVES) % 7) * 24 + entrada % 24, minlength=7 * 24)
+
+    pico = int(ocupacion_casilla.argmax())
+    return {
+        'dias': list(DIAS_SEMANA),
+        'llegadas': llegadas.reshape(7, 24).tolist(),
+        'ocupacion': np.round(ocupacion_casilla, 2).reshape(7, 24).tolist(),
+        'hora_pico': {'dia': DIAS_SEMANA[pico // 24], 'hora': pico % 24,
+                      'ocupacion': round(float(ocupacion_casilla[pico]), 2)}
+    }
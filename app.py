@@ -3,32 +3,179 @@ Aplicación Web del Sistema de Gestión de Estacionamiento
 Usando Flask para crear una interfaz web
 """
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
-from datetime import datetime
+from flask import (Flask, render_template, request, jsonify, redirect, url_for, flash, stream_template,
+                   Response, stream_with_context, g)
+from werkzeug.local import LocalProxy
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import hmac
 import json
 import os
+import threading
+import time
 
 # Importar nuestras clases del sistema de estacionamiento
-from estacionamiento import Estacionamiento, Vehiculo, AbonoMensual
+from estacionamiento import Estacionamiento, Vehiculo, AbonoMensual, hora_local
+from almacenamiento import AlmacenamientoDiferido, AlmacenamientoJSON, AlmacenamientoSQLite
+from instrumentacion import REGISTRO
+from perfilador import PerfiladorMuestreo
+from sitios import SITIO_PRINCIPAL, DespachoSitios, RegistroSitios, ruta_fragmento
+
+# Los reportes de /api/analitica usan NumPy; sin él, el resto de la aplicación funciona
+try:
+    import analitica
+except ImportError:
+    analitica = None
 
 app = Flask(__name__)
 app.secret_key = 'estacionamiento_secret_key_2025'
 
-# Instancia global del estacionamiento
-estacionamiento = Estacionamiento(capacidad_total=50, nombre="Estacionamiento Web")
+# Estacionamientos atendidos por el proceso. Con ESTACIONAMIENTO_SITIOS se leen
+# de un archivo JSON (ver sitios.py) y cada sitio se atiende en /sitios/<id>/...;
+# sin él hay un solo sitio con los archivos de siempre. Con ESTACIONAMIENTO_DB
+# se usa una base SQLite compartida, lo que permite correr varios procesos
+# (ver gunicorn.conf.py)
+ruta_base_datos = os.environ.get('ESTACIONAMIENTO_DB')
+archivo_sitios = os.environ.get('ESTACIONAMIENTO_SITIOS')
+
+# Atraso máximo aceptado en la hora que informan las barreras, en horas (por
+# defecto Estacionamiento.MAX_ATRASO_EVENTO)
+if os.environ.get('ESTACIONAMIENTO_MAX_ATRASO_HORAS'):
+    Estacionamiento.MAX_ATRASO_EVENTO = timedelta(hours=float(os.environ['ESTACIONAMIENTO_MAX_ATRASO_HORAS']))
+
+def crear_almacenamiento(id_sitio):
+    """Backend del fragmento de almacenamiento de un sitio"""
+    if ruta_base_datos:
+        almacenamiento = AlmacenamientoSQLite(ruta_fragmento(ruta_base_datos, id_sitio) if archivo_sitios
+                                              else ruta_base_datos)
+    else:
+        # El diario y el snapshot binario se activan con ESTACIONAMIENTO_PERSISTENCIA=diario
+        # y ESTACIONAMIENTO_FORMATO_SNAPSHOT=binario; el binario migra el JSON existente
+        archivo_datos = "estacionamiento_datos.json"
+        almacenamiento = AlmacenamientoJSON(ruta_fragmento(archivo_datos, id_sitio) if archivo_sitios
+                                            else archivo_datos,
+                                            modo_persistencia=os.environ.get('ESTACIONAMIENTO_PERSISTENCIA',
+                                                                             'completo'),
+                                            formato_snapshot=os.environ.get('ESTACIONAMIENTO_FORMATO_SNAPSHOT',
+                                                                            'json'))
+    
+    # Con ESTACIONAMIENTO_ESCRITURA_DIFERIDA las escrituras se hacen en segundo
+    # plano; solo para un proceso (ver app_asgi.py)
+    if os.environ.get('ESTACIONAMIENTO_ESCRITURA_DIFERIDA'):
+        almacenamiento = AlmacenamientoDiferido(almacenamiento)
+    return almacenamiento
+
+if archivo_sitios:
+    sitios = RegistroSitios.desde_archivo(archivo_sitios, crear_almacenamiento)
+else:
+    sitios = RegistroSitios(crear_almacenamiento)
+    sitios.agregar(SITIO_PRINCIPAL, "Estacionamiento Web", capacidad_total=50)
+app.wsgi_app = DespachoSitios(app.wsgi_app, sitios)
+
+# Estacionamiento del sitio de la solicitud en curso (ver seleccionar_sitio)
+estacionamiento = LocalProxy(lambda: g.estacionamiento)
+
+# Estado actual de cada sitio expuesto en /metrics; se lee de los contadores en vivo
+for id_sitio, estacionamiento_sitio in sitios.items():
+    REGISTRO.medidor('estacionamiento_ocupados', 'Vehículos estacionados',
+                     lambda e=estacionamiento_sitio: e.metricas.ocupados, sitio=id_sitio)
+    REGISTRO.medidor('estacionamiento_capacidad', 'Capacidad total',
+                     lambda e=estacionamiento_sitio: e.metricas.capacidad_total, sitio=id_sitio)
+    REGISTRO.medidor('estacionamiento_recaudado', 'Total recaudado por egresos',
+                     lambda e=estacionamiento_sitio: e.metricas.recaudado, sitio=id_sitio)
+    REGISTRO.medidor('estacionamiento_version', 'Versión del estado (eventos persistidos)',
+                     lambda e=estacionamiento_sitio: e.version, sitio=id_sitio)
+
+@app.before_request
+def seleccionar_sitio():
+    """Toma el estacionamiento del sitio de la URL (ver sitios.DespachoSitios)"""
+    g.id_sitio = request.environ.get(DespachoSitios.CLAVE, sitios.principal)
+    g.estacionamiento = sitios.obtener(g.id_sitio)
+
+@contextmanager
+def contexto_sitio(id_sitio):
+    """Contexto de aplicación con el estacionamiento de un sitio, fuera de una solicitud"""
+    with app.app_context():
+        g.id_sitio = id_sitio
+        g.estacionamiento = sitios.obtener(id_sitio)
+        yield g.estacionamiento
+
+@app.context_processor
+def datos_sitio():
+    """Sitio actual y lista de sitios para la barra de navegación"""
+    return {'sitio_actual': g.get('id_sitio'), 'sitios': sitios}
+
+# Histograma y contadores de cada ruta, por endpoint y método o código; se
+# crean con la primera solicitud y después solo se buscan
+histogramas_rutas = {}  # endpoint -> método -> Histograma
+respuestas_rutas = {}  # endpoint -> código -> Contador
+
+@app.before_request
+def iniciar_medicion():
+    """Marca el comienzo de la solicitud (se registra en registrar_medicion)"""
+    g.inicio_solicitud = time.perf_counter()
+
+@app.after_request
+def registrar_medicion(respuesta):
+    """Registra la duración y el código de la respuesta de cada ruta"""
+    inicio = g.get('inicio_solicitud')
+    if inicio is None:
+        return respuesta
+    duracion = time.perf_counter() - inicio
+    endpoint = request.endpoint or 'sin_ruta'
+    
+    histograma = histogramas_rutas.get(endpoint, {}).get(request.method)
+    if histograma is None:
+        histograma = histogramas_rutas.setdefault(endpoint, {})[request.method] = REGISTRO.histograma(
+            'estacionamiento_http_segundos', 'Duración de las solicitudes HTTP (hasta el primer byte)',
+            ruta=endpoint, metodo=request.method)
+    histograma.observar(duracion)
+    
+    contador = respuestas_rutas.get(endpoint, {}).get(respuesta.status_code)
+    if contador is None:
+        contador = respuestas_rutas.setdefault(endpoint, {})[respuesta.status_code] = REGISTRO.contador(
+            'estacionamiento_http_respuestas_total', 'Respuestas HTTP por ruta y código',
+            ruta=endpoint, codigo=respuesta.status_code)
+    contador.incrementar()
+    return respuesta
+
+# Perfilador por muestreo, desactivado hasta que se lo active desde
+# /admin/perfilador; las rutas de administración requieren el token de
+# ESTACIONAMIENTO_TOKEN_ADMIN (sin él, quedan deshabilitadas)
+perfilador = PerfiladorMuestreo()
+token_admin = os.environ.get('ESTACIONAMIENTO_TOKEN_ADMIN')
+
+@app.before_request
+def perfilar_solicitud():
+    """Registra la solicitud en el perfilador si está activo y la elige"""
+    if perfilador.activo and request.url_rule is not None:
+        perfilador.comenzar(request.url_rule.rule)
+
+@app.teardown_request
+def terminar_perfil(error=None):
+    """Quita la solicitud del perfilador al terminar, aun si falló"""
+    if perfilador.activo:
+        perfilador.terminar()
+
+@app.before_request
+def sincronizar_estado():
+    """Recarga el estado si otro proceso lo modificó (solo con backend compartido)"""
+    estacionamiento.sincronizar()
 
 @app.route('/')
 def index():
     """Página principal con el dashboard"""
+    metricas = estacionamiento.obtener_metricas()
     estado = {
         'nombre': estacionamiento.nombre,
-        'capacidad_total': estacionamiento.capacidad_total,
-        'ocupados': len(estacionamiento.vehiculos_actuales),
-        'disponibles': estacionamiento.espacios_disponibles(),
-        'porcentaje_ocupacion': (len(estacionamiento.vehiculos_actuales) / estacionamiento.capacidad_total) * 100,
+        'capacidad_total': metricas['capacidad_total'],
+        'ocupados': metricas['ocupados'],
+        'disponibles': metricas['disponibles'],
+        'porcentaje_ocupacion': metricas['porcentaje_ocupacion'],
         'vehiculos_actuales': list(estacionamiento.vehiculos_actuales.values()),
         'tarifas': estacionamiento.tarifas,
-        'estadisticas_abonos': estacionamiento.obtener_estadisticas_abonos()
+        'estadisticas_abonos': estacionamiento.obtener_estadisticas_abonos(),
+        'ocupacion_por_pool': estacionamiento.ocupacion_por_pool()
     }
     return render_template('index.html', estado=estado)
 
@@ -39,8 +186,9 @@ def ingresar_vehiculo():
         placa = request.form.get('placa', '').strip()
         tipo_vehiculo = request.form.get('tipo_vehiculo', '').strip()
         propietario = request.form.get('propietario', '').strip()
+        nivel = request.form.get('nivel', type=int)
         
-        exito, mensaje, espacio = estacionamiento.registrar_ingreso(placa, tipo_vehiculo, propietario)
+        exito, mensaje, espacio = estacionamiento.registrar_ingreso(placa, tipo_vehiculo, propietario, nivel)
         
         if exito:
             flash(f'✅ {mensaje}', 'success')
@@ -49,7 +197,8 @@ def ingresar_vehiculo():
         
         return redirect(url_for('index'))
     
-    return render_template('ingresar.html', tarifas=estacionamiento.tarifas)
+    niveles = sorted({pool['nivel'] for pool in estacionamiento.ocupacion_por_pool()})
+    return render_template('ingresar.html', tarifas=estacionamiento.tarifas, niveles=niveles)
 
 @app.route('/egresar', methods=['GET', 'POST'])
 def egresar_vehiculo():
@@ -83,22 +232,19 @@ def egresar_rapido():
                 'message': 'Placa es requerida'
             }), 400
         
-        # Verificar que el vehículo existe
-        if placa not in estacionamiento.vehiculos_actuales:
+        # Verificar que el vehículo existe (una sola lectura: otro hilo puede egresarlo)
+        vehiculo = estacionamiento.vehiculos_actuales.get(placa.upper())
+        if vehiculo is None:
             return jsonify({
                 'success': False,
                 'message': f'Vehículo {placa} no encontrado en el estacionamiento'
             }), 404
         
-        # Obtener información del vehículo antes del egreso
-        vehiculo = estacionamiento.vehiculos_actuales[placa]
-        tiempo_permanencia = vehiculo.calcular_tiempo_permanencia()
-        tarifa_calculada = estacionamiento.calcular_tarifa(vehiculo)
-        
-        # Procesar egreso
+        # Procesar egreso; si otra terminal lo egresó antes, registrar_egreso lo rechaza
         exito, mensaje, tarifa = estacionamiento.registrar_egreso(placa)
         
         if exito:
+            tiempo_permanencia = vehiculo.calcular_tiempo_permanencia()
             horas = int(tiempo_permanencia.total_seconds() // 3600)
             minutos = int((tiempo_permanencia.total_seconds() % 3600) // 60)
             
@@ -126,6 +272,46 @@ def egresar_rapido():
             'message': f'Error interno: {str(e)}'
         }), 500
 
+MAX_EVENTOS_LOTE = 1000  # Eventos por solicitud de /api/lote
+
+@app.route('/api/lote', methods=['POST'])
+def api_lote():
+    """
+    Ingresos y egresos en lote, para las barreras que acumulan lecturas de placas
+    
+    Recibe un JSON como
+    {"eventos": [{"tipo": "ingreso", "placa": "ABC123", "tipo_vehiculo": "auto",
+                  "momento": "2025-10-01T08:15:00"},
+                 {"tipo": "egreso", "placa": "XYZ789", "momento": "2025-10-01T08:16:30"}]}
+    y aplica los eventos en el orden recibido, usando "momento" como hora de
+    entrada o salida, con una sola escritura al final. Devuelve el resultado de
+    cada evento en el mismo orden.
+    """
+    datos = request.get_json(silent=True)
+    eventos = datos.get('eventos') if isinstance(datos, dict) else datos
+    if not isinstance(eventos, list):
+        return jsonify({'success': False, 'message': 'Se esperaba una lista de eventos'}), 400
+    if len(eventos) > MAX_EVENTOS_LOTE:
+        return jsonify({
+            'success': False,
+            'message': f'Se admiten hasta {MAX_EVENTOS_LOTE} eventos por solicitud'
+        }), 413
+    
+    resultados = []
+    for indice, (evento, (exito, mensaje, valor)) in enumerate(
+            zip(eventos, estacionamiento.procesar_lote(eventos))):
+        resultado = {'indice': indice, 'success': exito, 'message': mensaje}
+        if exito:
+            resultado['espacio' if evento['tipo'] == 'ingreso' else 'tarifa'] = valor
+        resultados.append(resultado)
+    
+    return jsonify({
+        'procesados': len(resultados),
+        'exitosos': sum(1 for r in resultados if r['success']),
+        'version': estacionamiento.version,
+        'resultados': resultados
+    })
+
 @app.route('/consultar', methods=['GET', 'POST'])
 def consultar_vehiculo():
     """Consultar información de un vehículo"""
@@ -157,17 +343,23 @@ def consultar_vehiculo():
 
 @app.route('/historial')
 def ver_historial():
-    """Ver el historial de vehículos"""
-    # Obtener los últimos 20 registros del historial
-    historial_reciente = estacionamiento.historial[-20:] if estacionamiento.historial else []
+    """Ver el historial de vehículos, por páginas del más reciente al más antiguo"""
+    limite = max(1, min(request.args.get('limite', 50, type=int), 500))
+    antes_de = request.args.get('antes_de', type=int)
+    
+    historial_pagina, cursor_siguiente = estacionamiento.consultar_historial(limite, antes_de)
     
-    # Calcular total recaudado
-    total_recaudado = sum(v.tarifa_pagada for v in estacionamiento.historial)
+    # Totales acumulados: no se recorre el historial en cada solicitud
+    total_registros, total_recaudado = estacionamiento.resumen_historial()
     
-    return render_template('historial.html', 
-                         historial=historial_reciente, 
-                         total_recaudado=total_recaudado,
-                         total_registros=len(estacionamiento.historial))
+    # La página se envía a medida que se genera, sin armar todo el HTML en memoria
+    return stream_template('historial.html', 
+                           historial=historial_pagina, 
+                           total_recaudado=total_recaudado,
+                           total_registros=total_registros,
+                           limite=limite,
+                           es_primera_pagina=antes_de is None,
+                           cursor_siguiente=cursor_siguiente)
 
 @app.route('/tarifas', methods=['GET', 'POST'])
 def gestionar_tarifas():
@@ -248,6 +440,36 @@ def modificar_tarifa():
             'message': f'Error interno: {str(e)}'
         }), 500
 
+@app.route('/api/tarifas', methods=['GET', 'POST'])
+def api_tarifas():
+    """
+    API de versiones de tarifas
+    
+    GET devuelve todas las versiones. POST crea una versión nueva con un JSON como
+    {"tarifas": {"auto": 3000}, "vigente_desde": "2025-11-01T00:00:00",
+     "franjas": [{"desde": "22:00", "hasta": "06:00", "tarifas": {"auto": 1500}}],
+     "topes_diarios": {"auto": 30000}}
+    donde todo salvo "tarifas" es opcional.
+    """
+    if request.method == 'POST':
+        datos = request.get_json(silent=True) or {}
+        try:
+            vigente_desde = datos.get('vigente_desde')
+            vigente_desde = datetime.fromisoformat(vigente_desde) if vigente_desde else None
+            nuevas_tarifas = {tipo: int(tarifa) for tipo, tarifa in datos.get('tarifas', {}).items()}
+        except (AttributeError, TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Formato de tarifas o fecha no válido'}), 400
+        
+        exito, mensaje = estacionamiento.cambiar_tarifas(nuevas_tarifas, vigente_desde,
+                                                         datos.get('franjas'), datos.get('topes_diarios'))
+        if not exito:
+            return jsonify({'success': False, 'message': mensaje}), 400
+    
+    return jsonify({
+        'vigente': estacionamiento.motor_tarifas.vigente().numero,
+        'versiones': estacionamiento.motor_tarifas.a_lista()
+    })
+
 @app.route('/abonos')
 def gestionar_abonos():
     """Ver todos los abonos mensuales"""
@@ -334,36 +556,214 @@ def cancelar_abono(placa):
 @app.route('/api/estado')
 def api_estado():
     """API para obtener el estado actual del estacionamiento"""
+    metricas = estacionamiento.obtener_metricas()
     return jsonify({
-        'ocupados': len(estacionamiento.vehiculos_actuales),
-        'disponibles': estacionamiento.espacios_disponibles(),
-        'porcentaje_ocupacion': (len(estacionamiento.vehiculos_actuales) / estacionamiento.capacidad_total) * 100,
-        'vehiculos_count': len(estacionamiento.vehiculos_actuales)
+        'ocupados': metricas['ocupados'],
+        'disponibles': metricas['disponibles'],
+        'porcentaje_ocupacion': metricas['porcentaje_ocupacion'],
+        'vehiculos_count': metricas['ocupados'],
+        'por_tipo': metricas['por_tipo'],
+        'recaudado': metricas['recaudado'],
+        'pools': estacionamiento.ocupacion_por_pool()
     })
 
+def milisegundos(fecha):
+    """Fecha como milisegundos desde la época Unix (el formato de Date en JavaScript)"""
+    return int(fecha.timestamp() * 1000) if fecha else None
+
+def plan_tarifa_a_json(plan):
+    """Plan de tarifa con el que el cliente calcula la tarifa en vivo"""
+    return {
+        'entrada': milisegundos(plan['hora_entrada']),
+        'version_tarifa': plan['version_tarifa'],
+        'monto': plan['monto'],
+        'tarifa_hora': plan['tarifa_hora'],
+        'factor_descuento': plan['factor_descuento'],
+        'abono_vence': milisegundos(plan['abono_vence']),
+        'proximo_cambio': milisegundos(plan['proximo_cambio'])
+    }
+
+def vehiculo_a_json(vehiculo):
+    """Datos de un vehículo estacionado tal como los muestra el dashboard"""
+    tiempo = vehiculo.calcular_tiempo_permanencia()
+    plan = estacionamiento.obtener_plan_tarifa(vehiculo)
+    return {
+        'placa': vehiculo.placa,
+        'tipo': vehiculo.tipo_vehiculo.capitalize(),
+        'tipo_vehiculo': vehiculo.tipo_vehiculo,
+        'propietario': vehiculo.propietario,
+        'espacio': vehiculo.espacio_asignado,
+        'hora_entrada': vehiculo.hora_entrada.strftime('%H:%M:%S') if vehiculo.hora_entrada else '',
+        'tiempo_horas': int(tiempo.total_seconds() // 3600),
+        'tiempo_minutos': int((tiempo.total_seconds() % 3600) // 60),
+        'tiene_abono': plan['abono_vence'] is not None,
+        'tarifa_actual': plan['monto'],
+        'plan_tarifa': plan_tarifa_a_json(plan),
+        'generado': milisegundos(datetime.now())
+    }
+
 @app.route('/api/vehiculos')
 def api_vehiculos():
-    """API para obtener la lista de vehículos actuales"""
-    vehiculos_data = []
-    for vehiculo in estacionamiento.vehiculos_actuales.values():
-        tiempo = vehiculo.calcular_tiempo_permanencia()
-        tarifa = estacionamiento.calcular_tarifa(vehiculo)
+    """
+    API para obtener la lista de vehículos actuales
+    
+    Responde con ETag y 304 si el cliente ya tiene la versión actual. Con
+    ?since=<versión> devuelve solo las placas agregadas y quitadas desde esa
+    versión (o la lista completa si los cambios ya no se conocen).
+    """
+    version = estacionamiento.version
+    since = request.args.get('since', type=int)
+    
+    # El tiempo y la tarifa mostrados cambian con el reloj: la ETag incluye el minuto
+    etag = f"v{version}-m{int(time.time() // 60)}" + (f"-s{since}" if since is not None else "")
+    if request.if_none_match.contains(etag):
+        respuesta = Response(status=304)
+    elif since is None:
+        vehiculos_data = [vehiculo_a_json(vehiculo) for vehiculo in estacionamiento.vehiculos_actuales.values()]
+        respuesta = jsonify(vehiculos_data)
+    else:
+        cambios = estacionamiento.cambios_desde(since)
+        vehiculos = estacionamiento.vehiculos_actuales
+        if cambios is None:
+            respuesta = jsonify({
+                'version': version,
+                'completo': True,
+                'vehiculos': [vehiculo_a_json(vehiculo) for vehiculo in vehiculos.values()]
+            })
+        else:
+            agregados, quitados = cambios
+            respuesta = jsonify({
+                'version': version,
+                'completo': False,
+                'agregados': [vehiculo_a_json(vehiculos[placa]) for placa in agregados if placa in vehiculos],
+                'quitados': quitados
+            })
+    
+    respuesta.set_etag(etag)
+    respuesta.headers['X-Version'] = str(version)
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta
+
+# Segundos sin eventos tras los que se envía un comentario para mantener viva
+# la conexión (y se revisa si otro proceso cambió el estado)
+INTERVALO_LATIDO_SSE = 15
+
+# Con Flask cada flujo abierto ocupa un hilo del servidor. Los flujos se cierran
+# a los DURACION_FLUJO_SSE segundos (EventSource se reconecta solo y con
+# Last-Event-ID recibe lo que se perdió) y cada proceso sostiene a lo sumo
+# MAX_FLUJOS_SSE a la vez, para que siempre queden hilos para las demás rutas.
+# Los que no entran reciben 503: el navegador cierra el flujo, el dashboard
+# consulta /api/estado periódicamente y vuelve a intentar el flujo más tarde.
+DURACION_FLUJO_SSE = 60
+REINTENTO_SSE_OCUPADO = 60  # Segundos (encabezado Retry-After del 503)
+MAX_FLUJOS_SSE = int(os.environ.get('ESTACIONAMIENTO_MAX_FLUJOS_SSE', 8))
+flujos_sse = threading.BoundedSemaphore(MAX_FLUJOS_SSE)
+
+def delta_evento(tipo, datos):
+    """Convierte un evento del estacionamiento en el delta que aplica el cliente"""
+    if tipo == 'ingreso':
+        return vehiculo_a_json(Vehiculo.desde_dict(datos))
+    if tipo == 'egreso':
+        return {'placa': datos['placa'], 'tarifa_pagada': datos.get('tarifa_pagada', 0)}
+    if tipo == 'abono':
+        abono = AbonoMensual.desde_dict(datos)
+        return {'placa': abono.placa, 'vigente': abono.esta_vigente()}
+    return datos
+
+def formatear_sse(tipo, datos, id_evento=None):
+    """Arma un mensaje con el formato de Server-Sent Events"""
+    mensaje = f"event: {tipo}\n"
+    if id_evento is not None:
+        mensaje += f"id: {id_evento}\n"
+    return mensaje + f"data: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+def inicio_sse(ultimo_id):
+    """
+    Primeros mensajes de un flujo de eventos
+    
+    Args:
+        ultimo_id (int): Valor de Last-Event-ID, o None en una conexión nueva
         
-        tiene_abono = estacionamiento.tiene_abono_vigente(vehiculo.placa)
+    Returns:
+        tuple: (mensajes, último id enviado)
+    """
+    mensajes = ["retry: 3000\n\n"]
+    if ultimo_id is None:
+        # Conexión nueva: el cliente parte de los contadores actuales
+        ultimo_id = estacionamiento.canal.ultimo_id
+        mensajes.append(formatear_sse('estado', {'metricas': estacionamiento.obtener_metricas()}, ultimo_id))
+    return mensajes, ultimo_id
+
+def mensajes_sse(eventos, ultimo_id):
+    """
+    Mensajes para lo que devolvió la espera en el canal de eventos
+    
+    Args:
+        eventos (list): Eventos nuevos, lista vacía si venció la espera o None
+            si el cliente se atrasó demasiado (ver CanalEventos.esperar)
+        ultimo_id (int): Último id enviado al cliente
         
-        vehiculos_data.append({
-            'placa': vehiculo.placa,
-            'tipo': vehiculo.tipo_vehiculo.capitalize(),
-            'propietario': vehiculo.propietario,
-            'espacio': vehiculo.espacio_asignado,
-            'hora_entrada': vehiculo.hora_entrada.strftime('%H:%M:%S') if vehiculo.hora_entrada else '',
-            'tiempo_horas': int(tiempo.total_seconds() // 3600),
-            'tiempo_minutos': int((tiempo.total_seconds() % 3600) // 60),
-            'tiene_abono': tiene_abono,
-            'tarifa_actual': tarifa
-        })
+    Returns:
+        tuple: (mensajes, último id enviado)
+    """
+    if eventos is None:
+        # El cliente se perdió eventos: debe releer el estado completo
+        ultimo_id = estacionamiento.canal.ultimo_id
+        return [formatear_sse('recarga', {'metricas': estacionamiento.obtener_metricas()}, ultimo_id)], ultimo_id
+    if not eventos:
+        estacionamiento.sincronizar()
+        return [": latido\n\n"], ultimo_id
+    
+    metricas = estacionamiento.obtener_metricas()
+    mensajes = [formatear_sse(tipo, {'datos': delta_evento(tipo, datos), 'metricas': metricas}, id_evento)
+                for id_evento, tipo, datos in eventos]
+    return mensajes, eventos[-1][0]
+
+@app.route('/api/eventos')
+def api_eventos():
+    """
+    Flujo Server-Sent Events con los cambios del estacionamiento
     
-    return jsonify(vehiculos_data)
+    Cada ingreso, egreso, cambio de tarifas o abono se envía como un delta
+    junto con los contadores actuales, así el dashboard no necesita consultar
+    /api/estado ni /api/vehiculos periódicamente. El flujo dura a lo sumo
+    DURACION_FLUJO_SSE segundos y el navegador se reconecta (ver MAX_FLUJOS_SSE).
+    """
+    encabezados = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if not flujos_sse.acquire(blocking=False):
+        return Response("Demasiados flujos de eventos abiertos", status=503, mimetype='text/plain',
+                        headers={'Retry-After': str(REINTENTO_SSE_OCUPADO)})
+    
+    canal = estacionamiento.canal
+    ultimo_id = request.headers.get('Last-Event-ID', type=int)
+    
+    def generar(ultimo_id):
+        mensajes, ultimo_id = inicio_sse(ultimo_id)
+        yield from mensajes
+        fin = time.monotonic() + DURACION_FLUJO_SSE
+        while time.monotonic() < fin:
+            eventos = canal.esperar(ultimo_id, min(INTERVALO_LATIDO_SSE, fin - time.monotonic()))
+            mensajes, ultimo_id = mensajes_sse(eventos, ultimo_id)
+            yield from mensajes
+    
+    respuesta = Response(stream_with_context(generar(ultimo_id)), mimetype='text/event-stream',
+                         headers=encabezados)
+    # El servidor cierra la respuesta aunque el cliente se haya desconectado antes
+    respuesta.call_on_close(flujos_sse.release)
+    return respuesta
+
+@app.route('/api/historial')
+def api_historial():
+    """API para paginar el historial con un cursor"""
+    limite = max(1, min(request.args.get('limite', 50, type=int), 500))
+    antes_de = request.args.get('antes_de', type=int)
+    
+    historial_pagina, cursor_siguiente = estacionamiento.consultar_historial(limite, antes_de)
+    
+    return jsonify({
+        'registros': [vehiculo.a_dict() for vehiculo in historial_pagina],
+        'cursor_siguiente': cursor_siguiente
+    })
 
 @app.route('/api/abonos')
 def api_abonos():
@@ -371,6 +771,201 @@ def api_abonos():
     estadisticas = estacionamiento.obtener_estadisticas_abonos()
     return jsonify(estadisticas)
 
+@app.route('/api/buscar')
+def api_buscar():
+    """
+    Autocompletado de placas: coincidencias exactas, por principio o final de
+    la placa y a un carácter de distancia, tolerando O/0, I/1 y similares
+    
+    Con ?estacionados=1 solo devuelve vehículos que están dentro.
+    """
+    texto = request.args.get('q', '')
+    limite = max(1, min(request.args.get('limite', 10, type=int), 50))
+    if not texto.strip():
+        return jsonify([])
+    
+    if request.args.get('estacionados') == '1':
+        # Se piden más resultados para que queden suficientes después de filtrar
+        resultados = [r for r in estacionamiento.buscar_placas(texto, limite * 5) if r['estacionado']]
+    else:
+        resultados = estacionamiento.buscar_placas(texto, limite)
+    return jsonify(resultados[:limite])
+
+@app.route('/api/sitios')
+def api_sitios():
+    """Contadores de cada sitio y totales entre todos (ver RegistroSitios.resumen)"""
+    return jsonify(sitios.resumen())
+
+@app.route('/api/replica')
+def api_replica():
+    """
+    Estado actual para las réplicas locales de las barreras (ver agente_puerta.py)
+    
+    Incluye los datos de todos los abonados: requiere el token de administración.
+    """
+    error = autorizado_admin()
+    if error:
+        return error
+    
+    estado = estacionamiento.exportar_estado()
+    estado['historial_resumido'] = []
+    estado['claves_aplicadas'] = []
+    return jsonify(estado)
+
+MAX_PUNTOS_OCUPACION = 5000  # Intervalos por consulta de /api/analitica/ocupacion
+
+def periodo_consultado(dias_por_defecto=None):
+    """
+    Período de los parámetros 'desde' y 'hasta' (ISO 8601) de la consulta
+    
+    Args:
+        dias_por_defecto (int): Días hasta ahora que se toman si falta 'desde'
+            (None para no limitar)
+    
+    Returns:
+        tuple: (desde, hasta) en hora local, como el historial; ValueError si
+        alguna fecha no es válida
+    """
+    desde = request.args.get('desde')
+    hasta = request.args.get('hasta')
+    hasta = hora_local(datetime.fromisoformat(hasta)) if hasta else None
+    if desde:
+        desde = hora_local(datetime.fromisoformat(desde))
+    elif dias_por_defecto is not None:
+        desde = ((hasta or datetime.now()) - timedelta(days=dias_por_defecto)).replace(minute=0, second=0,
+                                                                                    microsecond=0)
+    else:
+        desde = None
+    return desde, hasta
+
+@app.route('/reportes')
+def ver_reportes():
+    """Página de reportes: recaudación, permanencia, ocupación y horas pico"""
+    return render_template('reportes.html')
+
+@app.route('/api/analitica/<reporte>')
+def api_analitica(reporte):
+    """
+    Reportes calculados sobre todo el historial (ver analitica.py)
+    
+    - recaudacion y permanencia: egresos entre 'desde' y 'hasta' (todo el historial por defecto)
+    - ocupacion: curva de los últimos 7 días, con puntos cada 'intervalo' minutos (60 por defecto)
+    - mapa-calor: llegadas y ocupación por día de la semana y hora de los últimos 28 días
+    """
+    if reporte not in ('recaudacion', 'permanencia', 'ocupacion', 'mapa-calor'):
+        return jsonify({'success': False, 'message': f'Reporte desconocido: {reporte}'}), 404
+    
+    if analitica is None:
+        return jsonify({'success': False, 'message': 'Reportes no disponibles: instalar numpy'}), 501
+    
+    try:
+        if reporte in ('recaudacion', 'permanencia'):
+            desde, hasta = periodo_consultado()
+        else:
+            desde, hasta = periodo_consultado(7 if reporte == 'ocupacion' else 28)
+    except (ValueError, OverflowError):
+        return jsonify({'success': False, 'message': 'Fecha no válida (formato ISO 8601)'}), 400
+    
+    columnas = estacionamiento.columnas_historial()
+    
+    if reporte == 'recaudacion':
+        return jsonify(analitica.recaudacion(columnas, desde, hasta))
+    if reporte == 'permanencia':
+        return jsonify(analitica.permanencia(columnas, desde, hasta))
+    
+    ahora = datetime.now()
+    hasta = hasta or ahora
+    entradas_actuales = estacionamiento.entradas_actuales()
+    if reporte == 'mapa-calor':
+        return jsonify(analitica.mapa_calor(columnas, desde, hasta, entradas_actuales, ahora))
+    
+    intervalo = timedelta(minutes=request.args.get('intervalo', 60, type=int))
+    if intervalo <= timedelta(0) or (hasta - desde) / intervalo > MAX_PUNTOS_OCUPACION:
+        return jsonify({
+            'success': False,
+            'message': f'El intervalo debe ser positivo y dar hasta {MAX_PUNTOS_OCUPACION} puntos'
+        }), 400
+    resultado = analitica.ocupacion(columnas, desde, hasta, intervalo, entradas_actuales, ahora)
+    resultado['capacidad_total'] = estacionamiento.capacidad_total
+    return jsonify(resultado)
+
+@app.route('/metrics')
+def metricas_prometheus():
+    """Métricas del proceso en el formato de texto de Prometheus (ver instrumentacion.py)"""
+    return Response(REGISTRO.exponer(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def autorizado_admin():
+    """
+    Verifica el token de administración (encabezado Authorization: Bearer <token>)
+    
+    Returns:
+        Response: Respuesta de error, o None si la solicitud está autorizada
+    """
+    if not token_admin:
+        return jsonify({'success': False,
+                        'message': 'Administración deshabilitada: definir ESTACIONAMIENTO_TOKEN_ADMIN'}), 403
+    encabezado = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(encabezado.encode(), f'Bearer {token_admin}'.encode()):
+        return jsonify({'success': False, 'message': 'Token de administración inválido'}), 401
+    return None
+
+@app.route('/admin/perfilador', methods=['GET', 'POST'])
+def admin_perfilador():
+    """
+    Estado del perfilador por muestreo (GET) o activación y desactivación (POST)
+    
+    POST con JSON: {"activo": true, "rutas": ["/abonos"], "porcentaje": 10,
+    "duracion": 300, "intervalo_ms": 5}; todos los campos salvo 'activo' son
+    opcionales. Activar descarta la captura anterior.
+    """
+    error = autorizado_admin()
+    if error:
+        return error
+    
+    if request.method == 'POST':
+        datos = request.get_json(silent=True)
+        if not isinstance(datos, dict):
+            return jsonify({'success': False, 'message': 'Se esperaba un objeto JSON'}), 400
+        
+        if not datos.get('activo'):
+            perfilador.desactivar()
+            return jsonify({'success': True, 'message': 'Perfilador desactivado',
+                            'estado': perfilador.estado()})
+        
+        rutas = datos.get('rutas') or []
+        if isinstance(rutas, str):
+            rutas = [rutas]
+        reglas = {regla.rule for regla in app.url_map.iter_rules()}
+        desconocidas = [ruta for ruta in rutas if ruta not in reglas]
+        if desconocidas:
+            return jsonify({'success': False,
+                            'message': f"Rutas desconocidas: {', '.join(map(str, desconocidas))}"}), 400
+        
+        try:
+            intervalo_ms = datos.get('intervalo_ms')
+            exito, mensaje = perfilador.activar(
+                rutas, float(datos.get('porcentaje', 100)),
+                float(datos['duracion']) if datos.get('duracion') is not None else None,
+                float(intervalo_ms) / 1000 if intervalo_ms is not None else None)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Porcentaje, duración o intervalo no válidos'}), 400
+        if not exito:
+            return jsonify({'success': False, 'message': mensaje}), 400
+        return jsonify({'success': True, 'message': mensaje, 'estado': perfilador.estado()})
+    
+    return jsonify({'success': True, 'estado': perfilador.estado()})
+
+@app.route('/admin/perfilador/pilas')
+def admin_perfilador_pilas():
+    """Descarga las pilas colapsadas capturadas (opcionalmente de una sola ruta)"""
+    error = autorizado_admin()
+    if error:
+        return error
+    
+    contenido = perfilador.exportar(request.args.get('ruta'))
+    return Response(contenido, content_type='text/plain; charset=utf-8',
+                    headers={'Content-Disposition': 'attachment; filename="pilas_colapsadas.txt"'})
+
 @app.template_filter('currency')
 def currency_filter(amount):
     """Filtro para formatear moneda"""
@@ -0,0 +1,124 @@
+"""
+Aplicación web asíncrona (ASGI) del Sistema de Estacionamiento
+
+Expone las mismas rutas que app.py sobre asyncio:
+
+- El flujo de eventos /api/eventos se atiende en el bucle de eventos: cada
+  dashboard conectado es una corrutina que espera en memoria y no ocupa un
+  hilo, así que un solo proceso sostiene cientos de conexiones.
+- El resto de las páginas y de /api/* son las de la aplicación Flask, que se
+  ejecutan en el grupo de hilos del servidor.
+- Las escrituras se hacen en segundo plano (ver AlmacenamientoDiferido), así
+  que la latencia de una solicitud no incluye el disco.
+
+Corre en un solo proceso: las escrituras diferidas no se coordinan entre
+procesos. Para varios procesos está gunicorn.conf.py.
+
+Ejecutar:
+    uvicorn app_asgi:app --host 0.0.0.0 --port 8080
+"""
+
+import asyncio
+import contextlib
+import os
+import threading
+
+# Debe definirse antes de que app.py cree el estacionamiento
+os.environ.setdefault('ESTACIONAMIENTO_ESCRITURA_DIFERIDA', '1')
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import INTERVALO_LATIDO_SSE, app as app_flask, contexto_sitio, inicio_sse, mensajes_sse, sitios
+
+
+class EsperaEventos:
+    """
+    Espera asíncrona en el canal de eventos
+
+    El canal se sincroniza con threading. Un solo hilo espera en él y, con
+    cada publicación, despierta en el bucle de eventos a todas las conexiones.
+    """
+
+    def __init__(self, canal):
+        """
+        Args:
+            canal (CanalEventos): Canal del estacionamiento
+        """
+        self.canal = canal
+        self._bucle = None
+        self._aviso = None
+
+    def iniciar(self):
+        """Arranca el hilo que vigila el canal; se llama desde el bucle de eventos"""
+        self._bucle = asyncio.get_running_loop()
+        self._aviso = asyncio.Event()
+        threading.Thread(target=self._vigilar, name="vigia-eventos", daemon=True).start()
+
+    def _vigilar(self):
+        ultimo_id = self.canal.ultimo_id
+        while True:
+            self.canal.esperar(ultimo_id)
+            ultimo_id = self.canal.ultimo_id
+            self._bucle.call_soon_threadsafe(self._avisar)
+
+    def _avisar(self):
+        aviso, self._aviso = self._aviso, asyncio.Event()
+        aviso.set()
+
+    async def esperar(self, ultimo_id, timeout):
+        """Igual que CanalEventos.esperar, sin bloquear el bucle de eventos"""
+        if self.canal.ultimo_id == ultimo_id:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._aviso.wait(), timeout)
+        return self.canal.desde(ultimo_id)
+
+
+# Una espera por sitio: cada uno tiene su propio canal de eventos
+esperas_eventos = {id_sitio: EsperaEventos(estacionamiento.canal)
+                   for id_sitio, estacionamiento in sitios.items()}
+
+
+async def api_eventos(request):
+    """Flujo Server-Sent Events con los cambios de un sitio (ver app.api_eventos)"""
+    id_sitio = request.path_params.get('sitio', sitios.principal)
+    espera_eventos = esperas_eventos.get(id_sitio)
+    if espera_eventos is None:
+        return PlainTextResponse('Sitio desconocido', status_code=404)
+
+    try:
+        ultimo_id = int(request.headers['last-event-id'])
+    except (KeyError, ValueError):
+        ultimo_id = None
+
+    async def generar(ultimo_id):
+        with contexto_sitio(id_sitio):
+            mensajes, ultimo_id = inicio_sse(ultimo_id)
+        for mensaje in mensajes:
+            yield mensaje
+        while True:
+            eventos = await espera_eventos.esperar(ultimo_id, INTERVALO_LATIDO_SSE)
+            with contexto_sitio(id_sitio):
+                mensajes, ultimo_id = mensajes_sse(eventos, ultimo_id)
+            for mensaje in mensajes:
+                yield mensaje
+
+    return StreamingResponse(generar(ultimo_id), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@contextlib.asynccontextmanager
+async def ciclo_de_vida(aplicacion):
+    for espera_eventos in esperas_eventos.values():
+        espera_eventos.iniciar()
+    yield
+    sitios.cerrar()  # Escribe lo que haya quedado encolado
+
+
+app = Starlette(routes=[
+    Route('/api/eventos', api_eventos),
+    Route('/sitios/{sitio}/api/eventos', api_eventos),
+    Mount('/', app=WSGIMiddleware(app_flask))
+], lifespan=ciclo_de_vida)
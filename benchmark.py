@@ -0,0 +1,343 @@
+"""
+Benchmark del núcleo del Sistema de Estacionamiento
+
+Mide la latencia de las operaciones de Estacionamiento (registrar_ingreso,
+registrar_egreso, calcular_tarifa, asignar_espacio, guardar_datos y
+cargar_datos) en escenarios con distinta capacidad, tamaño de historial y
+cantidad de abonos. Cada escenario se arma desde cero en un directorio
+temporal, con datos sintéticos generados con una semilla fija, así que dos
+corridas con los mismos parámetros miden exactamente el mismo trabajo.
+
+El resultado es un JSON con p50, p90, p99 y operaciones por segundo de cada
+operación, junto con el commit y la versión de Python. Dos resultados se
+comparan con --comparar para detectar regresiones entre commits.
+
+Uso:
+    python benchmark.py --capacidad 50,500 --historial 0,100000 --abonos 0,1000 \\
+        --salida resultados.json
+    python benchmark.py --comparar base.json --salida resultados.json
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from almacenamiento import AlmacenamientoJSON, AlmacenamientoSQLite
+from estacionamiento import Estacionamiento
+
+BACKENDS = ('completo', 'diario', 'binario', 'sqlite')
+TIPOS_VEHICULO = ('auto', 'auto', 'auto', 'moto', 'camioneta')  # Mezcla aproximada de una barrera
+OCUPACION_INICIAL = 0.5  # Fracción de la capacidad ocupada antes de medir
+EVENTOS_POR_LOTE = 1000  # Eventos por llamada a procesar_lote al cargar datos sintéticos
+DIFERENCIA_MINIMA_MS = 0.005  # Por debajo de esto un aumento es ruido de medición, no regresión
+
+
+def estadisticas(duraciones_ns, segundos=None):
+    """
+    Resume una serie de latencias
+
+    Args:
+        duraciones_ns (list): Duración de cada operación, en nanosegundos
+        segundos (float): Duración total de la medición para calcular el
+            rendimiento; por defecto, la suma de las duraciones
+
+    Returns:
+        dict: Cantidad, percentiles y máximo en milisegundos y operaciones por segundo
+    """
+    if not duraciones_ns:
+        return {'operaciones': 0}
+    ordenadas = sorted(duraciones_ns)
+    cantidad = len(ordenadas)
+
+    def percentil(p):
+        # Rango más cercano: el menor valor con al menos p% de las muestras a su izquierda
+        return ordenadas[min(cantidad - 1, max(0, -(-cantidad * p // 100) - 1))] / 1e6
+
+    if segundos is None:
+        segundos = sum(ordenadas) / 1e9
+    return {
+        'operaciones': cantidad,
+        'p50_ms': round(percentil(50), 4),
+        'p90_ms': round(percentil(90), 4),
+        'p99_ms': round(percentil(99), 4),
+        'max_ms': round(ordenadas[-1] / 1e6, 4),
+        'media_ms': round(sum(ordenadas) / cantidad / 1e6, 4),
+        'por_segundo': round(cantidad / segundos, 1) if segundos > 0 else None
+    }
+
+
+def datos_de_entorno():
+    """Commit, versión de Python y máquina donde se midió"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ''
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'procesadores': os.cpu_count()
+    }
+
+
+def clave_escenario(escenario):
+    return json.dumps(escenario, sort_keys=True)
+
+
+def comparar(anterior, actual, tolerancia=0.10):
+    """
+    Compara dos resultados e informa los cambios de p50 y p99
+
+    Args:
+        anterior (dict): Resultado de referencia
+        actual (dict): Resultado nuevo
+        tolerancia (float): Aumento relativo de p50 o p99 a partir del cual se
+            considera una regresión
+
+    Returns:
+        list: Regresiones como (escenario, operación, métrica, antes, después)
+    """
+    referencia = {clave_escenario(r['escenario']): r['operaciones'] for r in anterior['resultados']}
+    regresiones = []
+    print(f"\nComparación con {anterior.get('commit') or 'referencia'} "
+          f"({anterior.get('fecha', '?')}), tolerancia {tolerancia:.0%}")
+
+    for resultado in actual['resultados']:
+        operaciones_antes = referencia.get(clave_escenario(resultado['escenario']))
+        if operaciones_antes is None:
+            continue
+        print(f"\n  {resultado['escenario']}")
+        for operacion, despues in resultado['operaciones'].items():
+            antes = operaciones_antes.get(operacion)
+            if not antes or not antes.get('operaciones') or not despues.get('operaciones'):
+                continue
+            marcas = []
+            for metrica in ('p50_ms', 'p99_ms'):
+                if (despues[metrica] > antes[metrica] * (1 + tolerancia)
+                        and despues[metrica] - antes[metrica] > DIFERENCIA_MINIMA_MS):
+                    marcas.append(metrica)
+                    regresiones.append((resultado['escenario'], operacion, metrica,
+                                        antes[metrica], despues[metrica]))
+            cambio = (despues['p50_ms'] / antes['p50_ms'] - 1) if antes['p50_ms'] else 0
+            print(f"    {'❌' if marcas else '✅'} {operacion:<20} p50 {antes['p50_ms']:>9.3f} → "
+                  f"{despues['p50_ms']:>9.3f} ms ({cambio:+.0%})  p99 {antes['p99_ms']:>9.3f} → "
+                  f"{despues['p99_ms']:>9.3f} ms")
+    return regresiones
+
+
+class EscenarioBenchmark:
+    """Un estacionamiento con datos sintéticos sobre el que se miden las operaciones"""
+
+    def __init__(self, directorio, backend, capacidad, historial, abonos, durabilidad, semilla):
+        """
+        Arma el estacionamiento y lo carga con datos sintéticos
+
+        Args:
+            directorio (str): Directorio temporal para los datos
+            backend (str): 'completo', 'diario', 'binario' (diario con snapshot binario) o 'sqlite'
+            capacidad (int): Capacidad total
+            historial (int): Registros del historial a generar
+            abonos (int): Abonos mensuales a generar
+            durabilidad (str): Política de fsync del backend
+            semilla (int): Semilla de los datos sintéticos
+        """
+        self.directorio = directorio
+        self.backend = backend
+        self.capacidad = capacidad
+        self.durabilidad = durabilidad
+        self.azar = random.Random(semilla)
+        self.placas = (f"B{numero:07d}" for numero in itertools.count())
+        self.placas_abono = []
+
+        self.estacionamiento = self.abrir()
+        self._generar_abonos(abonos)
+        self._generar_historial(historial)
+        self._generar_ocupacion(int(capacidad * OCUPACION_INICIAL))
+
+    def abrir(self):
+        """Crea un Estacionamiento sobre los datos del directorio"""
+        if self.backend == 'sqlite':
+            almacenamiento = AlmacenamientoSQLite(os.path.join(self.directorio, 'benchmark.db'),
+                                                  durabilidad=self.durabilidad)
+        else:
+            almacenamiento = AlmacenamientoJSON(
+                os.path.join(self.directorio, 'benchmark.json'),
+                modo_persistencia='completo' if self.backend == 'completo' else 'diario',
+                durabilidad=self.durabilidad,
+                formato_snapshot='binario' if self.backend == 'binario' else 'json')
+        return Estacionamiento(capacidad_total=self.capacidad, nombre="Benchmark",
+                               almacenamiento=almacenamiento)
+
+    def _tipo(self):
+        return self.azar.choice(TIPOS_VEHICULO)
+
+    def _generar_abonos(self, cantidad):
+        with self.estacionamiento.lote():
+            for _ in range(cantidad):
+                placa = next(self.placas)
+                self.estacionamiento.registrar_abono_mensual(placa, f"Titular {placa}", self._tipo())
+                self.placas_abono.append(placa)
+
+    def _generar_historial(self, cantidad):
+        """Ingresos y egresos de los últimos 90 días, aplicados por lotes"""
+        ahora = datetime.now()
+        inicio = ahora - timedelta(days=90)
+        paso = (ahora - inicio - timedelta(hours=12)) / max(cantidad, 1)
+        eventos = []
+        for i in range(cantidad):
+            placa = next(self.placas)
+            entrada = inicio + paso * i
+            salida = entrada + timedelta(minutes=self.azar.randint(10, 600))
+            eventos.append({'tipo': 'ingreso', 'placa': placa, 'tipo_vehiculo': self._tipo(),
+                            'momento': entrada.isoformat()})
+            eventos.append({'tipo': 'egreso', 'placa': placa, 'momento': salida.isoformat()})
+            if len(eventos) >= EVENTOS_POR_LOTE or i == cantidad - 1:
+                with self.estacionamiento.lote():
+                    self.estacionamiento.procesar_lote(eventos)
+                eventos = []
+
+    def _generar_ocupacion(self, cantidad):
+        ahora = datetime.now()
+        eventos = [{'tipo': 'ingreso', 'placa': next(self.placas), 'tipo_vehiculo': self._tipo(),
+                    'momento': (ahora - timedelta(minutes=self.azar.randint(1, 600))).isoformat()}
+                   for _ in range(cantidad)]
+        with self.estacionamiento.lote():
+            self.estacionamiento.procesar_lote(eventos)
+
+    def medir(self, operaciones):
+        """
+        Mide cada operación
+
+        Args:
+            operaciones (int): Repeticiones de las operaciones por vehículo;
+                guardar_datos y cargar_datos se repiten la vigésima parte
+
+        Returns:
+            dict: Estadísticas por operación (ver estadisticas)
+        """
+        estacionamiento = self.estacionamiento
+        reloj = time.perf_counter_ns
+        tiempos = {nombre: [] for nombre in ('registrar_ingreso', 'registrar_egreso', 'calcular_tarifa',
+                                             'asignar_espacio', 'guardar_datos', 'cargar_datos')}
+
+        # Ingreso y egreso alternados: la ocupación se mantiene estable. Uno de
+        # cada diez ingresos es de un abonado (descuento en el egreso)
+        for i in range(operaciones):
+            if self.placas_abono and i % 10 == 0:
+                placa = self.azar.choice(self.placas_abono)
+            else:
+                placa = next(self.placas)
+            tipo = self._tipo()
+
+            inicio = reloj()
+            exito, mensaje, _ = estacionamiento.registrar_ingreso(placa, tipo)
+            tiempos['registrar_ingreso'].append(reloj() - inicio)
+            if not exito:
+                raise RuntimeError(f"registrar_ingreso falló durante el benchmark: {mensaje}")
+
+            inicio = reloj()
+            estacionamiento.registrar_egreso(placa)
+            tiempos['registrar_egreso'].append(reloj() - inicio)
+
+        vehiculos = list(estacionamiento.vehiculos_actuales.values())
+        for _ in range(operaciones if vehiculos else 0):
+            vehiculo = self.azar.choice(vehiculos)
+            inicio = reloj()
+            estacionamiento.calcular_tarifa(vehiculo)
+            tiempos['calcular_tarifa'].append(reloj() - inicio)
+
+        for _ in range(operaciones):
+            tipo = self._tipo()
+            inicio = reloj()
+            espacio = estacionamiento.asignar_espacio(tipo)
+            tiempos['asignar_espacio'].append(reloj() - inicio)
+            estacionamiento._liberar_espacio(espacio)
+
+        for _ in range(max(5, operaciones // 20)):
+            inicio = reloj()
+            estacionamiento.guardar_datos()
+            tiempos['guardar_datos'].append(reloj() - inicio)
+
+            inicio = reloj()
+            estacionamiento.cargar_datos()
+            tiempos['cargar_datos'].append(reloj() - inicio)
+
+        return {nombre: estadisticas(duraciones) for nombre, duraciones in tiempos.items()}
+
+    def cerrar(self):
+        self.estacionamiento.cerrar()
+
+
+def lista_de_enteros(texto):
+    return [int(valor) for valor in texto.split(',') if valor.strip()]
+
+
+def main():
+    """Corre los escenarios pedidos y guarda el resultado en JSON"""
+    parser = argparse.ArgumentParser(description="Benchmark del núcleo del estacionamiento")
+    parser.add_argument('--capacidad', type=lista_de_enteros, default=[50, 500],
+                        help="Capacidades a medir, separadas por comas")
+    parser.add_argument('--historial', type=lista_de_enteros, default=[0, 10000],
+                        help="Tamaños de historial a medir, separados por comas")
+    parser.add_argument('--abonos', type=lista_de_enteros, default=[0, 1000],
+                        help="Cantidades de abonos a medir, separadas por comas")
+    parser.add_argument('--backend', choices=BACKENDS, default='diario', help="Backend de almacenamiento")
+    parser.add_argument('--durabilidad', choices=('siempre', 'grupo', 'sistema'), default='sistema',
+                        help="Política de fsync ('sistema' mide el código y no el disco)")
+    parser.add_argument('--operaciones', type=int, default=500, help="Repeticiones por operación")
+    parser.add_argument('--semilla', type=int, default=1, help="Semilla de los datos sintéticos")
+    parser.add_argument('--salida', help="Archivo JSON donde guardar el resultado")
+    parser.add_argument('--comparar', help="Resultado anterior con el que comparar")
+    parser.add_argument('--tolerancia', type=float, default=0.10,
+                        help="Aumento relativo de p50 o p99 que se informa como regresión")
+    args = parser.parse_args()
+
+    resultado = datos_de_entorno()
+    resultado['parametros'] = {'backend': args.backend, 'durabilidad': args.durabilidad,
+                               'operaciones': args.operaciones, 'semilla': args.semilla}
+    resultado['resultados'] = []
+
+    for capacidad, historial, abonos in itertools.product(args.capacidad, args.historial, args.abonos):
+        escenario = {'backend': args.backend, 'capacidad': capacidad, 'historial': historial, 'abonos': abonos}
+        print(f"⏱️  {escenario}")
+        directorio = tempfile.mkdtemp(prefix='benchmark_estacionamiento_')
+        try:
+            banco = EscenarioBenchmark(directorio, args.backend, capacidad, historial, abonos,
+                                       args.durabilidad, args.semilla)
+            try:
+                operaciones = banco.medir(args.operaciones)
+            finally:
+                banco.cerrar()
+        finally:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+        for nombre, datos in operaciones.items():
+            print(f"    {nombre:<20} p50 {datos['p50_ms']:>9.3f} ms  p99 {datos['p99_ms']:>9.3f} ms  "
+                  f"{datos['por_segundo']:>10.1f} op/s")
+        resultado['resultados'].append({'escenario': escenario, 'operaciones': operaciones})
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Resultado guardado en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f:
+            anterior = json.load(f)
+        if comparar(anterior, resultado, args.tolerancia):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Asignación de espacios del Sistema de Estacionamiento
+
+Cada espacio tiene nivel, zona y tipo de vehículo; los espacios se agrupan
+en pools y cada pool tiene su propio asignador. Los espacios libres de un
+pool se representan como un mapa de bits (un entero de Python donde el bit i
+encendido indica que el espacio i está libre). Buscar el primer espacio libre
+es una operación de bits sobre palabras de máquina, en lugar de recorrer
+todos los espacios uno por uno.
+"""
+
+POLITICAS_ASIGNACION = ('menor_primero', 'rotativo')
+
+
+def _primer_bit(mascara):
+    """Posición del bit encendido más bajo de una máscara distinta de cero"""
+    return (mascara & -mascara).bit_length() - 1
+
+
+class AsignadorEspacios:
+    """Asignador de espacios libres basado en un mapa de bits"""
+
+    def __init__(self, espacios, politica='menor_primero'):
+        """
+        Inicializa el asignador con todos los espacios libres
+
+        Args:
+            espacios (iterable): Números de espacio que administra el asignador
+            politica (str): 'menor_primero' asigna siempre el número más bajo libre;
+                'rotativo' continúa después del último espacio asignado
+        """
+        if politica not in POLITICAS_ASIGNACION:
+            raise ValueError(f"Política de asignación no válida. Opciones: {list(POLITICAS_ASIGNACION)}")
+        self.politica = politica
+        self.libres = 0
+        self.total = 0
+        for espacio in espacios:
+            self.libres |= 1 << espacio
+            self.total += 1
+        self.cantidad_libres = self.total
+        self._administrados = self.libres  # Máscara de todos los espacios del asignador
+        self._ultimo = 0  # Último espacio asignado (política 'rotativo')
+
+    def administra(self, espacio):
+        """Indica si el espacio pertenece a este asignador"""
+        return isinstance(espacio, int) and espacio >= 0 and bool(self._administrados >> espacio & 1)
+
+    def esta_libre(self, espacio):
+        """Indica si un espacio está libre"""
+        return bool(self.libres >> espacio & 1)
+
+    def asignar(self):
+        """
+        Toma un espacio libre según la política
+
+        Returns:
+            int: Número de espacio asignado, o None si no hay espacios libres
+        """
+        if not self.libres:
+            return None
+
+        espacio = None
+        if self.politica == 'rotativo':
+            siguientes = self.libres >> (self._ultimo + 1)
+            if siguientes:
+                espacio = self._ultimo + 1 + _primer_bit(siguientes)
+        if espacio is None:
+            espacio = _primer_bit(self.libres)
+
+        self.libres &= ~(1 << espacio)
+        self.cantidad_libres -= 1
+        self._ultimo = espacio
+        return espacio
+
+    def ocupar(self, espacio):
+        """
+        Marca como ocupado un espacio concreto (por ejemplo al cargar datos)
+
+        Returns:
+            bool: True si el espacio estaba libre
+        """
+        if not self.administra(espacio) or not self.esta_libre(espacio):
+            return False
+        self.libres &= ~(1 << espacio)
+        self.cantidad_libres -= 1
+        return True
+
+    def liberar(self, espacio):
+        """Devuelve un espacio al conjunto de libres"""
+        if not self.administra(espacio) or self.esta_libre(espacio):
+            return
+        self.libres |= 1 << espacio
+        self.cantidad_libres += 1
+
+
+class Espacio:
+    """Espacio físico del estacionamiento"""
+
+    def __init__(self, numero, nivel=1, zona="A", tipo_vehiculo=None):
+        """
+        Inicializa un espacio
+
+        Args:
+            numero (int): Número único del espacio
+            nivel (int): Nivel o piso donde se encuentra
+            zona (str): Zona dentro del nivel
+            tipo_vehiculo (str): Tipo de vehículo para el que está reservado
+                ('moto', 'auto', 'camioneta'), o None si admite cualquiera
+        """
+        self.numero = numero
+        self.nivel = nivel
+        self.zona = zona
+        self.tipo_vehiculo = tipo_vehiculo
+
+    @property
+    def pool(self):
+        """Clave del grupo de espacios al que pertenece"""
+        return (self.nivel, self.zona, self.tipo_vehiculo)
+
+
+class InventarioEspacios:
+    """
+    Inventario de espacios organizado por nivel, zona y tipo de vehículo
+
+    Cada combinación (nivel, zona, tipo) es un pool con su propio asignador,
+    y los pools se indexan por tipo y por (tipo, nivel). Así, buscar un espacio
+    para una camioneta en el nivel 2 es una consulta directa al pool que
+    corresponde, y la ocupación de cada pool se obtiene de sus contadores.
+    """
+
+    def __init__(self, espacios, politica='menor_primero'):
+        """
+        Inicializa el inventario
+
+        Args:
+            espacios (list): Lista de Espacio
+            politica (str): Política de asignación de cada pool
+        """
+        self.espacios = {espacio.numero: espacio for espacio in espacios}
+        self.capacidad = len(self.espacios)
+
+        numeros_por_pool = {}
+        for espacio in espacios:
+            numeros_por_pool.setdefault(espacio.pool, []).append(espacio.numero)
+        self.pools = {clave: AsignadorEspacios(numeros, politica)
+                      for clave, numeros in sorted(numeros_por_pool.items(), key=lambda p: _orden_pool(p[0]))}
+
+        # Índices de pools candidatos: primero los reservados al tipo, luego los generales
+        self._por_tipo = {}
+        self._por_tipo_nivel = {}
+        for clave in self.pools:
+            nivel, _, tipo = clave
+            self._por_tipo.setdefault(tipo, []).append(clave)
+            self._por_tipo_nivel.setdefault((tipo, nivel), []).append(clave)
+
+    @classmethod
+    def uniforme(cls, capacidad, politica='menor_primero'):
+        """Inventario de un solo nivel y zona donde cualquier vehículo usa cualquier espacio"""
+        return cls([Espacio(numero) for numero in range(1, capacidad + 1)], politica)
+
+    @classmethod
+    def desde_configuracion(cls, configuracion, politica='menor_primero'):
+        """
+        Construye el inventario a partir de bloques de espacios numerados en orden
+
+        Args:
+            configuracion (list): Bloques como
+                {'nivel': 2, 'zona': 'B', 'tipo_vehiculo': 'camioneta', 'cantidad': 10};
+                'tipo_vehiculo' puede omitirse para espacios de uso general
+            politica (str): Política de asignación de cada pool
+        """
+        espacios = []
+        for bloque in configuracion:
+            for _ in range(bloque['cantidad']):
+                espacios.append(Espacio(len(espacios) + 1,
+                                        bloque.get('nivel', 1),
+                                        bloque.get('zona', 'A'),
+                                        bloque.get('tipo_vehiculo')))
+        return cls(espacios, politica)
+
+    def _candidatos(self, tipo_vehiculo, nivel):
+        """Pools donde puede estacionar el tipo de vehículo, en orden de preferencia"""
+        if nivel is None:
+            return self._por_tipo.get(tipo_vehiculo, []) + self._por_tipo.get(None, [])
+        return self._por_tipo_nivel.get((tipo_vehiculo, nivel), []) + self._por_tipo_nivel.get((None, nivel), [])
+
+    def asignar(self, tipo_vehiculo=None, nivel=None):
+        """
+        Toma un espacio libre para un tipo de vehículo
+
+        Se usan primero los pools reservados para el tipo y luego los de uso general.
+
+        Args:
+            tipo_vehiculo (str): Tipo de vehículo
+            nivel (int): Nivel preferido, o None para cualquiera
+
+        Returns:
+            int: Número de espacio, o None si no hay lugar
+        """
+        for clave in self._candidatos(tipo_vehiculo, nivel):
+            espacio = self.pools[clave].asignar()
+            if espacio is not None:
+                return espacio
+        return None
+
+    def ocupar(self, numero):
+        """Marca como ocupado un espacio concreto"""
+        espacio = self.espacios.get(numero)
+        return espacio is not None and self.pools[espacio.pool].ocupar(numero)
+
+    def liberar(self, numero):
+        """Libera un espacio concreto"""
+        espacio = self.espacios.get(numero)
+        if espacio is not None:
+            self.pools[espacio.pool].liberar(numero)
+
+    @property
+    def cantidad_libres(self):
+        """Espacios libres en todo el inventario"""
+        return sum(pool.cantidad_libres for pool in self.pools.values())
+
+    def ocupacion_por_pool(self):
+        """
+        Ocupación de cada pool a partir de sus contadores
+
+        Returns:
+            list: Diccionarios con nivel, zona, tipo_vehiculo, total, ocupados y disponibles
+        """
+        return [{
+            'nivel': nivel,
+            'zona': zona,
+            'tipo_vehiculo': tipo or 'general',
+            'total': pool.total,
+            'ocupados': pool.total - pool.cantidad_libres,
+            'disponibles': pool.cantidad_libres
+        } for (nivel, zona, tipo), pool in self.pools.items()]
+
+
+def _orden_pool(clave):
+    nivel, zona, tipo = clave
+    return (nivel, zona, tipo or '')
@@ -7,13 +7,48 @@ Este sistema permite gestionar el ingreso y egreso de vehículos en un estaciona
 incluyendo el cálculo de tarifas y el control de espacios disponibles.
 """
 
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-import json
+from functools import wraps
+import atexit
+import itertools
 import os
+import threading
+
+from almacenamiento import AlmacenamientoJSON
+from espacios import InventarioEspacios
+from eventos import CanalEventos
+from historial import ColumnasHistorial
+from indice_abonos import IndiceAbonos
+from indice_placas import IndicePlacas, normalizar_placa
+from instrumentacion import REGISTRO, medir
+from metricas import MetricasEnVivo
+from tarifas import MotorTarifas
+
+
+def _fecha(valor):
+    """Fecha de un snapshot: texto ISO 8601 (JSON) o datetime (snapshot binario)"""
+    return valor if isinstance(valor, datetime) else datetime.fromisoformat(valor)
+
+
+def hora_local(momento):
+    """
+    Lleva una fecha con zona horaria (como '2026-11-01T00:00:00-03:00') a la
+    hora local sin zona, la que usa todo el sistema; las fechas sin zona ya
+    son locales y quedan igual
+    """
+    if momento is not None and momento.tzinfo is not None:
+        return momento.astimezone().replace(tzinfo=None)
+    return momento
+
 
 class Vehiculo:
     """Clase que representa un vehículo en el estacionamiento"""
     
+    __slots__ = ('placa', 'tipo_vehiculo', 'propietario', 'hora_entrada', 'hora_salida',
+                 'espacio_asignado', 'tarifa_pagada', 'version_tarifa')
+    
     def __init__(self, placa, tipo_vehiculo, propietario=""):
         """
         Inicializa un nuevo vehículo
@@ -30,15 +65,16 @@ class Vehiculo:
         self.hora_salida = None
         self.espacio_asignado = None
         self.tarifa_pagada = 0.0
+        self.version_tarifa = None  # Versión de tarifas vigente al ingresar
     
-    def ingresar(self, espacio):
-        """Registra el ingreso del vehículo al estacionamiento"""
-        self.hora_entrada = datetime.now()
+    def ingresar(self, espacio, momento=None):
+        """Registra el ingreso del vehículo al estacionamiento (por defecto, ahora)"""
+        self.hora_entrada = momento or datetime.now()
         self.espacio_asignado = espacio
     
-    def egresar(self):
-        """Registra el egreso del vehículo del estacionamiento"""
-        self.hora_salida = datetime.now()
+    def egresar(self, momento=None):
+        """Registra el egreso del vehículo del estacionamiento (por defecto, ahora)"""
+        self.hora_salida = momento or datetime.now()
     
     def calcular_tiempo_permanencia(self):
         """Calcula el tiempo que el vehículo ha permanecido en el estacionamiento"""
@@ -47,6 +83,32 @@ class Vehiculo:
             return hora_calculo - self.hora_entrada
         return timedelta(0)
     
+    def a_dict(self):
+        """Convierte el vehículo en un diccionario serializable a JSON"""
+        return {
+            'placa': self.placa,
+            'tipo_vehiculo': self.tipo_vehiculo,
+            'propietario': self.propietario,
+            'hora_entrada': self.hora_entrada.isoformat() if self.hora_entrada else None,
+            'hora_salida': self.hora_salida.isoformat() if self.hora_salida else None,
+            'espacio_asignado': self.espacio_asignado,
+            'tarifa_pagada': self.tarifa_pagada,
+            'version_tarifa': self.version_tarifa
+        }
+
+    @classmethod
+    def desde_dict(cls, datos):
+        """Reconstruye un vehículo a partir de un diccionario generado por a_dict"""
+        vehiculo = cls(datos['placa'], datos['tipo_vehiculo'], datos.get('propietario', ''))
+        if datos.get('hora_entrada'):
+            vehiculo.hora_entrada = _fecha(datos['hora_entrada'])
+        if datos.get('hora_salida'):
+            vehiculo.hora_salida = _fecha(datos['hora_salida'])
+        vehiculo.espacio_asignado = datos.get('espacio_asignado')
+        vehiculo.tarifa_pagada = datos.get('tarifa_pagada', 0)
+        vehiculo.version_tarifa = datos.get('version_tarifa')
+        return vehiculo
+    
     def __str__(self):
         estado = "Dentro" if self.hora_salida is None else "Salió"
         tiempo = self.calcular_tiempo_permanencia()
@@ -61,6 +123,9 @@ class Vehiculo:
 class AbonoMensual:
     """Clase que representa un abono mensual para un vehículo"""
     
+    __slots__ = ('placa', 'propietario', 'tipo_vehiculo', 'telefono', 'email', 'fecha_inicio',
+                 'fecha_vencimiento', 'activo', 'monto_pagado', 'descuento_aplicado')
+    
     def __init__(self, placa, propietario, tipo_vehiculo="auto", telefono="", email=""):
         """
         Inicializa un nuevo abono mensual
@@ -105,6 +170,40 @@ class AbonoMensual:
         """Cancela el abono mensual"""
         self.activo = False
     
+    def a_dict(self):
+        """Convierte el abono en un diccionario serializable a JSON"""
+        return {
+            'placa': self.placa,
+            'propietario': self.propietario,
+            'tipo_vehiculo': self.tipo_vehiculo,
+            'telefono': self.telefono,
+            'email': self.email,
+            'fecha_inicio': self.fecha_inicio.isoformat() if self.fecha_inicio else None,
+            'fecha_vencimiento': self.fecha_vencimiento.isoformat() if self.fecha_vencimiento else None,
+            'activo': self.activo,
+            'monto_pagado': self.monto_pagado,
+            'descuento_aplicado': self.descuento_aplicado
+        }
+
+    @classmethod
+    def desde_dict(cls, datos):
+        """Reconstruye un abono a partir de un diccionario generado por a_dict"""
+        abono = cls(
+            datos['placa'],
+            datos['propietario'],
+            datos.get('tipo_vehiculo', 'auto'),
+            datos.get('telefono', ''),
+            datos.get('email', '')
+        )
+        if datos.get('fecha_inicio'):
+            abono.fecha_inicio = _fecha(datos['fecha_inicio'])
+        if datos.get('fecha_vencimiento'):
+            abono.fecha_vencimiento = _fecha(datos['fecha_vencimiento'])
+        abono.activo = datos.get('activo', True)
+        abono.monto_pagado = datos.get('monto_pagado', 0)
+        abono.descuento_aplicado = datos.get('descuento_aplicado', 10)
+        return abono
+    
     def __str__(self):
         estado = "Vigente" if self.esta_vigente() else "Vencido"
         dias = self.dias_restantes()
@@ -112,46 +211,185 @@ class AbonoMensual:
                f"Propietario: {self.propietario} | Estado: {estado} | Días restantes: {dias}"
 
 
+def sincronizado(metodo):
+    """
+    Decorador para los métodos que modifican el estado del estacionamiento
+    
+    Las escrituras se serializan con el lock de la instancia. Las lecturas no
+    lo toman: los diccionarios compartidos se reemplazan por copias nuevas en
+    cada cambio (copy-on-write), así que un lector siempre recorre una versión
+    completa y estable.
+    """
+    @wraps(metodo)
+    def envoltura(self, *args, **kwargs):
+        with self._lock:
+            return metodo(self, *args, **kwargs)
+    return envoltura
+
+
+def transaccional(metodo):
+    """
+    Decorador para las mutaciones: además del lock de la instancia toma la
+    transacción exclusiva del backend y refresca el estado si otro proceso lo
+    cambió, así la verificación y la escritura se hacen sobre datos al día.
+    """
+    @wraps(metodo)
+    def envoltura(self, *args, **kwargs):
+        with self._lock, self.almacenamiento.transaccion():
+            self.sincronizar()
+            return metodo(self, *args, **kwargs)
+    return envoltura
+
+
+def instrumentado(metodo):
+    """
+    Decorador que registra la duración de cada llamada, incluida la espera del
+    lock, en el histograma estacionamiento_operacion_segundos (ver /metrics)
+    """
+    return medir(REGISTRO.histograma('estacionamiento_operacion_segundos',
+                                     'Duración de las operaciones del estacionamiento',
+                                     operacion=metodo.__name__))(metodo)
+
+
 class Estacionamiento:
     """Clase principal que gestiona el estacionamiento"""
     
-    def __init__(self, capacidad_total=50, nombre="Estacionamiento Principal"):
+    # Registros recientes del historial que se conservan en memoria; el
+    # historial completo se consulta en el backend con consultar_historial()
+    HISTORIAL_EN_MEMORIA = 100
+    
+    DESCUENTO_ABONO = 0.10  # 10% de descuento con abono mensual vigente
+    
+    # Adelanto máximo aceptado en la hora informada por una barrera (relojes desfasados)
+    TOLERANCIA_RELOJ = timedelta(minutes=5)
+    
+    # Atraso máximo aceptado en la hora informada: lo que una barrera puede
+    # pasar sin conexión acumulando eventos (ver agente_puerta.py)
+    MAX_ATRASO_EVENTO = timedelta(days=7)
+    
+    # Claves de idempotencia recordadas (ver registrar_ingreso y registrar_egreso)
+    CLAVES_RETENIDAS = 10000
+    
+    # Tipos de coincidencia de buscar_placas, de mejor a peor
+    ORDEN_COINCIDENCIAS = ('exacta', 'prefijo', 'sufijo', 'aproximada')
+    
+    def __init__(self, capacidad_total=50, nombre="Estacionamiento Principal",
+                 archivo_datos="estacionamiento_datos.json", modo_persistencia="completo",
+                 durabilidad="siempre", intervalo_grupo_ms=50, almacenamiento=None,
+                 politica_espacios="menor_primero", configuracion_espacios=None,
+                 formato_snapshot="json"):
         """
         Inicializa el estacionamiento
         
         Args:
             capacidad_total (int): Número máximo de espacios
             nombre (str): Nombre del estacionamiento
+            archivo_datos (str): Archivo JSON donde se persisten los datos
+            modo_persistencia (str): 'completo' reescribe el archivo en cada cambio,
+                'diario' anexa cada cambio a un diario y compacta periódicamente
+            durabilidad (str): Política de fsync: 'siempre', 'grupo' (un fsync por
+                ventana de `intervalo_grupo_ms`) o 'sistema' (sin fsync)
+            intervalo_grupo_ms (int): Ventana de agrupación para la política 'grupo'
+            formato_snapshot (str): 'json' o 'binario' (ver snapshot_binario.py)
+            almacenamiento (Almacenamiento): Backend de almacenamiento a usar; si no
+                se indica se usa AlmacenamientoJSON con los parámetros anteriores
+            politica_espacios (str): 'menor_primero' o 'rotativo'
+            configuracion_espacios (list): Bloques de espacios por nivel, zona y tipo
+                (ver InventarioEspacios.desde_configuracion); si se indica, define
+                la capacidad. Por defecto todos los espacios admiten cualquier vehículo
         """
+        self._lock = threading.RLock()  # Serializa las escrituras (ver sincronizado)
         self.nombre = nombre
         self.capacidad_total = capacidad_total
         self.vehiculos_actuales = {}  # placa -> Vehiculo
-        self.historial = []  # Lista de todos los vehículos que han pasado
+        self.historial = []  # Vehículos que salieron recientemente
         self.espacios_ocupados = set()
+        self.politica_espacios = politica_espacios
+        self.configuracion_espacios = configuracion_espacios
+        self.inventario = None  # Se construye al cargar los datos
         self.abonos_mensuales = {}  # placa -> AbonoMensual
+        self.indice_abonos = None  # Abonos ordenados por vencimiento; se arma al cargar
+        self.indice_placas = IndicePlacas()  # Placas conocidas, para buscar_placas
+        self.metricas = None  # Contadores en vivo; se arman al cargar los datos
+        self.canal = CanalEventos()  # Publica cada mutación a los suscriptores
+        self._cambios = deque(maxlen=1000)  # (versión, tipo, placa) de las últimas mutaciones
+        self._version_base = 0  # Versión desde la que _cambios está completo
+        self._planes_tarifa = {}  # placa -> plan de tarifa vigente hasta su próximo cambio
+        self.claves_aplicadas = OrderedDict()  # id_evento -> (tipo, placa, espacio o tarifa)
+        self._ultimas_salidas = {}  # placa -> última salida dentro de MAX_ATRASO_EVENTO
+        self._tope_salidas = 1000  # Tamaño de _ultimas_salidas que dispara la poda
         
-        # Tarifas por hora según el tipo de vehículo
-        self.tarifas = {
+        # Tarifas por hora según el tipo de vehículo (primera versión del motor de tarifas)
+        self.motor_tarifas = MotorTarifas.inicial({
             'moto': 1500,      # $1500 por hora
             'auto': 2500,      # $2500 por hora
             'camioneta': 3500  # $3500 por hora
-        }
+        })
+        
+        # Backend para persistir datos
+        self.archivo_datos = archivo_datos
+        self.secuencia = 0  # Número del último evento persistido
+        if almacenamiento is None:
+            almacenamiento = AlmacenamientoJSON(archivo_datos, modo_persistencia,
+                                                durabilidad, intervalo_grupo_ms, formato_snapshot)
+        self.almacenamiento = almacenamiento
+        self.almacenamiento.vincular(self.exportar_estado)
+        atexit.register(self.cerrar)
         
-        # Archivo para persistir datos
-        self.archivo_datos = "estacionamiento_datos.json"
         self.cargar_datos()
     
+    @property
+    def tarifas(self):
+        """Tarifas por hora vigentes ahora (solo lectura; se cambian con cambiar_tarifas)"""
+        return self.motor_tarifas.vigente().tarifas
+    
     def espacios_disponibles(self):
         """Retorna el número de espacios disponibles"""
-        return self.capacidad_total - len(self.vehiculos_actuales)
+        return self.metricas.disponibles
+    
+    @instrumentado
+    def asignar_espacio(self, tipo_vehiculo=None, nivel=None):
+        """
+        Asigna un espacio disponible y lo marca como ocupado
+        
+        Args:
+            tipo_vehiculo (str): Tipo de vehículo; se prefieren los espacios reservados para él
+            nivel (int): Nivel preferido, o None para cualquiera
+        """
+        espacio = self.inventario.asignar(tipo_vehiculo, nivel)
+        if espacio is not None:
+            self.espacios_ocupados.add(espacio)
+        return espacio
     
-    def asignar_espacio(self):
-        """Asigna un espacio disponible"""
-        for i in range(1, self.capacidad_total + 1):
-            if i not in self.espacios_ocupados:
-                return i
-        return None
+    def _ocupar_espacio(self, espacio):
+        """Marca como ocupado un espacio conocido (al cargar o reproducir datos)"""
+        if espacio:
+            self.espacios_ocupados.add(espacio)
+            if self.inventario is not None:
+                self.inventario.ocupar(espacio)
     
+    def _liberar_espacio(self, espacio):
+        """Libera un espacio en el conjunto de ocupados y en el inventario"""
+        if espacio:
+            self.espacios_ocupados.discard(espacio)
+            self.inventario.liberar(espacio)
+    
+    def _reconstruir_inventario(self):
+        """Reconstruye el inventario de espacios y marca los ocupados"""
+        if self.configuracion_espacios:
+            self.inventario = InventarioEspacios.desde_configuracion(self.configuracion_espacios,
+                                                                     self.politica_espacios)
+            self.capacidad_total = self.inventario.capacidad
+        else:
+            self.inventario = InventarioEspacios.uniforme(self.capacidad_total, self.politica_espacios)
+        for espacio in self.espacios_ocupados:
+            self.inventario.ocupar(espacio)
+    
+    def ocupacion_por_pool(self):
+        """Ocupación por nivel, zona y tipo de espacio, tomada de los contadores del inventario"""
+        return self.inventario.ocupacion_por_pool()
+    
+    @instrumentado
     def calcular_tarifa(self, vehiculo):
         """
         Calcula la tarifa a pagar por un vehículo
@@ -162,23 +400,87 @@ class Estacionamiento:
         Returns:
             float: Monto a pagar
         """
-        tiempo_permanencia = vehiculo.calcular_tiempo_permanencia()
-        horas = tiempo_permanencia.total_seconds() / 3600
+        return self.obtener_plan_tarifa(vehiculo)['monto']
+    
+    def obtener_plan_tarifa(self, vehiculo):
+        """
+        Obtiene el plan de tarifa de un vehículo, reutilizándolo hasta su próximo cambio
+        
+        La tarifa solo cambia al cumplirse cada hora de permanencia (o al vencer
+        el abono), así que el plan calculado se guarda hasta ese momento.
+        Cambiar las tarifas o el abono de la placa lo descarta (ver persistir_evento).
+        """
+        if vehiculo.hora_salida is not None:
+            return self.plan_tarifa(vehiculo, vehiculo.hora_salida)
+        
+        ahora = datetime.now()
+        plan = self._planes_tarifa.get(vehiculo.placa)
+        if (plan is not None and plan['hora_entrada'] == vehiculo.hora_entrada
+                and plan['proximo_cambio'] is not None and ahora <= plan['proximo_cambio']):
+            return plan
+        
+        plan = self.plan_tarifa(vehiculo, ahora)
+        self._planes_tarifa[vehiculo.placa] = plan
+        return plan
+    
+    def plan_tarifa(self, vehiculo, ahora):
+        """
+        Calcula la tarifa de un vehículo y hasta cuándo sigue valiendo
+        
+        Se cobra con la versión de tarifas a la que quedó ligado el vehículo al
+        ingresar. Si esa versión no tiene franjas ni tope para su tipo, con la
+        hora de entrada, la tarifa por hora y el factor de descuento un cliente
+        puede calcular la tarifa en cualquier momento sin volver a consultar al
+        servidor; si no, tarifa_hora es None y el monto vale hasta proximo_cambio.
+        
+        Args:
+            vehiculo (Vehiculo): El vehículo para calcular la tarifa
+            ahora (datetime): Momento del cálculo
+            
+        Returns:
+            dict: hora_entrada, version_tarifa, tarifa_hora (o None),
+                factor_descuento, horas_cobradas, monto, abono_vence (o None) y
+                proximo_cambio (o None)
+        """
+        if vehiculo.hora_entrada:
+            horas = (ahora - vehiculo.hora_entrada).total_seconds() / 3600
+        else:
+            horas = 0
         
         # Se cobra mínimo 1 hora, y se redondea hacia arriba
         horas_a_cobrar = max(1, int(horas) + (1 if horas % 1 > 0 else 0))
         
-        tarifa_por_hora = self.tarifas.get(vehiculo.tipo_vehiculo, self.tarifas['auto'])
-        tarifa_base = horas_a_cobrar * tarifa_por_hora
+        tabla = self.motor_tarifas.tabla_de(vehiculo)
+        tarifa_base = tabla.cobrar(vehiculo.tipo_vehiculo, vehiculo.hora_entrada or ahora, horas_a_cobrar)
         
         # Aplicar descuento si el vehículo tiene abono mensual vigente
-        if self.tiene_abono_vigente(vehiculo.placa):
-            descuento = tarifa_base * 0.10  # 10% de descuento
-            return tarifa_base - descuento
+        abono_vence = self.indice_abonos.vencimiento(vehiculo.placa)
+        monto = tarifa_base
+        if abono_vence is not None:
+            monto = tarifa_base - tarifa_base * self.DESCUENTO_ABONO
+        
+        # El monto se mantiene hasta completar la hora cobrada o hasta que vence el abono
+        proximo_cambio = None
+        if vehiculo.hora_entrada:
+            proximo_cambio = vehiculo.hora_entrada + timedelta(hours=horas_a_cobrar)
+            if abono_vence is not None and abono_vence < proximo_cambio:
+                proximo_cambio = abono_vence
         
-        return tarifa_base
+        return {
+            'hora_entrada': vehiculo.hora_entrada,
+            'version_tarifa': tabla.numero,
+            'tarifa_hora': tabla.tarifa_plana(vehiculo.tipo_vehiculo),
+            'factor_descuento': 1 - self.DESCUENTO_ABONO if abono_vence is not None else 1,
+            'horas_cobradas': horas_a_cobrar,
+            'monto': monto,
+            'abono_vence': abono_vence,
+            'proximo_cambio': proximo_cambio
+        }
     
-    def registrar_ingreso(self, placa, tipo_vehiculo, propietario=""):
+    @instrumentado
+    @transaccional
+    def registrar_ingreso(self, placa, tipo_vehiculo, propietario="", nivel=None, momento=None,
+                          id_evento=None):
         """
         Registra el ingreso de un vehículo al estacionamiento
         
@@ -186,20 +488,36 @@ class Estacionamiento:
             placa (str): Placa del vehículo
             tipo_vehiculo (str): Tipo de vehículo
             propietario (str): Propietario del vehículo
+            nivel (int): Nivel preferido (opcional)
+            momento (datetime): Hora de entrada informada por la barrera (por defecto, ahora)
+            id_evento (str): Clave de idempotencia; si ya se aplicó un evento con
+                esta clave no se repite y se devuelve su resultado
             
         Returns:
             tuple: (éxito, mensaje, espacio_asignado)
         """
-        placa = placa.upper().strip()
+        if id_evento is not None and id_evento in self.claves_aplicadas:
+            return self._resultado_repetido(id_evento)
+        
+        placa = normalizar_placa(placa)
         
         # Validaciones
         if not placa:
             return False, "La placa no puede estar vacía", None
         
+        if momento is not None:
+            if momento > datetime.now() + self.TOLERANCIA_RELOJ:
+                return False, "La hora de entrada está en el futuro", None
+            if momento < datetime.now() - self.MAX_ATRASO_EVENTO:
+                return False, "La hora de entrada es demasiado antigua", None
+            ultima_salida = self._ultimas_salidas.get(placa)
+            if ultima_salida is not None and momento < ultima_salida:
+                return False, f"La hora de entrada de {placa} es anterior a su última salida", None
+        
         if placa in self.vehiculos_actuales:
             return False, f"El vehículo con placa {placa} ya está en el estacionamiento", None
         
-        if len(self.vehiculos_actuales) >= self.capacidad_total:
+        if self.metricas.ocupados >= self.capacidad_total:
             return False, "El estacionamiento está lleno", None
         
         if tipo_vehiculo.lower() not in self.tarifas:
@@ -207,32 +525,46 @@ class Estacionamiento:
         
         # Crear el vehículo y asignar espacio
         vehiculo = Vehiculo(placa, tipo_vehiculo, propietario)
-        espacio = self.asignar_espacio()
+        espacio = self.asignar_espacio(vehiculo.tipo_vehiculo, nivel)
         
         if espacio is None:
-            return False, "No hay espacios disponibles", None
+            if nivel is not None:
+                return False, f"No hay espacios disponibles para {vehiculo.tipo_vehiculo} en el nivel {nivel}", None
+            return False, f"No hay espacios disponibles para {vehiculo.tipo_vehiculo}", None
         
         # Registrar ingreso
-        vehiculo.ingresar(espacio)
-        self.vehiculos_actuales[placa] = vehiculo
-        self.espacios_ocupados.add(espacio)
+        vehiculo.ingresar(espacio, momento)
+        vehiculo.version_tarifa = self.motor_tarifas.vigente(vehiculo.hora_entrada).numero
+        self.vehiculos_actuales = {**self.vehiculos_actuales, placa: vehiculo}
+        self.metricas.ingreso(vehiculo.tipo_vehiculo)
         
         # Guardar datos
-        self.guardar_datos()
+        datos = vehiculo.a_dict()
+        if id_evento is not None:
+            datos['id_evento'] = id_evento
+        self.persistir_evento('ingreso', datos)
         
         return True, f"Vehículo ingresado exitosamente en el espacio {espacio}", espacio
     
-    def registrar_egreso(self, placa):
+    @instrumentado
+    @transaccional
+    def registrar_egreso(self, placa, momento=None, id_evento=None):
         """
         Registra el egreso de un vehículo del estacionamiento
         
         Args:
             placa (str): Placa del vehículo a dar salida
+            momento (datetime): Hora de salida informada por la barrera (por defecto, ahora)
+            id_evento (str): Clave de idempotencia; si ya se aplicó un evento con
+                esta clave no se cobra de nuevo y se devuelve la tarifa cobrada
             
         Returns:
             tuple: (éxito, mensaje, tarifa_a_pagar)
         """
-        placa = placa.upper().strip()
+        if id_evento is not None and id_evento in self.claves_aplicadas:
+            return self._resultado_repetido(id_evento)
+        
+        placa = normalizar_placa(placa)
         
         if not placa:
             return False, "La placa no puede estar vacía", 0
@@ -240,24 +572,35 @@ class Estacionamiento:
         if placa not in self.vehiculos_actuales:
             return False, f"El vehículo con placa {placa} no se encuentra en el estacionamiento", 0
         
-        # Obtener el vehículo y calcular tarifa
         vehiculo = self.vehiculos_actuales[placa]
-        tarifa = self.calcular_tarifa(vehiculo)
+        if momento is not None:
+            if momento > datetime.now() + self.TOLERANCIA_RELOJ:
+                return False, "La hora de salida está en el futuro", 0
+            if momento < datetime.now() - self.MAX_ATRASO_EVENTO:
+                return False, "La hora de salida es demasiado antigua", 0
+            if momento < vehiculo.hora_entrada:
+                return False, f"La hora de salida de {placa} es anterior a su ingreso", 0
         
-        # Registrar egreso
-        vehiculo.egresar()
+        # Registrar egreso y calcular la tarifa hasta la hora de salida
+        vehiculo.egresar(momento)
+        tarifa = self.calcular_tarifa(vehiculo)
         vehiculo.tarifa_pagada = tarifa
         
         # Liberar espacio
-        if vehiculo.espacio_asignado:
-            self.espacios_ocupados.discard(vehiculo.espacio_asignado)
+        self._liberar_espacio(vehiculo.espacio_asignado)
         
         # Mover al historial y quitar de vehículos actuales
-        self.historial.append(vehiculo)
-        del self.vehiculos_actuales[placa]
+        self._agregar_al_historial(vehiculo)
+        vehiculos = dict(self.vehiculos_actuales)
+        del vehiculos[placa]
+        self.vehiculos_actuales = vehiculos
+        self.metricas.egreso(vehiculo.tipo_vehiculo, tarifa)
         
         # Guardar datos
-        self.guardar_datos()
+        datos = vehiculo.a_dict()
+        if id_evento is not None:
+            datos['id_evento'] = id_evento
+        self.persistir_evento('egreso', datos)
         
         tiempo = vehiculo.calcular_tiempo_permanencia()
         horas = int(tiempo.total_seconds() // 3600)
@@ -269,12 +612,77 @@ class Estacionamiento:
         
         return True, mensaje, tarifa
     
+    def _recordar_clave(self, tipo, datos):
+        """Registra la clave de idempotencia de un ingreso o egreso aplicado"""
+        if not datos.get('id_evento'):
+            return
+        valor = datos['tarifa_pagada'] if tipo == 'egreso' else datos.get('espacio_asignado')
+        self.claves_aplicadas[datos['id_evento']] = (tipo, datos['placa'], valor)
+        while len(self.claves_aplicadas) > self.CLAVES_RETENIDAS:
+            self.claves_aplicadas.popitem(last=False)
+    
+    def _resultado_repetido(self, id_evento):
+        """Resultado de un evento que ya se había aplicado"""
+        tipo, placa, valor = self.claves_aplicadas[id_evento]
+        return True, f"El {tipo} de {placa} ({id_evento}) ya estaba registrado", valor
+    
+    @contextmanager
+    def lote(self):
+        """
+        Contexto para aplicar varias mutaciones con una sola escritura
+        
+        Las mutaciones hechas dentro del contexto se aplican en memoria una a
+        una, como siempre, pero el backend las persiste juntas al salir (una
+        transacción en SQLite, un solo anexo y fsync del diario o un solo
+        snapshot en JSON).
+        """
+        with self._lock, self.almacenamiento.transaccion(), self.almacenamiento.lote():
+            self.sincronizar()
+            yield
+    
+    @instrumentado
+    def procesar_lote(self, eventos):
+        """
+        Aplica en orden una lista de ingresos y egresos informados por las barreras
+        
+        Args:
+            eventos (list): Diccionarios con 'tipo' ('ingreso' o 'egreso'),
+                'placa', 'momento' (ISO 8601, opcional), 'id_evento' (clave de
+                idempotencia, opcional) y, para los ingresos, 'tipo_vehiculo',
+                'propietario' y 'nivel'
+            
+        Returns:
+            list: (éxito, mensaje, valor) por evento, donde valor es el espacio
+                asignado en un ingreso o la tarifa en un egreso
+        """
+        with self.lote():
+            return [self._procesar_evento_lote(evento) for evento in eventos]
+    
+    def _procesar_evento_lote(self, evento):
+        try:
+            tipo = evento.get('tipo')
+            momento = evento.get('momento')
+            if momento:
+                momento = hora_local(datetime.fromisoformat(momento))
+            
+            if tipo == 'ingreso':
+                return self.registrar_ingreso(evento.get('placa', ''), evento.get('tipo_vehiculo', ''),
+                                              evento.get('propietario', ''), evento.get('nivel'),
+                                              momento or None, evento.get('id_evento'))
+            if tipo == 'egreso':
+                return self.registrar_egreso(evento.get('placa', ''), momento or None,
+                                             evento.get('id_evento'))
+            return False, f"Tipo de evento no válido: {tipo}", None
+        except (AttributeError, TypeError, ValueError) as e:
+            return False, f"Evento no válido: {e}", None
+    
+    @instrumentado
     def consultar_vehiculo(self, placa):
         """Consulta el estado de un vehículo en el estacionamiento"""
-        placa = placa.upper().strip()
+        placa = normalizar_placa(placa)
         
-        if placa in self.vehiculos_actuales:
-            vehiculo = self.vehiculos_actuales[placa]
+        vehiculo = self.vehiculos_actuales.get(placa)
+        if vehiculo:
             tiempo_actual = vehiculo.calcular_tiempo_permanencia()
             tarifa_actual = self.calcular_tarifa(vehiculo)
             
@@ -294,11 +702,12 @@ class Estacionamiento:
         else:
             return False, f"El vehículo con placa {placa} no se encuentra en el estacionamiento"
     
+    @instrumentado
     def obtener_estado_general(self):
         """Obtiene el estado general del estacionamiento"""
-        ocupados = len(self.vehiculos_actuales)
-        disponibles = self.espacios_disponibles()
-        porcentaje_ocupacion = (ocupados / self.capacidad_total) * 100
+        ocupados = self.metricas.ocupados
+        disponibles = self.metricas.disponibles
+        porcentaje_ocupacion = self.metricas.porcentaje_ocupacion
         
         estado = f"=== ESTADO DEL ESTACIONAMIENTO ===\n"
         estado += f"Nombre: {self.nombre}\n"
@@ -314,135 +723,548 @@ class Estacionamiento:
         
         return estado
     
-    def cambiar_tarifas(self, nuevas_tarifas):
-        """Permite modificar las tarifas del estacionamiento"""
-        for tipo, tarifa in nuevas_tarifas.items():
-            if tipo in self.tarifas:
-                self.tarifas[tipo] = tarifa
-        self.guardar_datos()
+    @instrumentado
+    @transaccional
+    def cambiar_tarifas(self, nuevas_tarifas, vigente_desde=None, franjas=None, topes_diarios=None):
+        """
+        Crea una nueva versión de tarifas; los vehículos que ya están dentro
+        siguen pagando con la versión vigente cuando ingresaron
+        
+        Args:
+            nuevas_tarifas (dict): Tarifas por hora que cambian, por tipo de vehículo
+            vigente_desde (datetime): Desde cuándo aplica (por defecto, ahora);
+                no puede ser una fecha pasada. Si tiene zona horaria se lleva a
+                la hora local
+            franjas (list): Franjas horarias (ver TablaTarifas); por defecto se
+                conservan las de la versión anterior
+            topes_diarios (dict): Topes diarios por tipo; por defecto se conservan
+            
+        Returns:
+            tuple: (éxito, mensaje)
+        """
+        ahora = datetime.now()
+        vigente_desde = hora_local(vigente_desde)
+        if vigente_desde is None:
+            vigente_desde = ahora
+        elif vigente_desde < ahora:
+            return False, "Las tarifas no pueden cambiarse con fecha pasada"
+        
+        tarifas_validas = {tipo: tarifa for tipo, tarifa in nuevas_tarifas.items() if tipo in self.tarifas}
+        try:
+            self.motor_tarifas, version = self.motor_tarifas.con_version(tarifas_validas, vigente_desde,
+                                                                         franjas, topes_diarios)
+        except (ValueError, KeyError) as e:
+            return False, f"Tarifas no válidas: {e}"
+        
+        self.persistir_evento('tarifas', {'versiones': self.motor_tarifas.a_lista()})
+        
+        if vigente_desde > ahora:
+            return True, f"Tarifas (versión {version.numero}) programadas desde {vigente_desde.strftime('%d/%m/%Y %H:%M')}"
         return True, "Tarifas actualizadas correctamente"
     
-    def guardar_datos(self):
-        """Guarda los datos del estacionamiento en un archivo JSON"""
+    def persistir_evento(self, tipo, datos):
+        """
+        Persiste una mutación del estado a través del backend de almacenamiento
+        y la publica en el canal de eventos
+        
+        Args:
+            tipo (str): Tipo de evento ('ingreso', 'egreso', 'tarifas', 'abono')
+            datos (dict): Datos del evento
+        """
+        self.secuencia += 1
+        self._anotar_evento(tipo, datos)
+        
         try:
-            datos = {
-                'nombre': self.nombre,
-                'capacidad_total': self.capacidad_total,
-                'tarifas': self.tarifas,
-                'vehiculos_actuales': {},
-                'historial_resumido': [],
-                'abonos_mensuales': {}
-            }
-            
-            # Guardar vehículos actuales
-            for placa, vehiculo in self.vehiculos_actuales.items():
-                datos['vehiculos_actuales'][placa] = {
-                    'placa': vehiculo.placa,
-                    'tipo_vehiculo': vehiculo.tipo_vehiculo,
-                    'propietario': vehiculo.propietario,
-                    'hora_entrada': vehiculo.hora_entrada.isoformat() if vehiculo.hora_entrada else None,
-                    'espacio_asignado': vehiculo.espacio_asignado
-                }
-            
-            # Guardar resumen del historial (últimos 100 registros)
-            for vehiculo in self.historial[-100:]:
-                datos['historial_resumido'].append({
-                    'placa': vehiculo.placa,
-                    'tipo_vehiculo': vehiculo.tipo_vehiculo,
-                    'hora_entrada': vehiculo.hora_entrada.isoformat() if vehiculo.hora_entrada else None,
-                    'hora_salida': vehiculo.hora_salida.isoformat() if vehiculo.hora_salida else None,
-                    'tarifa_pagada': vehiculo.tarifa_pagada
-                })
+            self.almacenamiento.registrar_evento(self.secuencia, tipo, datos)
+        except Exception as e:
+            print(f"Error al guardar datos: {e}")
+        
+        self.canal.publicar(tipo, datos)
+    
+    def _anotar_evento(self, tipo, datos):
+        """Actualiza lo que depende de cada mutación, se haya hecho aquí o en otro proceso"""
+        self._cambios.append((self.secuencia, tipo, datos.get('placa')))
+        self._recordar_clave(tipo, datos)
+        
+        # El plan de tarifa de la placa deja de valer (una versión nueva de
+        # tarifas no cambia lo que pagan los vehículos que ya están dentro)
+        self._planes_tarifa.pop(datos.get('placa'), None)
+        
+        if tipo in ('ingreso', 'abono'):
+            self.indice_placas.agregar(datos['placa'])
+    
+    def _aplicar_externo(self, secuencia, tipo, datos):
+        """
+        Aplica un evento confirmado por otro proceso igual que la mutación que
+        lo generó: contenedores nuevos para los lectores, contadores e índices
+        al día, y el evento publicado en el canal
+        
+        Args:
+            secuencia (int): Número del evento
+            tipo (str): Tipo de evento ('ingreso', 'egreso', 'tarifas', 'abono')
+            datos (dict): Datos del evento
             
-            # Guardar abonos mensuales
-            for placa, abono in self.abonos_mensuales.items():
-                datos['abonos_mensuales'][placa] = {
-                    'placa': abono.placa,
-                    'propietario': abono.propietario,
-                    'tipo_vehiculo': abono.tipo_vehiculo,
-                    'telefono': abono.telefono,
-                    'email': abono.email,
-                    'fecha_inicio': abono.fecha_inicio.isoformat() if abono.fecha_inicio else None,
-                    'fecha_vencimiento': abono.fecha_vencimiento.isoformat() if abono.fecha_vencimiento else None,
-                    'activo': abono.activo,
-                    'monto_pagado': abono.monto_pagado,
-                    'descuento_aplicado': abono.descuento_aplicado
-                }
+        Returns:
+            bool: False si el evento no encaja con el estado en memoria y hay
+            que recargarlo completo
+        """
+        placa = datos.get('placa')
+        if tipo == 'ingreso':
+            if placa in self.vehiculos_actuales:
+                return False
+            vehiculo = Vehiculo.desde_dict(datos)
+            self._ocupar_espacio(vehiculo.espacio_asignado)
+            self.vehiculos_actuales = {**self.vehiculos_actuales, placa: vehiculo}
+            self.metricas.ingreso(vehiculo.tipo_vehiculo)
+        
+        elif tipo == 'egreso':
+            if placa not in self.vehiculos_actuales:
+                return False
+            vehiculos = dict(self.vehiculos_actuales)
+            self._liberar_espacio(vehiculos.pop(placa).espacio_asignado)
+            vehiculo = Vehiculo.desde_dict(datos)
+            self._agregar_al_historial(vehiculo)
+            self.vehiculos_actuales = vehiculos
+            self.metricas.egreso(vehiculo.tipo_vehiculo, vehiculo.tarifa_pagada)
+        
+        elif tipo == 'tarifas':
+            self.motor_tarifas = MotorTarifas.desde_lista(datos['versiones'])
+        
+        elif tipo == 'abono':
+            abono = AbonoMensual.desde_dict(datos)
+            self.abonos_mensuales = {**self.abonos_mensuales, placa: abono}
+            self.indice_abonos.actualizar(abono)
+        
+        self.secuencia = secuencia
+        self._anotar_evento(tipo, datos)
+        self.canal.publicar(tipo, datos)
+        return True
+    
+    def aplicar_evento(self, tipo, datos):
+        """Aplica al estado en memoria un evento leído del diario"""
+        if tipo == 'ingreso':
+            vehiculo = Vehiculo.desde_dict(datos)
+            self.vehiculos_actuales[vehiculo.placa] = vehiculo
+            self._ocupar_espacio(vehiculo.espacio_asignado)
+            self._recordar_clave(tipo, datos)
+        
+        elif tipo == 'egreso':
+            vehiculo = self.vehiculos_actuales.pop(datos['placa'], None)
+            if vehiculo:
+                self._liberar_espacio(vehiculo.espacio_asignado)
+                self._agregar_al_historial(Vehiculo.desde_dict(datos))
+            self._recordar_clave(tipo, datos)
+        
+        elif tipo == 'tarifas':
+            if 'versiones' in datos:
+                self.motor_tarifas = MotorTarifas.desde_lista(datos['versiones'])
+            else:
+                # Diario anterior a las versiones de tarifas: tarifas planas
+                self.motor_tarifas = MotorTarifas.inicial({**self.tarifas, **datos})
+        
+        elif tipo == 'abono':
+            abono = AbonoMensual.desde_dict(datos)
+            self.abonos_mensuales[abono.placa] = abono
+    
+    @instrumentado
+    @sincronizado
+    def exportar_estado(self):
+        """Obtiene el estado completo como diccionario con el formato del snapshot"""
+        datos = {
+            'nombre': self.nombre,
+            'capacidad_total': self.capacidad_total,
+            'tarifas': dict(self.tarifas),
+            'versiones_tarifas': self.motor_tarifas.a_lista(),
+            'secuencia': self.secuencia,
+            'vehiculos_actuales': {},
+            'historial_resumido': [],
+            'abonos_mensuales': {},
+            'claves_aplicadas': [[clave, *resultado] for clave, resultado in list(self.claves_aplicadas.items())]
+        }
+        
+        # Guardar vehículos actuales
+        for placa, vehiculo in list(self.vehiculos_actuales.items()):
+            datos['vehiculos_actuales'][placa] = vehiculo.a_dict()
+        
+        # Guardar resumen del historial (últimos registros)
+        for vehiculo in self.historial[-self.HISTORIAL_EN_MEMORIA:]:
+            datos['historial_resumido'].append(vehiculo.a_dict())
+        
+        # Guardar abonos mensuales
+        for placa, abono in list(self.abonos_mensuales.items()):
+            datos['abonos_mensuales'][placa] = abono.a_dict()
+        
+        return datos
+    
+    def restaurar_estado(self, datos):
+        """
+        Restaura el estado en memoria a partir de un diccionario de snapshot
+        
+        Los contenedores se arman aparte y se reemplazan al final, de modo que
+        los lectores concurrentes nunca ven un estado a medio cargar.
+        """
+        # Restaurar configuración básica
+        self.nombre = datos.get('nombre', self.nombre)
+        self.capacidad_total = datos.get('capacidad_total', self.capacidad_total)
+        if datos.get('versiones_tarifas'):
+            self.motor_tarifas = MotorTarifas.desde_lista(datos['versiones_tarifas'])
+        elif datos.get('tarifas'):
+            self.motor_tarifas = MotorTarifas.inicial(datos['tarifas'])
+        self.secuencia = datos.get('secuencia', 0)
+        
+        # Restaurar vehículos actuales
+        vehiculos = {}
+        espacios_ocupados = set()
+        vehiculos_data = datos.get('vehiculos_actuales', {})
+        for placa, datos_vehiculo in vehiculos_data.items():
+            vehiculo = Vehiculo.desde_dict(datos_vehiculo)
             
-            with open(self.archivo_datos, 'w', encoding='utf-8') as f:
-                json.dump(datos, f, indent=2, ensure_ascii=False)
-                
+            vehiculos[placa] = vehiculo
+            if vehiculo.espacio_asignado:
+                espacios_ocupados.add(vehiculo.espacio_asignado)
+        
+        # Restaurar historial resumido
+        historial_data = datos.get('historial_resumido', [])
+        historial = [Vehiculo.desde_dict(datos_vehiculo) for datos_vehiculo in historial_data]
+        
+        # Restaurar abonos mensuales
+        abonos = {}
+        abonos_data = datos.get('abonos_mensuales', {})
+        for placa, datos_abono in abonos_data.items():
+            abonos[placa] = AbonoMensual.desde_dict(datos_abono)
+        
+        # Restaurar claves de idempotencia
+        claves = OrderedDict((clave, tuple(resultado))
+                             for clave, *resultado in datos.get('claves_aplicadas', []))
+        
+        self.vehiculos_actuales = vehiculos
+        self.espacios_ocupados = espacios_ocupados
+        self.historial = historial
+        self.abonos_mensuales = abonos
+        self.claves_aplicadas = claves
+    
+    def _agregar_al_historial(self, vehiculo):
+        """Agrega un vehículo al historial en memoria, descartando los más antiguos"""
+        self.historial.append(vehiculo)
+        self.indice_placas.agregar(vehiculo.placa)
+        if len(self.historial) > 2 * self.HISTORIAL_EN_MEMORIA:
+            del self.historial[:-self.HISTORIAL_EN_MEMORIA]
+        self._anotar_salida(vehiculo.placa, vehiculo.hora_salida)
+    
+    def _anotar_salida(self, placa, salida):
+        """Recuerda la última salida de una placa, descartando las que ya no cuentan"""
+        if salida is None:
+            return
+        anterior = self._ultimas_salidas.get(placa)
+        if anterior is None or salida > anterior:
+            self._ultimas_salidas[placa] = salida
+        if len(self._ultimas_salidas) > self._tope_salidas:
+            limite = datetime.now() - self.MAX_ATRASO_EVENTO
+            self._ultimas_salidas = {p: s for p, s in self._ultimas_salidas.items() if s >= limite}
+            self._tope_salidas = 2 * len(self._ultimas_salidas) + 1000
+    
+    def _cargar_ultimas_salidas(self):
+        """
+        Arma _ultimas_salidas con las salidas dentro de MAX_ATRASO_EVENTO, para
+        rechazar ingresos anteriores a la última salida de la placa
+        """
+        desde = datetime.now() - self.MAX_ATRASO_EVENTO
+        salidas = None
+        try:
+            salidas = self.almacenamiento.salidas_desde(
+                desde, self.MAX_ATRASO_EVENTO + self.TOLERANCIA_RELOJ)
+        except Exception as e:
+            print(f"Error al leer las últimas salidas: {e}")
+        self._ultimas_salidas = {}
+        self._tope_salidas = 1000
+        for placa, salida in (salidas or {}).items():
+            self._anotar_salida(placa, salida)
+        # El historial en memoria puede tener salidas que el backend no guarda
+        for vehiculo in self.historial:
+            if vehiculo.hora_salida is not None and vehiculo.hora_salida >= desde:
+                self._anotar_salida(vehiculo.placa, vehiculo.hora_salida)
+    
+    @instrumentado
+    @sincronizado
+    def guardar_datos(self):
+        """Guarda el estado completo del estacionamiento en el backend"""
+        try:
+            self.almacenamiento.guardar_estado(self.exportar_estado())
         except Exception as e:
             print(f"Error al guardar datos: {e}")
     
+    @instrumentado
+    @sincronizado
     def cargar_datos(self):
-        """Carga los datos del estacionamiento desde un archivo JSON"""
+        """Carga los datos del estacionamiento desde el backend y reaplica el diario"""
+        eventos = ()
         try:
-            if os.path.exists(self.archivo_datos):
-                with open(self.archivo_datos, 'r', encoding='utf-8') as f:
-                    datos = json.load(f)
-                
-                # Restaurar configuración básica
-                self.nombre = datos.get('nombre', self.nombre)
-                self.capacidad_total = datos.get('capacidad_total', self.capacidad_total)
-                self.tarifas = datos.get('tarifas', self.tarifas)
-                
-                # Restaurar vehículos actuales
-                vehiculos_data = datos.get('vehiculos_actuales', {})
-                for placa, datos_vehiculo in vehiculos_data.items():
-                    vehiculo = Vehiculo(
-                        datos_vehiculo['placa'],
-                        datos_vehiculo['tipo_vehiculo'],
-                        datos_vehiculo.get('propietario', '')
-                    )
-                    if datos_vehiculo.get('hora_entrada'):
-                        vehiculo.hora_entrada = datetime.fromisoformat(datos_vehiculo['hora_entrada'])
-                    vehiculo.espacio_asignado = datos_vehiculo.get('espacio_asignado')
-                    
-                    self.vehiculos_actuales[placa] = vehiculo
-                    if vehiculo.espacio_asignado:
-                        self.espacios_ocupados.add(vehiculo.espacio_asignado)
-                
-                # Restaurar historial resumido
-                historial_data = datos.get('historial_resumido', [])
-                for datos_vehiculo in historial_data:
-                    vehiculo = Vehiculo(
-                        datos_vehiculo['placa'],
-                        datos_vehiculo['tipo_vehiculo']
-                    )
-                    if datos_vehiculo.get('hora_entrada'):
-                        vehiculo.hora_entrada = datetime.fromisoformat(datos_vehiculo['hora_entrada'])
-                    if datos_vehiculo.get('hora_salida'):
-                        vehiculo.hora_salida = datetime.fromisoformat(datos_vehiculo['hora_salida'])
-                    vehiculo.tarifa_pagada = datos_vehiculo.get('tarifa_pagada', 0)
-                    
-                    self.historial.append(vehiculo)
-                
-                # Restaurar abonos mensuales
-                abonos_data = datos.get('abonos_mensuales', {})
-                for placa, datos_abono in abonos_data.items():
-                    abono = AbonoMensual(
-                        datos_abono['placa'],
-                        datos_abono['propietario'],
-                        datos_abono.get('tipo_vehiculo', 'auto'),
-                        datos_abono.get('telefono', ''),
-                        datos_abono.get('email', '')
-                    )
-                    if datos_abono.get('fecha_inicio'):
-                        abono.fecha_inicio = datetime.fromisoformat(datos_abono['fecha_inicio'])
-                    if datos_abono.get('fecha_vencimiento'):
-                        abono.fecha_vencimiento = datetime.fromisoformat(datos_abono['fecha_vencimiento'])
-                    abono.activo = datos_abono.get('activo', True)
-                    abono.monto_pagado = datos_abono.get('monto_pagado', 0)
-                    abono.descuento_aplicado = datos_abono.get('descuento_aplicado', 10)
-                    
-                    self.abonos_mensuales[placa] = abono
+            datos, eventos = self.almacenamiento.cargar()
+            self.restaurar_estado(datos or {})
                     
         except Exception as e:
             print(f"Error al cargar datos: {e}")
+            self._apartar_archivo_danado()
             print("Se iniciará con datos en blanco.")
+        
+        # La capacidad puede venir del snapshot: el inventario se arma después
+        self._reconstruir_inventario()
+        
+        # Reaplicar los eventos posteriores al último snapshot
+        try:
+            eventos_aplicados = 0
+            for secuencia, tipo, datos_evento in eventos:
+                if secuencia <= self.secuencia:
+                    continue  # Ya incluido en el snapshot
+                self.aplicar_evento(tipo, datos_evento)
+                self.secuencia = secuencia
+                eventos_aplicados += 1
+            
+            # Compactar para que el próximo arranque no repita la reproducción
+            if eventos_aplicados:
+                self.guardar_datos()
+        except Exception as e:
+            print(f"Error al reproducir el diario: {e}")
+        
+        self._recalcular_metricas()
+        self._cargar_ultimas_salidas()
+        
+        # Los cambios anteriores a esta carga no se conocen uno por uno
+        self._cambios = deque(maxlen=self._cambios.maxlen)
+        self._version_base = self.secuencia
+        self._planes_tarifa = {}
+    
+    @instrumentado
+    @sincronizado
+    def reemplazar_estado(self, datos):
+        """
+        Reemplaza todo el estado por el de otro estacionamiento y lo guarda
+        
+        Lo usan las réplicas locales (ver agente_puerta.py) para copiar el
+        estado del servidor central.
+        
+        Args:
+            datos (dict): Estado con el formato del snapshot (ver exportar_estado)
+        """
+        self.restaurar_estado(datos)
+        self._reconstruir_inventario()
+        self._recalcular_metricas()
+        self._cargar_ultimas_salidas()
+        self._cambios = deque(maxlen=self._cambios.maxlen)
+        self._version_base = self.secuencia
+        self._planes_tarifa = {}
+        self.guardar_datos()
+        self.canal.publicar('recarga', {})
+    
+    def _recalcular_metricas(self):
+        """Arma los contadores en vivo recorriendo el estado cargado una sola vez"""
+        self.indice_abonos = IndiceAbonos(self.abonos_mensuales.values())
+        # El historial entra al índice al cargar; después cada egreso agrega su placa
+        # (ver _agregar_al_historial), así buscar_placas no modifica el índice
+        self.indice_placas.agregar_varias(itertools.chain(self.vehiculos_actuales, self.abonos_mensuales,
+                                                          self.almacenamiento.placas_historial() or ()))
+        self.metricas = MetricasEnVivo.desde_estado(self.capacidad_total,
+                                                    self.tarifas.keys(),
+                                                    self.vehiculos_actuales.values(),
+                                                    self.indice_abonos,
+                                                    self._resumen_historial_backend())
+    
+    @property
+    def version(self):
+        """
+        Versión del estado: crece con cada mutación y se conserva entre
+        reinicios y entre procesos, porque es la secuencia de eventos persistida
+        """
+        return self.secuencia
+    
+    def cambios_desde(self, version):
+        """
+        Placas que entraron o salieron después de una versión
+        
+        Args:
+            version (int): Versión que ya conoce el cliente
+            
+        Returns:
+            tuple: (placas agregadas o modificadas, placas quitadas), o None si
+                los cambios no se conocen uno por uno (versión muy antigua o
+                de otra carga) y el cliente debe pedir la lista completa
+        """
+        cambios = list(self._cambios)
+        if version < self._version_base or version > self.secuencia:
+            return None
+        if cambios and version < cambios[0][0] - 1:
+            return None  # Los cambios intermedios ya se descartaron
+        
+        tocadas = {}  # placa -> True si entró o salió (False si solo cambió su abono)
+        for version_cambio, tipo, placa in cambios:
+            if version_cambio <= version:
+                continue
+            if placa is None:
+                continue  # Tarifas: no cambian lo que pagan los vehículos que ya están dentro
+            tocadas[placa] = tocadas.get(placa, False) or tipo in ('ingreso', 'egreso')
+        
+        vehiculos = self.vehiculos_actuales
+        agregados = [placa for placa in tocadas if placa in vehiculos]
+        quitados = [placa for placa, movida in tocadas.items() if movida and placa not in vehiculos]
+        return agregados, quitados
+    
+    @instrumentado
+    def obtener_metricas(self):
+        """
+        Obtiene los contadores en vivo sin recorrer vehículos, historial ni abonos
+        
+        Returns:
+            dict: Ocupación, vehículos por tipo, recaudación y conteo de abonos
+        """
+        return self.metricas.a_dict()
+    
+    @instrumentado
+    def sincronizar(self):
+        """
+        Pone al día el estado si otro proceso lo modificó
+        
+        Con un backend compartido (SQLite) cada proceso mantiene su propia copia
+        en memoria; esta verificación es una consulta de costo constante. Si
+        hubo commits de otros procesos se aplican solo sus eventos, y el estado
+        se recarga completo únicamente cuando el backend ya no los conserva uno
+        por uno. La verificación se repite con el lock de la instancia tomado,
+        de modo que la puesta al día y la mutación que la pidió (ver
+        transaccional) no se separan.
+        
+        Returns:
+            bool: True si se aplicaron cambios de otros procesos
+        """
+        if not self.almacenamiento.hay_cambios_externos():
+            return False
+        with self._lock:
+            # Otro hilo pudo ponerse al día mientras se esperaba el lock
+            if not self.almacenamiento.hay_cambios_externos():
+                return False
+            eventos = self.almacenamiento.eventos_desde(self.secuencia)
+            if eventos is not None and all(self._aplicar_externo(*evento) for evento in eventos):
+                return True
+            self.cargar_datos()
+        # Los cambios no se conocen uno por uno: los suscriptores releen el estado
+        self.canal.publicar('recarga', {})
+        return True
+    
+    @instrumentado
+    def consultar_historial(self, limite=20, antes_de=None):
+        """
+        Consulta el historial del más reciente al más antiguo, por páginas
+        
+        Args:
+            limite (int): Cantidad máxima de registros
+            antes_de: Cursor devuelto por la consulta anterior (None para empezar)
+            
+        Returns:
+            tuple: (lista de Vehiculo, cursor para la página siguiente o None)
+        """
+        resultado = self.almacenamiento.consultar_historial(limite, antes_de)
+        if resultado is not None:
+            registros, cursor = resultado
+            return [Vehiculo.desde_dict(registro) for registro in registros], cursor
+        
+        # El backend no guarda todo el historial: se pagina sobre la memoria
+        fin = len(self.historial) if antes_de is None else antes_de
+        inicio = max(0, fin - limite)
+        pagina = self.historial[inicio:fin][::-1]
+        return pagina, (inicio if inicio > 0 else None)
+    
+    def resumen_historial(self):
+        """
+        Returns:
+            tuple: (cantidad de registros, total recaudado)
+        """
+        return self.metricas.egresos, self.metricas.recaudado
+    
+    @instrumentado
+    def columnas_historial(self):
+        """
+        Columnas del historial completo para los reportes (ver analitica.py)
+        
+        Returns:
+            ColumnasHistorial: Entrada, salida, tipo y tarifa de cada registro
+        """
+        columnas = self.almacenamiento.columnas_historial()
+        if columnas is not None:
+            return columnas
+        
+        # El backend no guarda todo el historial: se usa el de memoria
+        columnas = ColumnasHistorial()
+        for vehiculo in list(self.historial):
+            columnas.agregar(vehiculo.a_dict())
+        return columnas
+    
+    @instrumentado
+    def buscar_placas(self, texto, limite=20):
+        """
+        Busca una placa completa, parcial o mal leída entre los vehículos
+        estacionados, los abonos y el historial (ver indice_placas.py)
+        
+        Args:
+            texto (str): Lo escrito por el operador
+            limite (int): Cantidad máxima de resultados
+            
+        Returns:
+            list: Un diccionario por placa con el tipo de coincidencia y si el
+            vehículo está estacionado o tiene abono, de mejor a peor
+        """
+        vehiculos = self.vehiculos_actuales
+        abonos = self.abonos_mensuales
+        resultados = []
+        for placa, coincidencia in self.indice_placas.buscar(texto, limite):
+            vehiculo = vehiculos.get(placa)
+            registro = vehiculo or abonos.get(placa)
+            resultados.append({
+                'placa': placa,
+                'coincidencia': coincidencia,
+                'estacionado': vehiculo is not None,
+                'espacio': vehiculo.espacio_asignado if vehiculo else None,
+                'tipo_vehiculo': registro.tipo_vehiculo if registro else None,
+                'abono_vigente': self.indice_abonos.esta_vigente(placa)
+            })
+        
+        # Con la misma coincidencia, primero los vehículos estacionados
+        resultados.sort(key=lambda r: (self.ORDEN_COINCIDENCIAS.index(r['coincidencia']), not r['estacionado']))
+        return resultados
+    
+    @sincronizado
+    def entradas_actuales(self):
+        """
+        Returns:
+            list: Hora de entrada de cada vehículo estacionado
+        """
+        return [vehiculo.hora_entrada for vehiculo in self.vehiculos_actuales.values()]
+    
+    def _resumen_historial_backend(self):
+        """Cantidad y total del historial según el backend (solo al cargar)"""
+        resumen = self.almacenamiento.resumen_historial()
+        if resumen is not None:
+            return resumen
+        return len(self.historial), sum(v.tarifa_pagada for v in self.historial)
+    
+    def _apartar_archivo_danado(self):
+        """Renombra un archivo de datos ilegible para que el próximo guardado no lo pise"""
+        if not isinstance(self.almacenamiento, AlmacenamientoJSON):
+            return
+        ruta = self.almacenamiento.ruta_snapshot
+        if not os.path.exists(ruta):
+            return
+        destino = f"{ruta}.danado-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        try:
+            os.replace(ruta, destino)
+            print(f"El archivo dañado se conservó como {destino}")
+        except OSError as e:
+            print(f"No se pudo conservar el archivo dañado: {e}")
+    
+    def cerrar(self):
+        """Escribe los cambios pendientes y libera los recursos del backend"""
+        self.almacenamiento.cerrar()
     
     # Métodos para gestión de abonos mensuales
+    @instrumentado
+    @transaccional
     def registrar_abono_mensual(self, placa, propietario, tipo_vehiculo="auto", telefono="", email=""):
         """
         Registra un nuevo abono mensual
@@ -457,7 +1279,7 @@ class Estacionamiento:
         Returns:
             tuple: (éxito, mensaje, abono)
         """
-        placa = placa.upper().strip()
+        placa = normalizar_placa(placa)
         tipo_vehiculo = tipo_vehiculo.lower().strip()
         
         # Validaciones
@@ -470,7 +1292,7 @@ class Estacionamiento:
         if tipo_vehiculo not in self.tarifas:
             return False, f"Tipo de vehículo no válido. Tipos permitidos: {list(self.tarifas.keys())}", None
         
-        if placa in self.abonos_mensuales and self.abonos_mensuales[placa].esta_vigente():
+        if self.indice_abonos.esta_vigente(placa):
             return False, f"El vehículo {placa} ya tiene un abono mensual vigente", None
         
         # Crear el abono mensual
@@ -480,26 +1302,28 @@ class Estacionamiento:
         costo_abono = self.calcular_costo_abono_mensual(tipo_vehiculo)
         abono.monto_pagado = costo_abono
         
-        self.abonos_mensuales[placa] = abono
+        self.abonos_mensuales = {**self.abonos_mensuales, placa: abono}
+        self.indice_abonos.actualizar(abono)
         
         # Guardar datos
-        self.guardar_datos()
+        self.persistir_evento('abono', abono.a_dict())
         
         return True, f"Abono mensual registrado exitosamente para {placa} ({tipo_vehiculo}). Válido hasta {abono.fecha_vencimiento.strftime('%d/%m/%Y')}", abono
     
     def tiene_abono_vigente(self, placa):
         """Verifica si un vehículo tiene abono mensual vigente"""
-        placa = placa.upper().strip()
-        return placa in self.abonos_mensuales and self.abonos_mensuales[placa].esta_vigente()
+        return self.indice_abonos.esta_vigente(normalizar_placa(placa))
     
     def obtener_abono(self, placa):
         """Obtiene el abono mensual de un vehículo"""
-        placa = placa.upper().strip()
+        placa = normalizar_placa(placa)
         return self.abonos_mensuales.get(placa)
     
+    @instrumentado
+    @transaccional
     def renovar_abono(self, placa):
         """Renueva un abono mensual existente"""
-        placa = placa.upper().strip()
+        placa = normalizar_placa(placa)
         
         if placa not in self.abonos_mensuales:
             return False, f"No existe un abono registrado para el vehículo {placa}"
@@ -510,33 +1334,51 @@ class Estacionamiento:
         # Calcular nuevo costo
         costo_renovacion = self.calcular_costo_abono_mensual()
         abono.monto_pagado = costo_renovacion
+        self.indice_abonos.actualizar(abono)
         
         # Guardar datos
-        self.guardar_datos()
+        self.persistir_evento('abono', abono.a_dict())
         
         return True, f"Abono renovado exitosamente. Válido hasta {abono.fecha_vencimiento.strftime('%d/%m/%Y')}"
     
+    @instrumentado
+    @transaccional
     def cancelar_abono(self, placa):
         """Cancela un abono mensual"""
-        placa = placa.upper().strip()
+        placa = normalizar_placa(placa)
         
         if placa not in self.abonos_mensuales:
             return False, f"No existe un abono registrado para el vehículo {placa}"
         
         abono = self.abonos_mensuales[placa]
         abono.cancelar()
+        self.indice_abonos.actualizar(abono)
         
         # Guardar datos
-        self.guardar_datos()
+        self.persistir_evento('abono', abono.a_dict())
         
         return True, f"Abono cancelado para el vehículo {placa}"
     
     def listar_abonos(self, solo_vigentes=False):
         """Lista todos los abonos mensuales"""
         if solo_vigentes:
-            return {placa: abono for placa, abono in self.abonos_mensuales.items() if abono.esta_vigente()}
+            abonos = self.abonos_mensuales
+            return {placa: abonos[placa] for placa in self.indice_abonos.vigentes()}
         return self.abonos_mensuales
     
+    def abonos_por_vencer(self, dias=7):
+        """
+        Abonos vigentes que vencen dentro de los próximos días
+        
+        Args:
+            dias (int): Ventana en días
+            
+        Returns:
+            list: AbonoMensual, del que vence antes al que vence después
+        """
+        abonos = self.abonos_mensuales
+        return [abonos[placa] for placa in self.indice_abonos.por_vencer(dias)]
+    
     def calcular_costo_abono_mensual(self, tipo_vehiculo="auto"):
         """
         Calcula el costo del abono mensual basado en el tipo de vehículo
@@ -559,19 +1401,17 @@ class Estacionamiento:
             costos[tipo] = self.calcular_costo_abono_mensual(tipo)
         return costos
     
+    @instrumentado
     def obtener_estadisticas_abonos(self):
-        """Obtiene estadísticas de los abonos mensuales"""
-        total_abonos = len(self.abonos_mensuales)
-        abonos_vigentes = len([a for a in self.abonos_mensuales.values() if a.esta_vigente()])
-        abonos_vencidos = total_abonos - abonos_vigentes
-        
-        ingresos_abonos = sum(a.monto_pagado for a in self.abonos_mensuales.values() if a.esta_vigente())
+        """Obtiene estadísticas de los abonos mensuales a partir de los contadores en vivo"""
+        metricas = self.metricas
         
         return {
-            'total_abonos': total_abonos,
-            'abonos_vigentes': abonos_vigentes,
-            'abonos_vencidos': abonos_vencidos,
-            'ingresos_mensuales': ingresos_abonos,
+            'total_abonos': metricas.total_abonos,
+            'abonos_vigentes': metricas.abonos_vigentes,
+            'abonos_vencidos': metricas.abonos_vencidos,
+            'ingresos_mensuales': metricas.ingresos_abonos,
+            'por_vencer_7_dias': len(self.indice_abonos.por_vencer(7)),
             'costo_abono': self.calcular_costo_abono_mensual()
         }
 
@@ -712,10 +1552,12 @@ def main():
             elif opcion == "6":
                 # Ver historial
                 print("\n--- HISTORIAL DE VEHÍCULOS ---")
-                if estacionamiento.historial:
-                    print(f"Últimos {len(estacionamiento.historial)} registros:")
+                total_registros, _ = estacionamiento.resumen_historial()
+                if total_registros:
+                    print(f"Últimos registros de {total_registros} en total:")
                     total_recaudado = 0
-                    for vehiculo in estacionamiento.historial[-10:]:  # Mostrar últimos 10
+                    ultimos, _ = estacionamiento.consultar_historial(limite=10)  # Mostrar últimos 10
+                    for vehiculo in reversed(ultimos):
                         tiempo = vehiculo.calcular_tiempo_permanencia()
                         horas = int(tiempo.total_seconds() // 3600)
                         minutos = int((tiempo.total_seconds() % 3600) // 60)
@@ -0,0 +1,87 @@
+"""
+Canal de eventos del Sistema de Estacionamiento
+
+Cada mutación del estacionamiento (ingreso, egreso, tarifas, abono) se
+publica en el canal con un identificador creciente. Los suscriptores (por
+ejemplo, el endpoint Server-Sent Events de la aplicación web) esperan en el
+canal y reciben solo los eventos nuevos, en lugar de consultar el estado
+completo cada cierto tiempo.
+
+Se retienen los últimos eventos para que un cliente que se reconecta con
+su último identificador reciba lo que se perdió.
+"""
+
+from collections import deque
+import threading
+
+
+class CanalEventos:
+    """Canal de publicación/suscripción de eventos en memoria"""
+
+    def __init__(self, eventos_retenidos=256):
+        """
+        Inicializa el canal
+
+        Args:
+            eventos_retenidos (int): Eventos recientes que se conservan para
+                las reconexiones
+        """
+        self._eventos = deque(maxlen=eventos_retenidos)  # (id, tipo, datos)
+        self._ultimo_id = 0
+        self._condicion = threading.Condition()
+
+    @property
+    def ultimo_id(self):
+        """Identificador del último evento publicado"""
+        return self._ultimo_id
+
+    def publicar(self, tipo, datos):
+        """
+        Publica un evento y despierta a los suscriptores
+
+        Args:
+            tipo (str): Tipo de evento
+            datos (dict): Datos del evento
+
+        Returns:
+            int: Identificador asignado al evento
+        """
+        with self._condicion:
+            self._ultimo_id += 1
+            self._eventos.append((self._ultimo_id, tipo, datos))
+            self._condicion.notify_all()
+            return self._ultimo_id
+
+    def desde(self, ultimo_id):
+        """
+        Eventos posteriores a un identificador, sin esperar
+
+        Returns:
+            list: Eventos (id, tipo, datos), o None si ya no están todos (ver esperar)
+        """
+        with self._condicion:
+            return self._desde(ultimo_id)
+
+    def _desde(self, ultimo_id):
+        if ultimo_id == self._ultimo_id:
+            return []
+        if ultimo_id > self._ultimo_id or self._eventos[0][0] > ultimo_id + 1:
+            return None  # Identificador de otra ejecución, o eventos ya descartados
+        return [evento for evento in self._eventos if evento[0] > ultimo_id]
+
+    def esperar(self, ultimo_id, timeout=None):
+        """
+        Espera eventos posteriores a un identificador
+
+        Args:
+            ultimo_id (int): Último evento que ya recibió el suscriptor
+            timeout (float): Segundos máximos de espera
+
+        Returns:
+            list: Eventos (id, tipo, datos) posteriores, vacía si venció el
+                tiempo, o None si el suscriptor quedó tan atrasado que debe
+                volver a leer el estado completo
+        """
+        with self._condicion:
+            self._condicion.wait_for(lambda: self._ultimo_id != ultimo_id, timeout)
+            return self._desde(ultimo_id)
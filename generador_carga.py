@@ -0,0 +1,282 @@
+"""
+Generador de carga HTTP para la aplicación web del Sistema de Estacionamiento
+
+Simula barreras y pantallas contra un servidor en marcha (app.py, gunicorn
+o app_asgi.py): cada cliente es un hilo con su propia conexión persistente
+que registra ingresos en /ingresar, egresos en /egresar-rapido de vehículos
+que él mismo ingresó, y consulta /api/vehiculos como lo hace el dashboard
+(con ?since= y la ETag de la respuesta anterior). La ocupación de los
+espacios libres al comenzar se mantiene cerca del objetivo: por encima de
+él, los clientes solo egresan y consultan.
+
+Con --tasa la carga es de lazo abierto: las solicitudes se programan a ritmo
+fijo y la latencia se mide desde el momento programado, así que una demora
+del servidor no reduce la carga ofrecida ni oculta la espera de las
+solicitudes siguientes. Sin --tasa cada cliente envía la siguiente en cuanto
+recibe la respuesta.
+
+El resultado tiene el mismo formato que el de benchmark.py y se compara con
+--comparar.
+
+Usar solo contra un servidor de prueba: los vehículos ingresados quedan en el
+historial.
+
+Uso:
+    python generador_carga.py --url http://localhost:8080 --clientes 8 --duracion 30 \\
+        --salida carga.json
+"""
+
+import argparse
+from collections import Counter
+import http.client
+import itertools
+import json
+import random
+import string
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+from benchmark import comparar, datos_de_entorno, estadisticas
+
+TIPOS_VEHICULO = ('auto', 'auto', 'auto', 'moto', 'camioneta')
+
+# Proporción de cada acción mientras la ocupación está por debajo del objetivo
+MEZCLA = (('ingreso', 0.4), ('egreso', 0.3), ('consulta', 0.3))
+
+RUTAS = {
+    'ingreso': 'POST /ingresar',
+    'egreso': 'POST /egresar-rapido',
+    'consulta': 'GET /api/vehiculos'
+}
+
+
+class GeneradorCarga:
+    """Clientes concurrentes que reproducen el tráfico de barreras y pantallas"""
+
+    def __init__(self, url, clientes=4, duracion=30, tasa=None, ocupacion_objetivo=0.8,
+                 tiempo_espera=10, semilla=1):
+        """
+        Args:
+            url (str): URL base del servidor
+            clientes (int): Clientes concurrentes (hilos)
+            duracion (float): Segundos de medición
+            tasa (float): Solicitudes por segundo entre todos los clientes (None
+                para enviar sin pausa)
+            ocupacion_objetivo (float): Fracción de la capacidad a partir de la
+                cual los clientes priorizan los egresos
+            tiempo_espera (float): Segundos máximos de espera por respuesta
+            semilla (int): Semilla de la secuencia de acciones
+        """
+        partes = urllib.parse.urlsplit(url)
+        self.clase_conexion = (http.client.HTTPSConnection if partes.scheme == 'https'
+                               else http.client.HTTPConnection)
+        self.servidor = partes.netloc
+        self.prefijo = partes.path.rstrip('/')
+        self.clientes = clientes
+        self.duracion = duracion
+        self.tasa = tasa
+        self.ocupacion_objetivo = ocupacion_objetivo
+        self.tiempo_espera = tiempo_espera
+        self.semilla = semilla
+
+        # Prefijo propio para no chocar con placas de otra corrida
+        sufijos = string.ascii_uppercase + string.digits
+        self.prefijo_placas = ''.join(random.Random(uuid.uuid4().int).choices(sufijos, k=3))
+        self._numeros = itertools.count()
+        self._lock = threading.Lock()
+        self.dentro = []  # Placas que ingresó el generador y siguen dentro
+        self.disponibles = None  # Espacios libres al comenzar: los que puede ocupar el generador
+
+        self.latencias = {ruta: [] for ruta in RUTAS.values()}
+        self.codigos = {ruta: Counter() for ruta in RUTAS.values()}
+        self.errores = Counter()
+
+    def _conectar(self):
+        return self.clase_conexion(self.servidor, timeout=self.tiempo_espera)
+
+    def _solicitar(self, conexion, metodo, ruta, cuerpo=None, encabezados=None):
+        """Envía una solicitud por la conexión persistente y lee la respuesta completa"""
+        conexion.request(metodo, self.prefijo + ruta, body=cuerpo, headers=encabezados or {})
+        respuesta = conexion.getresponse()
+        contenido = respuesta.read()
+        return respuesta, contenido
+
+    def _leer_disponibles(self):
+        conexion = self._conectar()
+        try:
+            _, contenido = self._solicitar(conexion, 'GET', '/api/estado')
+            return json.loads(contenido)['disponibles']
+        finally:
+            conexion.close()
+
+    def _nueva_placa(self):
+        return f"{self.prefijo_placas}{next(self._numeros) % 100000:05d}"
+
+    def _elegir_accion(self, azar):
+        with self._lock:
+            dentro = len(self.dentro)
+        if not dentro:
+            return 'ingreso'
+        if dentro >= self.disponibles * self.ocupacion_objetivo:
+            return azar.choice(('egreso', 'consulta'))
+        valor = azar.random()
+        for accion, proporcion in MEZCLA:
+            valor -= proporcion
+            if valor < 0:
+                return accion
+        return MEZCLA[-1][0]
+
+    def _ejecutar_accion(self, conexion, accion, azar, cliente):
+        """Devuelve la respuesta de la acción; el estado del cliente va en `cliente`"""
+        if accion == 'ingreso':
+            placa = self._nueva_placa()
+            cuerpo = urllib.parse.urlencode({'placa': placa, 'tipo_vehiculo': azar.choice(TIPOS_VEHICULO),
+                                             'propietario': ''})
+            respuesta, _ = self._solicitar(conexion, 'POST', '/ingresar', cuerpo,
+                                           {'Content-Type': 'application/x-www-form-urlencoded'})
+            if respuesta.status < 400:
+                with self._lock:
+                    self.dentro.append(placa)
+            return respuesta
+
+        if accion == 'egreso':
+            with self._lock:
+                if not self.dentro:
+                    return None
+                indice = azar.randrange(len(self.dentro))
+                self.dentro[indice], self.dentro[-1] = self.dentro[-1], self.dentro[indice]
+                placa = self.dentro.pop()
+            respuesta, _ = self._solicitar(conexion, 'POST', '/egresar-rapido', json.dumps({'placa': placa}),
+                                           {'Content-Type': 'application/json'})
+            return respuesta
+
+        # Consulta del dashboard: cambios desde la versión anterior, con su ETag
+        ruta = '/api/vehiculos'
+        encabezados = {}
+        if cliente.get('version') is not None:
+            ruta += f"?since={cliente['version']}"
+        if cliente.get('etag'):
+            encabezados['If-None-Match'] = cliente['etag']
+        respuesta, _ = self._solicitar(conexion, 'GET', ruta, encabezados=encabezados)
+        cliente['version'] = respuesta.getheader('X-Version', cliente.get('version'))
+        cliente['etag'] = respuesta.getheader('ETag')
+        return respuesta
+
+    def _cliente(self, numero, inicio, fin):
+        azar = random.Random(self.semilla * 1000 + numero)
+        intervalo = self.clientes / self.tasa if self.tasa else 0
+        programado = inicio + azar.random() * intervalo  # Los clientes no arrancan todos juntos
+        conexion = self._conectar()
+        cliente = {}
+        reloj = time.perf_counter
+
+        while True:
+            if intervalo:
+                espera = programado - reloj()
+                if espera > 0:
+                    time.sleep(espera)
+            comienzo = programado if intervalo else reloj()
+            if comienzo >= fin:
+                break
+
+            accion = self._elegir_accion(azar)
+            ruta = RUTAS[accion]
+            try:
+                respuesta = self._ejecutar_accion(conexion, accion, azar, cliente)
+                if respuesta is not None:
+                    duracion = reloj() - comienzo
+                    with self._lock:
+                        self.latencias[ruta].append(int(duracion * 1e9))
+                        self.codigos[ruta][respuesta.status] += 1
+            except (OSError, http.client.HTTPException) as e:
+                with self._lock:
+                    self.errores[f"{ruta}: {type(e).__name__}"] += 1
+                conexion.close()
+                conexion = self._conectar()
+
+            programado += intervalo
+
+        conexion.close()
+
+    def ejecutar(self):
+        """
+        Corre la carga durante la duración indicada
+
+        Returns:
+            dict: Estadísticas por ruta y totales
+        """
+        self.disponibles = self._leer_disponibles()
+        inicio = time.perf_counter()
+        fin = inicio + self.duracion
+        hilos = [threading.Thread(target=self._cliente, args=(numero, inicio, fin), daemon=True)
+                 for numero in range(self.clientes)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        transcurrido = time.perf_counter() - inicio
+
+        operaciones = {}
+        for ruta, latencias in self.latencias.items():
+            datos = estadisticas(latencias, transcurrido)
+            datos['codigos'] = {str(codigo): cantidad for codigo, cantidad in sorted(self.codigos[ruta].items())}
+            operaciones[ruta] = datos
+        operaciones['total'] = estadisticas(list(itertools.chain(*self.latencias.values())), transcurrido)
+        return {'operaciones': operaciones, 'errores': dict(self.errores), 'segundos': round(transcurrido, 2)}
+
+
+def main():
+    """Corre el generador y guarda el resultado en JSON"""
+    parser = argparse.ArgumentParser(description="Generador de carga HTTP del estacionamiento")
+    parser.add_argument('--url', default='http://localhost:8080', help="URL base del servidor")
+    parser.add_argument('--clientes', type=int, default=4, help="Clientes concurrentes")
+    parser.add_argument('--duracion', type=float, default=30, help="Segundos de medición")
+    parser.add_argument('--tasa', type=float, default=None,
+                        help="Solicitudes por segundo en total (por defecto, sin pausa)")
+    parser.add_argument('--ocupacion', type=float, default=0.8, help="Ocupación objetivo (0 a 1)")
+    parser.add_argument('--semilla', type=int, default=1, help="Semilla de la secuencia de acciones")
+    parser.add_argument('--salida', help="Archivo JSON donde guardar el resultado")
+    parser.add_argument('--comparar', help="Resultado anterior con el que comparar")
+    parser.add_argument('--tolerancia', type=float, default=0.10,
+                        help="Aumento relativo de p50 o p99 que se informa como regresión")
+    args = parser.parse_args()
+
+    generador = GeneradorCarga(args.url, args.clientes, args.duracion, args.tasa, args.ocupacion,
+                               semilla=args.semilla)
+    print(f"🚦 {args.clientes} clientes contra {args.url} durante {args.duracion:g} s"
+          + (f" a {args.tasa:g} solicitudes/s" if args.tasa else ""))
+    medicion = generador.ejecutar()
+
+    for ruta, datos in medicion['operaciones'].items():
+        if datos['operaciones']:
+            print(f"    {ruta:<22} p50 {datos['p50_ms']:>9.3f} ms  p99 {datos['p99_ms']:>9.3f} ms  "
+                  f"{datos['por_segundo']:>8.1f} sol/s")
+    for error, cantidad in medicion['errores'].items():
+        print(f"    ⚠️  {error}: {cantidad}")
+
+    resultado = datos_de_entorno()
+    resultado['parametros'] = {'url': args.url, 'semilla': args.semilla}
+    resultado['resultados'] = [{
+        'escenario': {'clientes': args.clientes, 'duracion': args.duracion, 'tasa': args.tasa,
+                      'ocupacion': args.ocupacion},
+        'operaciones': medicion['operaciones'],
+        'errores': medicion['errores']
+    }]
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Resultado guardado en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f:
+            anterior = json.load(f)
+        if comparar(anterior, resultado, args.tolerancia):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""
+Configuración de gunicorn para ejecutar la aplicación web con varios procesos
+
+Uso:
+    gunicorn -c gunicorn.conf.py app:app
+
+Todos los procesos comparten el estado a través de la base SQLite indicada en
+ESTACIONAMIENTO_DB (modo WAL). Cada proceso detecta los cambios de los demás
+antes de atender cada solicitud y se pone al día con ellos.
+
+Cada flujo de /api/eventos ocupa uno de los `threads` de un proceso mientras
+está abierto; cada proceso sostiene a lo sumo la mitad en flujos (ver
+MAX_FLUJOS_SSE en app.py) y el resto queda para las demás rutas. Para muchas
+pantallas conectadas conviene servir el dashboard con app_asgi.py.
+"""
+
+import multiprocessing
+import os
+
+# El backend JSON no admite varios procesos: se fuerza la base compartida
+os.environ.setdefault('ESTACIONAMIENTO_DB', 'estacionamiento.db')
+
+bind = os.environ.get('ESTACIONAMIENTO_BIND', '0.0.0.0:8080')
+workers = int(os.environ.get('ESTACIONAMIENTO_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('ESTACIONAMIENTO_THREADS', 8))
+
+# Los procesos heredan esta variable al iniciar (app.py la lee al importarse)
+os.environ.setdefault('ESTACIONAMIENTO_MAX_FLUJOS_SSE', str(max(1, threads // 2)))
@@ -0,0 +1,503 @@
+"""
+Historial segmentado del Sistema de Estacionamiento
+
+El historial se guarda completo, sin truncar, como una serie de segmentos
+JSON Lines de tamaño fijo dentro de un directorio. Solo el segmento activo
+se mantiene en memoria; los segmentos sellados se leen bajo demanda al
+paginar. La cantidad de registros y el total recaudado se llevan como
+acumulados, por lo que no hace falta recorrer el historial para obtenerlos.
+
+En memoria, los registros de un segmento se guardan por columnas
+(RegistrosColumnares) en lugar de como un diccionario por registro. Al
+sellar un segmento se escriben además, en un archivo binario aparte, las
+columnas que usan los reportes (ColumnasHistorial), que se leen de un solo
+bloque sin analizar el JSON.
+"""
+
+from array import array
+import json
+import os
+import struct
+import sys
+import threading
+
+from instrumentacion import bytes_escritos
+from persistencia import PoliticaDurabilidad, escribir_atomico
+from snapshot_binario import a_microsegundos, desde_microsegundos
+
+_SIN_NUMERO = -2**63  # Espacio o versión ausente
+
+BYTES_HISTORIAL = bytes_escritos('historial')
+
+
+class TablaTextos:
+    """Textos internados: cada texto distinto se guarda una sola vez"""
+
+    def __init__(self):
+        self.textos = []
+        self._indices = {}
+
+    def indice(self, texto):
+        """Índice del texto, agregándolo si es nuevo"""
+        indice = self._indices.get(texto)
+        if indice is None:
+            indice = self._indices[texto] = len(self.textos)
+            self.textos.append(texto)
+        return indice
+
+    def __getitem__(self, indice):
+        return self.textos[indice]
+
+
+class RegistrosColumnares:
+    """
+    Registros del historial guardados por columnas
+
+    Cada campo es un arreglo paralelo: placa y propietario como índices a una
+    tabla de textos internados, tipo de vehículo como código de un byte,
+    entrada y salida en microsegundos desde la época, espacio, versión de
+    tarifa y tarifa cobrada. Un registro ocupa unas decenas de bytes en lugar
+    de un diccionario con sus cadenas, y los totales se calculan recorriendo
+    una sola columna.
+    """
+
+    def __init__(self):
+        self.textos = TablaTextos()
+        self.tipos = TablaTextos()
+        self.placa = array('I')
+        self.propietario = array('I')
+        self.tipo = array('B')
+        self.entrada = array('q')
+        self.salida = array('q')
+        self.espacio = array('q')
+        self.version = array('q')
+        self.tarifa = array('d')
+
+    def __len__(self):
+        return len(self.tarifa)
+
+    def append(self, registro):
+        """
+        Agrega un registro
+
+        Args:
+            registro (dict): Registro con el formato de Vehiculo.a_dict
+        """
+        espacio = registro.get('espacio_asignado')
+        version = registro.get('version_tarifa')
+        self.placa.append(self.textos.indice(registro['placa']))
+        self.propietario.append(self.textos.indice(registro.get('propietario', '')))
+        self.tipo.append(self.tipos.indice(registro['tipo_vehiculo']))
+        self.entrada.append(a_microsegundos(registro.get('hora_entrada')))
+        self.salida.append(a_microsegundos(registro.get('hora_salida')))
+        self.espacio.append(_SIN_NUMERO if espacio is None else espacio)
+        self.version.append(_SIN_NUMERO if version is None else version)
+        self.tarifa.append(registro.get('tarifa_pagada', 0))
+
+    def _registro(self, i):
+        """Registro de la posición i como diccionario"""
+        entrada = desde_microsegundos(self.entrada[i])
+        salida = desde_microsegundos(self.salida[i])
+        tarifa = self.tarifa[i]
+        return {
+            'placa': self.textos[self.placa[i]],
+            'tipo_vehiculo': self.tipos[self.tipo[i]],
+            'propietario': self.textos[self.propietario[i]],
+            'hora_entrada': entrada.isoformat() if entrada else None,
+            'hora_salida': salida.isoformat() if salida else None,
+            'espacio_asignado': None if self.espacio[i] == _SIN_NUMERO else self.espacio[i],
+            'tarifa_pagada': int(tarifa) if tarifa.is_integer() else tarifa,
+            'version_tarifa': None if self.version[i] == _SIN_NUMERO else self.version[i]
+        }
+
+    def __getitem__(self, indice):
+        """Un registro, o una lista de registros si se indica un rango"""
+        if isinstance(indice, slice):
+            return [self._registro(i) for i in range(*indice.indices(len(self)))]
+        return self._registro(range(len(self))[indice])
+
+    @property
+    def total_recaudado(self):
+        """Suma de las tarifas cobradas"""
+        return sum(self.tarifa)
+
+
+class ColumnasHistorial:
+    """
+    Columnas del historial que usan los reportes (ver analitica.py)
+
+    entrada y salida en microsegundos desde la época (hora local), el tipo
+    de vehículo como código de la tabla tipos y la tarifa cobrada.
+    """
+
+    MAGIA = b'ESTC1'
+    CAMPOS = ('entrada', 'salida', 'tipo', 'tarifa')
+
+    def __init__(self):
+        self.tipos = TablaTextos()
+        self.entrada = array('q')
+        self.salida = array('q')
+        self.tipo = array('B')
+        self.tarifa = array('d')
+
+    def __len__(self):
+        return len(self.tarifa)
+
+    def agregar(self, registro):
+        """
+        Agrega un registro
+
+        Args:
+            registro (dict): Registro con el formato de Vehiculo.a_dict
+        """
+        self.entrada.append(a_microsegundos(registro.get('hora_entrada')))
+        self.salida.append(a_microsegundos(registro.get('hora_salida')))
+        self.tipo.append(self.tipos.indice(registro['tipo_vehiculo']))
+        self.tarifa.append(registro.get('tarifa_pagada', 0))
+
+    def extender(self, otras):
+        """
+        Agrega al final las columnas de otro historial
+
+        Args:
+            otras (ColumnasHistorial | RegistrosColumnares): Registros a agregar
+        """
+        # Los códigos de tipo de las otras columnas se traducen a los propios
+        traduccion = bytes(self.tipos.indice(tipo) for tipo in otras.tipos.textos)
+        traduccion += bytes(256 - len(traduccion))
+        self.entrada.extend(otras.entrada)
+        self.salida.extend(otras.salida)
+        self.tipo.frombytes(otras.tipo.tobytes().translate(traduccion))
+        self.tarifa.extend(otras.tarifa)
+
+    def copia(self):
+        """Copia independiente de las columnas"""
+        copia = ColumnasHistorial()
+        copia.extender(self)
+        return copia
+
+    def a_bytes(self):
+        """Serializa las columnas (formato binario de los archivos .columnas)"""
+        partes = [self.MAGIA, sys.byteorder[0].encode('ascii'),
+                  json.dumps(self.tipos.textos).encode('utf-8')]
+        partes.extend(getattr(self, campo).tobytes() for campo in self.CAMPOS)
+        return b''.join(struct.pack('<I', len(parte)) + parte for parte in partes)
+
+    @classmethod
+    def desde_bytes(cls, contenido):
+        """
+        Reconstruye las columnas serializadas con a_bytes
+
+        Raises:
+            ValueError: Si el contenido no es válido
+        """
+        partes = []
+        posicion = 0
+        while posicion < len(contenido):
+            (longitud,) = struct.unpack_from('<I', contenido, posicion)
+            partes.append(contenido[posicion + 4:posicion + 4 + longitud])
+            posicion += 4 + longitud
+        if len(partes) != 3 + len(cls.CAMPOS) or partes[0] != cls.MAGIA:
+            raise ValueError("Archivo de columnas no válido")
+
+        columnas = cls()
+        for tipo in json.loads(partes[2].decode('utf-8')):
+            columnas.tipos.indice(tipo)
+        for campo, datos in zip(cls.CAMPOS, partes[3:]):
+            columna = getattr(columnas, campo)
+            columna.frombytes(datos)
+            if partes[1] != sys.byteorder[0].encode('ascii'):
+                columna.byteswap()
+        if len({len(getattr(columnas, campo)) for campo in cls.CAMPOS}) != 1:
+            raise ValueError("Archivo de columnas con largos distintos")
+        return columnas
+
+
+class HistorialSegmentado:
+    """Historial de solo anexado dividido en segmentos de tamaño fijo"""
+
+    def __init__(self, directorio, registros_por_segmento=5000, durabilidad=None):
+        """
+        Inicializa el historial segmentado
+
+        Args:
+            directorio (str): Directorio donde se guardan los segmentos
+            registros_por_segmento (int): Registros por segmento antes de sellarlo
+            durabilidad (PoliticaDurabilidad): Política de fsync de los anexos
+        """
+        self.directorio = directorio
+        self.registros_por_segmento = registros_por_segmento
+        self.durabilidad = durabilidad or PoliticaDurabilidad()
+        self.ruta_indice = os.path.join(directorio, 'indice.json')
+
+        self.segmentos = []  # Segmentos sellados: {'numero', 'cantidad', 'total'}
+        self.cantidad = 0
+        self.total_recaudado = 0
+        self.activo = RegistrosColumnares()  # Registros del segmento activo
+        self._archivo = None
+        self._cache = (None, None)  # (número, registros) del último segmento sellado leído
+        self._columnas = ColumnasHistorial()  # Columnas de los segmentos sellados ya leídos
+        self._segmentos_en_columnas = 0
+        self._lock = threading.Lock()  # Lecturas y escrituras pueden venir de distintos hilos
+
+        os.makedirs(directorio, exist_ok=True)
+        self._cargar()
+
+    def _ruta_segmento(self, numero):
+        return os.path.join(self.directorio, f'segmento_{numero:06d}.jsonl')
+
+    def _ruta_columnas(self, numero):
+        return os.path.join(self.directorio, f'segmento_{numero:06d}.columnas')
+
+    @property
+    def numero_activo(self):
+        """Número del segmento que recibe los nuevos registros"""
+        return len(self.segmentos) + 1
+
+    def _cargar(self):
+        """Lee el índice de segmentos sellados y el segmento activo"""
+        if os.path.exists(self.ruta_indice):
+            with open(self.ruta_indice, 'r', encoding='utf-8') as f:
+                indice = json.load(f)
+            self.registros_por_segmento = indice.get('registros_por_segmento', self.registros_por_segmento)
+            self.segmentos = indice.get('segmentos', [])
+
+        self.cantidad = sum(s['cantidad'] for s in self.segmentos)
+        self.total_recaudado = sum(s['total'] for s in self.segmentos)
+
+        ruta = self._ruta_segmento(self.numero_activo)
+        if not os.path.exists(ruta):
+            return
+
+        with open(ruta, 'r', encoding='utf-8') as f:
+            contenido = f.read()
+
+        # Una última línea incompleta (escritura interrumpida) se descarta
+        valido = contenido[:contenido.rfind('\n') + 1]
+        if len(valido) != len(contenido):
+            with open(ruta, 'w', encoding='utf-8') as f:
+                f.write(valido)
+
+        for linea in valido.splitlines():
+            self._acumular(json.loads(linea))
+
+        if len(self.activo) >= self.registros_por_segmento:
+            self._sellar()
+
+    def _acumular(self, registro):
+        self.activo.append(registro)
+        self.cantidad += 1
+        self.total_recaudado += registro.get('tarifa_pagada', 0)
+
+    def agregar(self, registro):
+        """
+        Anexa un registro al final del historial
+
+        Args:
+            registro (dict): Registro de un vehículo que ya salió
+        """
+        with self._lock:
+            self._agregar(registro)
+
+    def agregar_varios(self, registros):
+        """
+        Anexa varios registros con una sola sincronización a disco
+
+        Args:
+            registros (list): Registros de vehículos que ya salieron, en orden
+        """
+        with self._lock:
+            for registro in registros:
+                self._agregar(registro, sincronizar=False)
+            if self._archivo is not None:
+                self._archivo.flush()
+                self.durabilidad.tras_escritura(self._archivo)
+
+    def _agregar(self, registro, sincronizar=True):
+        if self._archivo is None:
+            self._archivo = open(self._ruta_segmento(self.numero_activo), 'a', encoding='utf-8')
+
+        BYTES_HISTORIAL.incrementar(
+            self._archivo.write(json.dumps(registro, ensure_ascii=False, separators=(',', ':')) + '\n'))
+        if sincronizar:
+            self._archivo.flush()
+            self.durabilidad.tras_escritura(self._archivo)
+
+        self._acumular(registro)
+        if len(self.activo) >= self.registros_por_segmento:
+            self._sellar()
+
+    def _sellar(self):
+        """Cierra el segmento activo y lo agrega al índice"""
+        if self._archivo is not None:
+            # Un lote pudo dejar escrituras sin sincronizar en este segmento
+            self._archivo.flush()
+            self.durabilidad.tras_escritura(self._archivo)
+            self.durabilidad.vaciar()
+            self._archivo.close()
+            self._archivo = None
+
+        self._escribir_columnas(self.numero_activo, self.activo)
+        self.segmentos.append({
+            'numero': self.numero_activo,
+            'cantidad': len(self.activo),
+            'total': self.activo.total_recaudado
+        })
+        self.activo = RegistrosColumnares()
+
+        indice = {'registros_por_segmento': self.registros_por_segmento, 'segmentos': self.segmentos}
+        escribir_atomico(self.ruta_indice, json.dumps(indice),
+                         sincronizar=self.durabilidad.sincronizar_snapshots)
+
+    def _escribir_columnas(self, numero, registros):
+        """Guarda las columnas de un segmento sellado; sin ellas se usa el JSONL"""
+        columnas = ColumnasHistorial()
+        columnas.extender(registros)
+        try:
+            escribir_atomico(self._ruta_columnas(numero), columnas.a_bytes(), sincronizar=False)
+        except OSError as e:
+            print(f"Error al guardar columnas del segmento {numero}: {e}")
+        return columnas
+
+    def _leer_segmento(self, numero):
+        """Lee un segmento sellado, reutilizando el último leído"""
+        if self._cache[0] != numero:
+            registros = RegistrosColumnares()
+            with open(self._ruta_segmento(numero), 'r', encoding='utf-8') as f:
+                for linea in f:
+                    registros.append(json.loads(linea))
+            self._cache = (numero, registros)
+        return self._cache[1]
+
+    def _leer_columnas(self, numero):
+        """Columnas de un segmento sellado, creando el archivo si falta"""
+        try:
+            with open(self._ruta_columnas(numero), 'rb') as f:
+                return ColumnasHistorial.desde_bytes(f.read())
+        except (OSError, ValueError, struct.error):
+            # Segmento sellado antes de que existieran estos archivos, o dañado
+            return self._escribir_columnas(numero, self._leer_segmento(numero))
+
+    def columnas(self):
+        """
+        Columnas de todo el historial para los reportes
+
+        Los segmentos sellados no cambian: se leen una sola vez y quedan en
+        memoria, así que cada consulta solo copia las columnas.
+
+        Returns:
+            ColumnasHistorial: Columnas de todos los registros, en orden
+        """
+        with self._lock:
+            while self._segmentos_en_columnas < len(self.segmentos):
+                numero = self.segmentos[self._segmentos_en_columnas]['numero']
+                self._columnas.extender(self._leer_columnas(numero))
+                self._segmentos_en_columnas += 1
+            columnas = self._columnas.copia()
+            columnas.extender(self.activo)
+        return columnas
+
+    def placas(self, desde=0):
+        """
+        Placas distintas de los registros a partir de una posición
+
+        Args:
+            desde (int): Posición del primer registro a leer
+
+        Returns:
+            tuple: (placas, posición siguiente al último registro leído)
+        """
+        placas = set()
+        with self._lock:
+            posicion = desde
+            while posicion < self.cantidad:
+                indice_segmento, desplazamiento = divmod(posicion, self.registros_por_segmento)
+                if indice_segmento < len(self.segmentos):
+                    segmento = self._leer_segmento(self.segmentos[indice_segmento]['numero'])
+                else:
+                    segmento = self.activo
+                codigos = segmento.placa[desplazamiento:]
+                if not codigos:
+                    break
+                placas.update(segmento.textos[codigo] for codigo in set(codigos))
+                posicion += len(codigos)
+        return placas, posicion
+
+    def salidas_desde(self, desde, atraso_maximo):
+        """
+        Última salida de cada placa que salió a partir de un momento
+
+        Los registros se agregan en el orden en que llegan y cada salida se
+        informa con a lo sumo `atraso_maximo` de atraso, así que se recorre desde
+        el final y se deja de leer en la primera salida anterior a
+        desde - atraso_maximo.
+
+        Args:
+            desde (datetime): Momento desde el que interesan las salidas
+            atraso_maximo (timedelta): Atraso máximo con que se registra una salida
+
+        Returns:
+            dict: placa -> hora de salida más reciente
+        """
+        minimo = a_microsegundos(desde)
+        corte = a_microsegundos(desde - atraso_maximo)
+        salidas = {}
+        with self._lock:
+            numeros = [segmento['numero'] for segmento in reversed(self.segmentos)]
+            segmento = self.activo
+            while True:
+                for i in range(len(segmento) - 1, -1, -1):
+                    salida = segmento.salida[i]
+                    if salida < corte:
+                        numeros = []
+                        break
+                    if salida >= minimo:
+                        placa = segmento.textos[segmento.placa[i]]
+                        if salida > salidas.get(placa, minimo - 1):
+                            salidas[placa] = salida
+                if not numeros:
+                    break
+                segmento = self._leer_segmento(numeros.pop(0))
+        return {placa: desde_microsegundos(salida) for placa, salida in salidas.items()}
+
+    def _leer_rango(self, inicio, fin):
+        """Obtiene los registros de las posiciones [inicio, fin) en orden"""
+        registros = []
+        posicion = inicio
+        while posicion < fin:
+            indice_segmento, desplazamiento = divmod(posicion, self.registros_por_segmento)
+            if indice_segmento < len(self.segmentos):
+                segmento = self._leer_segmento(self.segmentos[indice_segmento]['numero'])
+            else:
+                segmento = self.activo
+            tomados = segmento[desplazamiento:desplazamiento + (fin - posicion)]
+            if not tomados:
+                break
+            registros.extend(tomados)
+            posicion += len(tomados)
+        return registros
+
+    def pagina(self, limite=20, antes_de=None):
+        """
+        Obtiene una página del historial, del registro más reciente al más antiguo
+
+        Args:
+            limite (int): Cantidad máxima de registros
+            antes_de (int): Cursor de la página anterior (None para empezar)
+
+        Returns:
+            tuple: (registros, cursor de la página siguiente o None)
+        """
+        with self._lock:
+            fin = self.cantidad if antes_de is None else min(antes_de, self.cantidad)
+            inicio = max(0, fin - limite)
+            registros = self._leer_rango(inicio, fin)
+        registros.reverse()
+        return registros, (inicio if inicio > 0 else None)
+
+    def cerrar(self):
+        """Cierra el archivo del segmento activo"""
+        if self._archivo is not None:
+            self.durabilidad.vaciar()
+            self._archivo.close()
+            self._archivo = None
@@ -0,0 +1,136 @@
+"""
+Índice de abonos por fecha de vencimiento
+
+Los abonos vigentes se mantienen en una lista ordenada por fecha de
+vencimiento. A medida que pasa el tiempo, los que vencieron quedan al
+principio de la lista y se pasan a vencidos en bloque, con una sola
+búsqueda binaria. Así, saber si un abono está vigente o cuántos hay es
+O(1), y los que vencen en los próximos N días se obtienen en O(log n).
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+import threading
+
+
+class IndiceAbonos:
+    """Clasificación de abonos en vigentes y vencidos ordenada por vencimiento"""
+
+    def __init__(self, abonos=(), ahora=None):
+        """
+        Inicializa el índice
+
+        Args:
+            abonos (iterable): AbonoMensual a indexar
+            ahora (datetime): Momento de referencia (por defecto, ahora)
+        """
+        self._vencimientos = []  # (fecha_vencimiento, placa) de los vigentes, ordenada
+        self._vigentes = {}  # placa -> (fecha_vencimiento, monto_pagado)
+        self._vencidos = set()
+        self.monto_vigentes = 0
+        self._lock = threading.Lock()  # Las consultas también pueden mover abonos a vencidos
+
+        ahora = ahora or datetime.now()
+        for abono in abonos:
+            self._clasificar(abono, ahora)
+        self._vencimientos.sort()
+
+    def _quitar(self, placa):
+        """Saca un abono del índice, esté vigente o vencido"""
+        anterior = self._vigentes.pop(placa, None)
+        if anterior is None:
+            self._vencidos.discard(placa)
+            return
+        fecha, monto = anterior
+        del self._vencimientos[bisect_left(self._vencimientos, (fecha, placa))]
+        self.monto_vigentes -= monto
+
+    def _clasificar(self, abono, ahora, insertar=False):
+        if abono.activo and ahora <= abono.fecha_vencimiento:
+            self._vigentes[abono.placa] = (abono.fecha_vencimiento, abono.monto_pagado)
+            self.monto_vigentes += abono.monto_pagado
+            if insertar:
+                insort(self._vencimientos, (abono.fecha_vencimiento, abono.placa))
+            else:
+                self._vencimientos.append((abono.fecha_vencimiento, abono.placa))
+        else:
+            self._vencidos.add(abono.placa)
+
+    def actualizar(self, abono, ahora=None):
+        """
+        Reubica un abono nuevo, renovado o cancelado (O(log n) + desplazamiento)
+
+        Args:
+            abono (AbonoMensual): Abono a indexar
+            ahora (datetime): Momento de referencia (por defecto, ahora)
+        """
+        with self._lock:
+            self._quitar(abono.placa)
+            self._clasificar(abono, ahora or datetime.now(), insertar=True)
+
+    def avanzar(self, ahora=None):
+        """
+        Pasa a vencidos todos los abonos cuyo vencimiento ya pasó
+
+        Si el primero de la lista no venció no hay nada que mover, así que la
+        llamada habitual cuesta una comparación.
+
+        Args:
+            ahora (datetime): Momento de referencia (por defecto, ahora)
+        """
+        ahora = ahora or datetime.now()
+        primero = self._vencimientos[:1]
+        if not primero or primero[0][0] >= ahora:
+            return
+        with self._lock:
+            # Vigente mientras ahora <= vencimiento: vencen los de fecha < ahora
+            corte = bisect_left(self._vencimientos, (ahora,))
+            for _, placa in self._vencimientos[:corte]:
+                _, monto = self._vigentes.pop(placa)
+                self.monto_vigentes -= monto
+                self._vencidos.add(placa)
+            del self._vencimientos[:corte]
+
+    def esta_vigente(self, placa):
+        """Indica si la placa tiene un abono vigente"""
+        self.avanzar()
+        return placa in self._vigentes
+
+    def vencimiento(self, placa):
+        """Fecha de vencimiento del abono vigente de la placa, o None si no tiene"""
+        self.avanzar()
+        vigente = self._vigentes.get(placa)
+        return vigente[0] if vigente else None
+
+    @property
+    def cantidad_vigentes(self):
+        """Cantidad de abonos vigentes"""
+        self.avanzar()
+        return len(self._vigentes)
+
+    @property
+    def cantidad_vencidos(self):
+        """Cantidad de abonos vencidos o cancelados"""
+        self.avanzar()
+        return len(self._vencidos)
+
+    def vigentes(self):
+        """Placas con abono vigente, de la que vence antes a la que vence después"""
+        self.avanzar()
+        return [placa for _, placa in self._vencimientos[:]]
+
+    def por_vencer(self, dias=7, ahora=None):
+        """
+        Placas cuyo abono vigente vence dentro de los próximos días
+
+        Args:
+            dias (int): Ventana en días
+            ahora (datetime): Momento de referencia (por defecto, ahora)
+
+        Returns:
+            list: Placas, de la que vence antes a la que vence después
+        """
+        ahora = ahora or datetime.now()
+        self.avanzar(ahora)
+        fin = bisect_right(self._vencimientos, (ahora + timedelta(days=dias), chr(0x10FFFF)))
+        return [placa for _, placa in self._vencimientos[:fin]]
@@ -0,0 +1,191 @@
+"""
+Índice de placas para búsquedas parciales y aproximadas
+
+Cada placa se indexa por una clave canónica: sin guiones ni espacios, en
+mayúsculas y con los caracteres que se confunden al leer una placa (O, Q y
+0; I, L y 1; S y 5; B y 8; Z y 2; G y 6) llevados a uno solo. Así "ABO-123"
+y "AB0123" tienen la misma clave, y una lectura equivocada de esos
+caracteres no impide encontrar la placa.
+
+Las claves se guardan en dos listas ordenadas, una de claves y otra de
+claves invertidas, y una búsqueda binaria en cada una da las placas que
+empiezan o terminan con lo escrito. Las placas a una edición de distancia
+(un carácter cambiado, de más o de menos) se encuentran sin recorrer el
+índice: si hay una sola edición, la primera mitad de la consulta queda
+intacta al principio de la placa o la segunda mitad al final, así que los
+candidatos salen de las mismas dos búsquedas y solo se verifican esos.
+"""
+
+from bisect import bisect_left
+from functools import lru_cache
+import threading
+
+# Caracteres que se confunden al leer una placa, llevados a uno solo
+_CONFUSIONES = str.maketrans({'O': '0', 'Q': '0', 'I': '1', 'L': '1', 'S': '5', 'B': '8', 'Z': '2',
+                              'G': '6', '-': None, ' ': None})
+
+_FIN = '\uffff'  # Mayor que cualquier carácter de una clave
+
+
+@lru_cache(maxsize=65536)
+def normalizar_placa(placa):
+    """Placa sin espacios al principio ni al final y en mayúsculas"""
+    return placa.strip().upper()
+
+
+@lru_cache(maxsize=65536)
+def clave_placa(placa):
+    """
+    Clave canónica de una placa o de parte de ella
+
+    Args:
+        placa (str): Placa tal como se escribió
+
+    Returns:
+        str: Clave sin separadores y con los caracteres confundibles unificados
+    """
+    return normalizar_placa(placa).translate(_CONFUSIONES)
+
+
+def _a_una_edicion(a, b):
+    """Indica si b se obtiene de a cambiando, agregando o quitando un carácter"""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:]
+    return a[i:] == b[i + 1:]
+
+
+class IndicePlacas:
+    """Placas conocidas ordenadas por clave canónica, al derecho y al revés"""
+
+    MAX_PENDIENTES = 128  # Claves nuevas que se revisan una por una antes de ordenarlas
+
+    def __init__(self, placas=()):
+        """
+        Inicializa el índice
+
+        Args:
+            placas (iterable): Placas a indexar
+        """
+        self._placas = {}  # clave -> placas con esa clave
+        self._claves = []  # Claves ordenadas
+        self._invertidas = []  # Claves invertidas, ordenadas
+        self._pendientes = []  # Claves nuevas aún no ordenadas
+        self._lock = threading.Lock()
+        self.agregar_varias(placas)
+
+    def __len__(self):
+        return sum(len(placas) for placas in self._placas.values())
+
+    def __contains__(self, placa):
+        return placa in self._placas.get(clave_placa(placa), ())
+
+    def agregar(self, placa):
+        """Agrega una placa (si ya estaba, no hace nada)"""
+        with self._lock:
+            self._agregar(placa)
+
+    def agregar_varias(self, placas):
+        """
+        Agrega varias placas; quedan pendientes como las de agregar y solo se
+        ordenan de una vez si superan MAX_PENDIENTES
+        """
+        with self._lock:
+            for placa in placas:
+                self._agregar(placa)
+            if len(self._pendientes) > self.MAX_PENDIENTES:
+                self._ordenar()
+
+    def _agregar(self, placa):
+        """Agrega una placa con el lock ya tomado"""
+        clave = clave_placa(placa)
+        placas = self._placas.get(clave)
+        if placas is None:
+            self._placas[clave] = [placa]
+            self._pendientes.append(clave)
+        elif placa not in placas:
+            placas.append(placa)
+
+    def _ordenar(self):
+        """
+        Incorpora las claves pendientes a las listas ordenadas
+
+        Reordenar cuesta O(n) aun con pocas claves nuevas (las listas ya están
+        casi ordenadas), por eso se hace recién cuando se juntan MAX_PENDIENTES.
+        """
+        if not self._pendientes:
+            return
+        self._claves = sorted(self._claves + self._pendientes)
+        self._invertidas = sorted(self._invertidas + [clave[::-1] for clave in self._pendientes])
+        self._pendientes = []
+
+    @staticmethod
+    def _con_prefijo(ordenadas, prefijo, limite=None):
+        """Claves de una lista ordenada que empiezan con el prefijo (hasta `limite`)"""
+        inicio = bisect_left(ordenadas, prefijo)
+        tope = len(ordenadas) if limite is None else min(len(ordenadas), inicio + limite)
+        fin = bisect_left(ordenadas, prefijo + _FIN, inicio, tope)
+        return ordenadas[inicio:fin]
+
+    def buscar(self, texto, limite=20, aproximada=True):
+        """
+        Busca placas por lo escrito hasta ahora
+
+        Args:
+            texto (str): Placa completa o parcial
+            limite (int): Cantidad máxima de resultados
+            aproximada (bool): Incluir placas a una edición de distancia
+
+        Returns:
+            list: (placa, coincidencia) de mejor a peor, donde coincidencia es
+            'exacta', 'prefijo', 'sufijo' o 'aproximada'
+        """
+        consulta = clave_placa(texto)
+        if not consulta:
+            return []
+
+        with self._lock:
+            if len(self._pendientes) > self.MAX_PENDIENTES:
+                self._ordenar()
+            claves, invertidas, pendientes = self._claves, self._invertidas, list(self._pendientes)
+            placas = self._placas
+
+        invertida = consulta[::-1]
+        encontradas = {}  # clave -> coincidencia, en orden de prioridad
+        if consulta in placas:
+            encontradas[consulta] = 'exacta'
+        prefijos = self._con_prefijo(claves, consulta, limite + 1)
+        prefijos.extend(clave for clave in pendientes if clave.startswith(consulta))
+        for clave in sorted(prefijos):
+            encontradas.setdefault(clave, 'prefijo')
+        sufijos = [clave[::-1] for clave in self._con_prefijo(invertidas, invertida, limite + 1)]
+        sufijos.extend(clave for clave in pendientes if clave.endswith(consulta))
+        for clave in sorted(sufijos):
+            encontradas.setdefault(clave, 'sufijo')
+
+        # A una edición, la primera mitad queda al principio o la segunda al final
+        if aproximada and len(consulta) >= 4 and len(encontradas) < limite:
+            mitad = len(consulta) // 2
+            largos = range(len(consulta) - 1, len(consulta) + 2)
+            candidatas = [clave for clave in self._con_prefijo(claves, consulta[:mitad]) if len(clave) in largos]
+            candidatas += [clave[::-1] for clave in self._con_prefijo(invertidas, invertida[:len(consulta) - mitad])
+                           if len(clave) in largos]
+            candidatas += [clave for clave in pendientes
+                           if clave.startswith(consulta[:mitad]) or clave.endswith(consulta[mitad:])]
+            for clave in sorted(set(candidatas)):
+                if clave not in encontradas and _a_una_edicion(consulta, clave):
+                    encontradas[clave] = 'aproximada'
+
+        resultado = []
+        for clave, coincidencia in encontradas.items():
+            for placa in placas[clave]:
+                resultado.append((placa, coincidencia))
+                if len(resultado) >= limite:
+                    return resultado
+        return resultado
@@ -0,0 +1,202 @@
+"""
+Instrumentación del Sistema de Estacionamiento
+
+Histogramas de latencia y contadores livianos, expuestos en el formato de
+texto de Prometheus (ver /metrics en app.py). Cada métrica se crea una sola
+vez, al decorar una función o al importar un módulo; registrar una medición
+es una búsqueda binaria sobre límites fijos y un incremento dentro de un lock,
+sin buscar la métrica por nombre ni crear estructuras nuevas.
+
+Los valores son por proceso: con varios procesos de gunicorn, cada uno
+expone los suyos.
+"""
+
+from bisect import bisect_left
+from functools import wraps
+import threading
+import time
+
+# Límites de los histogramas de latencia, en segundos (de 50 µs a 10 s)
+LIMITES_LATENCIA = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _etiquetas(etiquetas, extra=''):
+    """Etiquetas en formato Prometheus: {clave="valor",...}"""
+    partes = [f'{clave}="{_escapar(valor)}"' for clave, valor in etiquetas]
+    if extra:
+        partes.append(extra)
+    return '{' + ','.join(partes) + '}' if partes else ''
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Histograma:
+    """Histograma de límites fijos, con los contadores reservados al crearlo"""
+
+    def __init__(self, limites=LIMITES_LATENCIA):
+        """
+        Args:
+            limites (tuple): Límites superiores de los intervalos, en orden creciente
+        """
+        self.limites = tuple(limites)
+        self.cuentas = [0] * (len(self.limites) + 1)  # El último intervalo es +Inf
+        self.suma = 0.0
+        self._lock = threading.Lock()
+
+    def observar(self, valor):
+        """Registra una medición"""
+        indice = bisect_left(self.limites, valor)
+        with self._lock:
+            self.cuentas[indice] += 1
+            self.suma += valor
+
+    @property
+    def cantidad(self):
+        return sum(self.cuentas)
+
+    def lineas(self, nombre, etiquetas):
+        """Líneas de exposición (_bucket acumulados, _sum y _count)"""
+        with self._lock:
+            cuentas = list(self.cuentas)
+            suma = self.suma
+        acumulado = 0
+        for limite, cuenta in zip(self.limites + (None,), cuentas):
+            acumulado += cuenta
+            le = 'le="+Inf"' if limite is None else f'le="{limite!r}"'
+            yield f"{nombre}_bucket{_etiquetas(etiquetas, le)} {acumulado}"
+        yield f"{nombre}_sum{_etiquetas(etiquetas)} {suma!r}"
+        yield f"{nombre}_count{_etiquetas(etiquetas)} {acumulado}"
+
+
+class Contador:
+    """Contador que solo crece"""
+
+    def __init__(self):
+        self.valor = 0
+        self._lock = threading.Lock()
+
+    def incrementar(self, cantidad=1):
+        with self._lock:
+            self.valor += cantidad
+
+    def lineas(self, nombre, etiquetas):
+        yield f"{nombre}{_etiquetas(etiquetas)} {_numero(self.valor)}"
+
+
+class Medidor:
+    """Valor instantáneo que se lee al exponer las métricas"""
+
+    def __init__(self, funcion):
+        """
+        Args:
+            funcion (callable): Función sin argumentos que devuelve el valor
+        """
+        self.funcion = funcion
+
+    def lineas(self, nombre, etiquetas):
+        try:
+            valor = self.funcion()
+        except Exception as e:
+            print(f"Error al leer la métrica {nombre}: {e}")
+            return
+        yield f"{nombre}{_etiquetas(etiquetas)} {_numero(valor)}"
+
+
+class RegistroMetricas:
+    """Métricas del proceso, agrupadas por nombre y etiquetas"""
+
+    TIPOS = {Histograma: 'histogram', Contador: 'counter', Medidor: 'gauge'}
+
+    def __init__(self):
+        self._familias = {}  # nombre -> [clase, ayuda, {etiquetas: métrica}]
+        self._lock = threading.Lock()
+
+    def _obtener(self, clase, nombre, ayuda, etiquetas, crear):
+        clave = tuple(sorted(etiquetas.items()))
+        with self._lock:
+            familia = self._familias.setdefault(nombre, [clase, ayuda, {}])
+            if familia[0] is not clase:
+                raise ValueError(f"La métrica {nombre} ya existe con otro tipo")
+            metricas = familia[2]
+            if clave not in metricas:
+                metricas[clave] = crear()
+            return metricas[clave]
+
+    def histograma(self, nombre, ayuda, limites=LIMITES_LATENCIA, **etiquetas):
+        """Histograma con esas etiquetas (se crea la primera vez)"""
+        return self._obtener(Histograma, nombre, ayuda, etiquetas, lambda: Histograma(limites))
+
+    def contador(self, nombre, ayuda, **etiquetas):
+        """Contador con esas etiquetas (se crea la primera vez)"""
+        return self._obtener(Contador, nombre, ayuda, etiquetas, Contador)
+
+    def medidor(self, nombre, ayuda, funcion, **etiquetas):
+        """Registra (o reemplaza) un valor instantáneo calculado por `funcion`"""
+        clave = tuple(sorted(etiquetas.items()))
+        with self._lock:
+            familia = self._familias.setdefault(nombre, [Medidor, ayuda, {}])
+            familia[2][clave] = Medidor(funcion)
+
+    def exponer(self):
+        """
+        Returns:
+            str: Todas las métricas en el formato de texto de Prometheus
+        """
+        with self._lock:
+            familias = [(nombre, clase, ayuda, list(metricas.items()))
+                        for nombre, (clase, ayuda, metricas) in sorted(self._familias.items())]
+        lineas = []
+        for nombre, clase, ayuda, metricas in familias:
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {self.TIPOS[clase]}")
+            for etiquetas, metrica in metricas:
+                lineas.extend(metrica.lineas(nombre, etiquetas))
+        return '\n'.join(lineas) + '\n'
+
+
+REGISTRO = RegistroMetricas()
+
+
+def medir(histograma):
+    """
+    Decorador que registra la duración de cada llamada en un histograma
+
+    Args:
+        histograma (Histograma): Histograma donde se registran los segundos
+    """
+    def decorador(funcion):
+        observar = histograma.observar
+        reloj = time.perf_counter
+
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            inicio = reloj()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                observar(reloj() - inicio)
+        return envoltura
+    return decorador
+
+
+# Métricas de persistencia (ver persistencia.py)
+FSYNC = REGISTRO.histograma('estacionamiento_fsync_segundos', 'Duración de cada fsync')
+
+
+def bytes_escritos(destino):
+    """
+    Contador de bytes escritos a disco (en archivos de texto, caracteres)
+
+    Args:
+        destino (str): 'diario' o 'historial' (anexos) o 'reescritura'
+            (archivos completos: snapshots, índices)
+    """
+    return REGISTRO.contador('estacionamiento_bytes_escritos_total', 'Bytes escritos por la persistencia',
+                             destino=destino)
@@ -0,0 +1,109 @@
+"""
+Métricas en vivo del Sistema de Estacionamiento
+
+Los contadores de ocupación y recaudación se actualizan en cada mutación
+(ingreso, egreso) en lugar de recalcularse recorriendo los vehículos y el
+historial en cada solicitud; los de abonos salen del índice de abonos por
+vencimiento. Leerlos es O(1).
+"""
+
+from indice_abonos import IndiceAbonos
+
+
+class MetricasEnVivo:
+    """Contadores incrementales del estado del estacionamiento"""
+
+    def __init__(self, capacidad_total, tipos_vehiculo=(), indice_abonos=None):
+        """
+        Inicializa los contadores en cero
+
+        Args:
+            capacidad_total (int): Capacidad total del estacionamiento
+            tipos_vehiculo (iterable): Tipos de vehículo a contar por separado
+            indice_abonos (IndiceAbonos): Índice del que salen los conteos de abonos
+        """
+        self.capacidad_total = capacidad_total
+        self.ocupados = 0
+        self.por_tipo = {tipo: 0 for tipo in tipos_vehiculo}
+
+        # Historial (vehículos que ya salieron)
+        self.egresos = 0
+        self.recaudado = 0
+
+        self.abonos = indice_abonos or IndiceAbonos()
+
+    @classmethod
+    def desde_estado(cls, capacidad_total, tipos_vehiculo, vehiculos, indice_abonos, resumen_historial):
+        """
+        Construye los contadores recorriendo el estado una sola vez (al cargar)
+
+        Args:
+            capacidad_total (int): Capacidad total del estacionamiento
+            tipos_vehiculo (iterable): Tipos de vehículo
+            vehiculos (iterable): Vehículos actualmente estacionados
+            indice_abonos (IndiceAbonos): Índice de abonos ya armado
+            resumen_historial (tuple): (cantidad de egresos, total recaudado)
+        """
+        metricas = cls(capacidad_total, tipos_vehiculo, indice_abonos)
+        for vehiculo in vehiculos:
+            metricas.ingreso(vehiculo.tipo_vehiculo)
+        metricas.egresos, metricas.recaudado = resumen_historial
+        return metricas
+
+    @property
+    def disponibles(self):
+        """Espacios libres"""
+        return self.capacidad_total - self.ocupados
+
+    @property
+    def porcentaje_ocupacion(self):
+        """Porcentaje de espacios ocupados"""
+        return (self.ocupados / self.capacidad_total) * 100 if self.capacidad_total else 0
+
+    @property
+    def abonos_vigentes(self):
+        """Abonos vigentes"""
+        return self.abonos.cantidad_vigentes
+
+    @property
+    def abonos_vencidos(self):
+        """Abonos vencidos o cancelados"""
+        return self.abonos.cantidad_vencidos
+
+    @property
+    def ingresos_abonos(self):
+        """Monto pagado por los abonos vigentes"""
+        self.abonos.avanzar()
+        return self.abonos.monto_vigentes
+
+    @property
+    def total_abonos(self):
+        """Abonos registrados, vigentes o no"""
+        return self.abonos_vigentes + self.abonos_vencidos
+
+    def ingreso(self, tipo_vehiculo):
+        """Cuenta un vehículo que entró"""
+        self.ocupados += 1
+        self.por_tipo[tipo_vehiculo] = self.por_tipo.get(tipo_vehiculo, 0) + 1
+
+    def egreso(self, tipo_vehiculo, tarifa):
+        """Cuenta un vehículo que salió y lo cobrado"""
+        self.ocupados -= 1
+        self.por_tipo[tipo_vehiculo] = self.por_tipo.get(tipo_vehiculo, 0) - 1
+        self.egresos += 1
+        self.recaudado += tarifa
+
+    def a_dict(self):
+        """Instantánea de los contadores, serializable a JSON"""
+        return {
+            'capacidad_total': self.capacidad_total,
+            'ocupados': self.ocupados,
+            'disponibles': self.disponibles,
+            'porcentaje_ocupacion': self.porcentaje_ocupacion,
+            'por_tipo': dict(self.por_tipo),
+            'egresos': self.egresos,
+            'recaudado': self.recaudado,
+            'abonos_vigentes': self.abonos_vigentes,
+            'abonos_vencidos': self.abonos_vencidos,
+            'ingresos_abonos': self.ingresos_abonos
+        }
@@ -0,0 +1,184 @@
+"""
+Perfilador por muestreo del Sistema de Estacionamiento
+
+Mientras está activo, un hilo aparte toma cada pocos milisegundos la pila de
+los hilos que atienden solicitudes elegidas (por ruta o por porcentaje) y
+cuenta cuántas veces aparece cada pila. El resultado son pilas colapsadas,
+una por línea ("ruta;modulo:funcion;... cantidad"), el formato que leen
+flamegraph.pl, speedscope o inferno.
+
+Las solicitudes no se instrumentan: el costo para ellas es registrar el hilo
+al comenzar y quitarlo al terminar. Desactivado, no hay hilo de muestreo y a
+cada solicitud solo le cuesta leer `activo`.
+
+El perfil es por proceso: con varios procesos de gunicorn, cada uno perfila
+las solicitudes que atiende.
+"""
+
+from collections import Counter
+import os
+import random
+import sys
+import threading
+import time
+
+OTRAS_PILAS = '[otras pilas]'  # Muestras que no entran en el límite de pilas distintas
+
+
+class PerfiladorMuestreo:
+    """Perfilador por muestreo de las solicitudes elegidas"""
+
+    INTERVALO = 0.005  # Segundos entre muestras
+    PROFUNDIDAD = 80  # Marcos por pila (los más cercanos a la raíz se descartan)
+    MAX_PILAS = 20000  # Pilas distintas que se guardan
+
+    def __init__(self):
+        self.activo = False
+        self.rutas = frozenset()
+        self.porcentaje = 100.0
+        self.intervalo = self.INTERVALO
+        self.hasta = None  # Momento (time.monotonic) en que se desactiva solo
+        self.pilas = Counter()
+        self.muestras = 0
+        self.solicitudes = 0
+        self._hilos = {}  # id de hilo -> ruta de la solicitud que atiende
+        self._lock = threading.Lock()
+        self._detener = None
+
+    def activar(self, rutas=(), porcentaje=100.0, duracion=None, intervalo=None):
+        """
+        Comienza una captura nueva (descarta las pilas anteriores)
+
+        Args:
+            rutas (iterable): Reglas de las rutas a perfilar, como '/abonos'
+                (vacío para todas)
+            porcentaje (float): Porcentaje de esas solicitudes que se perfila
+            duracion (float): Segundos tras los cuales se desactiva solo (None
+                para seguir hasta desactivarlo)
+            intervalo (float): Segundos entre muestras
+
+        Returns:
+            tuple: (éxito, mensaje)
+        """
+        if not 0 < porcentaje <= 100:
+            return False, "El porcentaje debe estar entre 0 y 100"
+        if duracion is not None and duracion <= 0:
+            return False, "La duración debe ser positiva"
+        intervalo = self.INTERVALO if intervalo is None else intervalo
+        if not 0.0005 <= intervalo <= 1:
+            return False, "El intervalo debe estar entre 0.5 ms y 1 s"
+
+        self.desactivar()
+        with self._lock:
+            self.rutas = frozenset(rutas)
+            self.porcentaje = float(porcentaje)
+            self.intervalo = intervalo
+            self.hasta = time.monotonic() + duracion if duracion is not None else None
+            self.pilas = Counter()
+            self.muestras = 0
+            self.solicitudes = 0
+            self._detener = threading.Event()
+            self.activo = True
+        threading.Thread(target=self._muestrear, args=(self._detener,), name="perfilador",
+                         daemon=True).start()
+        return True, "Perfilador activado"
+
+    def desactivar(self):
+        """Detiene el muestreo; las pilas capturadas se conservan"""
+        with self._lock:
+            self.activo = False
+            self._hilos.clear()
+            if self._detener is not None:
+                self._detener.set()
+                self._detener = None
+
+    def comenzar(self, ruta):
+        """
+        Registra el hilo actual si su solicitud debe perfilarse
+
+        Args:
+            ruta (str): Regla de la ruta de la solicitud
+        """
+        if self.rutas and ruta not in self.rutas:
+            return
+        if self.porcentaje < 100 and random.random() * 100 >= self.porcentaje:
+            return
+        with self._lock:
+            if self.activo:
+                self._hilos[threading.get_ident()] = ruta
+                self.solicitudes += 1
+
+    def terminar(self):
+        """Quita el hilo actual de los perfilados (si estaba)"""
+        with self._lock:
+            self._hilos.pop(threading.get_ident(), None)
+
+    def _muestrear(self, detener):
+        """Bucle del hilo de muestreo"""
+        while not detener.wait(self.intervalo):
+            if self.hasta is not None and time.monotonic() >= self.hasta:
+                self.desactivar()
+                return
+            with self._lock:
+                if not self._hilos:
+                    continue
+                hilos = list(self._hilos.items())
+            # Las referencias a los marcos se sueltan enseguida: retenerlas hasta la
+            # próxima muestra haría que los objetos de una solicitud ya terminada
+            # se liberen en este hilo
+            marcos = sys._current_frames()
+            pilas = [self._pila(ruta, marcos[ident]) for ident, ruta in hilos if ident in marcos]
+            del marcos
+            with self._lock:
+                if detener.is_set():
+                    return
+                for pila in pilas:
+                    if pila not in self.pilas and len(self.pilas) >= self.MAX_PILAS:
+                        pila = OTRAS_PILAS
+                    self.pilas[pila] += 1
+                self.muestras += len(pilas)
+
+    def _pila(self, ruta, marco):
+        """Pila colapsada de un marco, desde la raíz y con la ruta como primer elemento"""
+        funciones = []
+        while marco is not None and len(funciones) < self.PROFUNDIDAD:
+            codigo = marco.f_code
+            modulo = marco.f_globals.get('__name__') or os.path.basename(codigo.co_filename)
+            funciones.append(f"{modulo}:{codigo.co_name}")
+            marco = marco.f_back
+        funciones.append(ruta)
+        return ';'.join(reversed(funciones))
+
+    def exportar(self, ruta=None):
+        """
+        Pilas colapsadas, de la más frecuente a la menos
+
+        Args:
+            ruta (str): Regla de la ruta cuyas pilas se exportan (None para todas)
+
+        Returns:
+            str: Una línea "pila cantidad" por pila
+        """
+        with self._lock:
+            pilas = self.pilas.most_common()
+        if ruta is not None:
+            pilas = [(pila, cantidad) for pila, cantidad in pilas if pila.split(';', 1)[0] == ruta]
+        return ''.join(f"{pila} {cantidad}\n" for pila, cantidad in pilas)
+
+    def estado(self):
+        """
+        Returns:
+            dict: Configuración actual y tamaño de la captura
+        """
+        with self._lock:
+            restante = max(0.0, self.hasta - time.monotonic()) if self.activo and self.hasta else None
+            return {
+                'activo': self.activo,
+                'rutas': sorted(self.rutas),
+                'porcentaje': self.porcentaje,
+                'intervalo_ms': self.intervalo * 1000,
+                'segundos_restantes': round(restante, 1) if restante is not None else None,
+                'solicitudes': self.solicitudes,
+                'muestras': self.muestras,
+                'pilas': len(self.pilas)
+            }
@@ -0,0 +1,279 @@
+"""
+Persistencia del Sistema de Estacionamiento
+
+Diario de eventos (journal) de solo anexado: cada mutación del estacionamiento
+se escribe como una línea JSON compacta al final del archivo, de modo que el
+costo de escritura por evento no depende del tamaño del estado.
+
+Los snapshots completos se escriben en un archivo temporal que luego reemplaza
+al original de forma atómica, y la política de durabilidad decide cuándo se
+fuerza la escritura a disco (fsync).
+"""
+
+import json
+import os
+import threading
+import time
+
+from instrumentacion import FSYNC, bytes_escritos
+
+POLITICAS_DURABILIDAD = ('siempre', 'grupo', 'sistema')
+
+BYTES_DIARIO = bytes_escritos('diario')
+BYTES_REESCRITURA = bytes_escritos('reescritura')
+
+
+def fsync(fd):
+    """os.fsync registrando su duración (ver instrumentacion.FSYNC)"""
+    inicio = time.perf_counter()
+    try:
+        os.fsync(fd)
+    finally:
+        FSYNC.observar(time.perf_counter() - inicio)
+
+
+def sincronizar_directorio(ruta):
+    """Fuerza a disco la entrada de directorio de un archivo recién renombrado"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return  # No soportado en Windows; el reemplazo sigue siendo atómico
+    fd = os.open(os.path.dirname(os.path.abspath(ruta)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def escribir_atomico(ruta, contenido, sincronizar=True):
+    """
+    Escribe un archivo completo sin dejarlo nunca truncado
+
+    El contenido se escribe en '<ruta>.tmp' y luego reemplaza al archivo
+    original con os.replace, que es atómico: ante una caída queda el archivo
+    anterior o el nuevo, nunca uno a medio escribir.
+
+    Args:
+        ruta (str): Archivo de destino
+        contenido (str | bytes): Texto o datos binarios a escribir
+        sincronizar (bool): Si es True se hace fsync del archivo y del directorio
+    """
+    temporal = ruta + '.tmp'
+    binario = isinstance(contenido, bytes)
+    with open(temporal, 'wb' if binario else 'w', encoding=None if binario else 'utf-8') as f:
+        BYTES_REESCRITURA.incrementar(f.write(contenido))
+        f.flush()
+        if sincronizar:
+            fsync(f.fileno())
+    os.replace(temporal, ruta)
+    if sincronizar:
+        sincronizar_directorio(ruta)
+
+
+class PoliticaDurabilidad:
+    """
+    Política que decide cuándo se hace fsync de lo escrito
+
+    - 'siempre': fsync en cada escritura (máxima seguridad)
+    - 'grupo': las escrituras de una ventana de `intervalo_ms` comparten un
+      único fsync (group commit)
+    - 'sistema': no se hace fsync; el sistema operativo decide cuándo escribir
+    """
+
+    def __init__(self, modo='siempre', intervalo_ms=50):
+        """
+        Inicializa la política de durabilidad
+
+        Args:
+            modo (str): 'siempre', 'grupo' o 'sistema'
+            intervalo_ms (int): Ventana de agrupación para el modo 'grupo'
+        """
+        if modo not in POLITICAS_DURABILIDAD:
+            raise ValueError(f"Política de durabilidad no válida. Opciones: {list(POLITICAS_DURABILIDAD)}")
+        self.modo = modo
+        self.intervalo_ms = intervalo_ms
+        self._pendientes = set()  # Descriptores con escrituras sin fsync
+        self._lock = threading.Lock()
+        self._temporizador = None
+
+    @property
+    def sincronizar_snapshots(self):
+        """Indica si los snapshots completos deben llevar fsync"""
+        return self.modo != 'sistema'
+
+    def tras_escritura(self, archivo):
+        """
+        Aplica la política después de escribir en un archivo abierto
+
+        Args:
+            archivo: Objeto archivo ya vaciado con flush()
+        """
+        if self.modo == 'siempre':
+            fsync(archivo.fileno())
+        elif self.modo == 'grupo':
+            with self._lock:
+                self._pendientes.add(archivo.fileno())
+                if self._temporizador is None:
+                    self._temporizador = threading.Timer(self.intervalo_ms / 1000, self.vaciar)
+                    self._temporizador.daemon = True
+                    self._temporizador.start()
+
+    def vaciar(self):
+        """Hace fsync de todas las escrituras pendientes del grupo"""
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, set()
+            if self._temporizador is not None:
+                self._temporizador.cancel()
+                self._temporizador = None
+        for fd in pendientes:
+            try:
+                fsync(fd)
+            except OSError:
+                pass  # El archivo se cerró (p. ej. por una compactación) y ya se sincronizó
+
+
+class ProgramadorGrupal:
+    """Agrupa varias solicitudes de una acción costosa en una sola ejecución"""
+
+    def __init__(self, intervalo_ms, accion):
+        """
+        Inicializa el programador
+
+        Args:
+            intervalo_ms (int): Espera desde la primera solicitud hasta ejecutar
+            accion (callable): Acción a ejecutar una vez por ventana
+        """
+        self.intervalo_ms = intervalo_ms
+        self.accion = accion
+        self._lock = threading.Lock()
+        self._temporizador = None
+
+    def solicitar(self):
+        """Programa la acción si no hay una ejecución pendiente"""
+        with self._lock:
+            if self._temporizador is None:
+                self._temporizador = threading.Timer(self.intervalo_ms / 1000, self._ejecutar)
+                self._temporizador.daemon = True
+                self._temporizador.start()
+
+    def _ejecutar(self):
+        with self._lock:
+            self._temporizador = None
+        self.accion()
+
+    def forzar(self):
+        """Ejecuta inmediatamente la acción si había una pendiente"""
+        with self._lock:
+            pendiente = self._temporizador is not None
+            if pendiente:
+                self._temporizador.cancel()
+                self._temporizador = None
+        if pendiente:
+            self.accion()
+
+
+class DiarioEventos:
+    """Diario de eventos de solo anexado con soporte para compactación"""
+
+    def __init__(self, ruta, eventos_por_compactacion=500, durabilidad=None):
+        """
+        Inicializa el diario de eventos
+
+        Args:
+            ruta (str): Ruta del archivo del diario
+            eventos_por_compactacion (int): Eventos acumulados antes de
+                solicitar una compactación (snapshot completo)
+            durabilidad (PoliticaDurabilidad): Política de fsync de los anexos
+        """
+        self.ruta = ruta
+        self.eventos_por_compactacion = eventos_por_compactacion
+        self.durabilidad = durabilidad or PoliticaDurabilidad()
+        self.eventos_pendientes = 0  # Eventos escritos desde la última compactación
+        self._archivo = None
+
+    def anexar(self, secuencia, tipo, datos):
+        """
+        Anexa un evento al final del diario
+
+        Args:
+            secuencia (int): Número de secuencia del evento
+            tipo (str): Tipo de evento ('ingreso', 'egreso', 'tarifas', 'abono')
+            datos (dict): Datos del evento
+
+        Returns:
+            bool: True si corresponde compactar el diario
+        """
+        return self.anexar_varios([(secuencia, tipo, datos)])
+
+    def anexar_varios(self, eventos):
+        """
+        Anexa varios eventos con una sola escritura y una sola sincronización
+
+        Args:
+            eventos (list): Eventos (secuencia, tipo, datos) en orden
+
+        Returns:
+            bool: True si corresponde compactar el diario
+        """
+        lineas = ''.join(self._linea(*evento) for evento in eventos)
+
+        if self._archivo is None:
+            self._archivo = open(self.ruta, 'a', encoding='utf-8')
+
+        BYTES_DIARIO.incrementar(self._archivo.write(lineas))
+        self._archivo.flush()
+        self.durabilidad.tras_escritura(self._archivo)
+
+        self.eventos_pendientes += len(eventos)
+        return self.eventos_pendientes >= self.eventos_por_compactacion
+
+    @staticmethod
+    def _linea(secuencia, tipo, datos):
+        return json.dumps({'s': secuencia, 't': tipo, 'd': datos},
+                          ensure_ascii=False, separators=(',', ':')) + '\n'
+
+    def reescribir(self, eventos):
+        """
+        Reemplaza de forma atómica el contenido del diario
+
+        Args:
+            eventos (list): Eventos (secuencia, tipo, datos) que quedan en el diario
+        """
+        self.cerrar()
+        escribir_atomico(self.ruta, ''.join(self._linea(*evento) for evento in eventos),
+                         sincronizar=self.durabilidad.sincronizar_snapshots)
+        self.eventos_pendientes = len(eventos)
+
+    def leer(self):
+        """
+        Lee los eventos del diario en orden
+
+        Una última línea incompleta (escritura interrumpida) se descarta.
+
+        Yields:
+            tuple: (secuencia, tipo, datos)
+        """
+        if not os.path.exists(self.ruta):
+            return
+
+        with open(self.ruta, 'r', encoding='utf-8') as f:
+            for linea in f:
+                if not linea.endswith('\n'):
+                    break
+                try:
+                    evento = json.loads(linea)
+                except json.JSONDecodeError:
+                    break
+                yield evento['s'], evento['t'], evento['d']
+
+    def truncar(self):
+        """Vacía el diario después de escribir un snapshot completo"""
+        self.cerrar()
+        with open(self.ruta, 'w', encoding='utf-8'):
+            pass
+        self.eventos_pendientes = 0
+
+    def cerrar(self):
+        """Cierra el archivo del diario si está abierto"""
+        if self._archivo is not None:
+            self.durabilidad.vaciar()
+            self._archivo.close()
+            self._archivo = None
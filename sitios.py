@@ -0,0 +1,203 @@
+"""
+Sitios del Sistema de Estacionamiento
+
+Un proceso puede atender varios estacionamientos (sitios). Cada sitio es una
+instancia independiente de Estacionamiento, con su propio lock y su propio
+fragmento de almacenamiento (archivos o base de datos con el id del sitio en
+el nombre), así que el tráfico de un sitio nunca espera al de otro. Los
+totales entre sitios se suman de los contadores en vivo de cada uno.
+
+Los sitios se configuran en un archivo JSON:
+
+    [
+        {"id": "centro", "nombre": "Estacionamiento Centro", "capacidad": 120},
+        {"id": "norte", "nombre": "Estacionamiento Norte", "capacidad": 60}
+    ]
+
+Campos opcionales de cada sitio: "politica_espacios" y "espacios" (bloques
+de espacios, ver InventarioEspacios.desde_configuracion).
+"""
+
+import json
+import os
+import re
+import threading
+
+from estacionamiento import Estacionamiento
+
+SITIO_PRINCIPAL = 'principal'  # Id del único sitio cuando no hay configuración
+PATRON_ID = re.compile(r'^[a-z0-9][a-z0-9_-]{0,31}$')
+
+# Contadores que se suman entre sitios (ver MetricasEnVivo.a_dict)
+CONTADORES_SUMADOS = ('capacidad_total', 'ocupados', 'disponibles', 'egresos', 'recaudado',
+                      'abonos_vigentes', 'abonos_vencidos', 'ingresos_abonos')
+
+
+def ruta_fragmento(ruta, id_sitio):
+    """
+    Ruta del fragmento de almacenamiento de un sitio
+
+    Args:
+        ruta (str): Ruta base, como 'estacionamiento.db'
+        id_sitio (str): Id del sitio
+
+    Returns:
+        str: La ruta con el id antes de la extensión ('estacionamiento_centro.db')
+    """
+    base, extension = os.path.splitext(ruta)
+    return f"{base}_{id_sitio}{extension}"
+
+
+class RegistroSitios:
+    """Estacionamientos del proceso, por id de sitio"""
+
+    def __init__(self, crear_almacenamiento):
+        """
+        Args:
+            crear_almacenamiento (callable): Recibe el id de un sitio y devuelve
+                el backend de almacenamiento de su fragmento
+        """
+        self.crear_almacenamiento = crear_almacenamiento
+        self._sitios = {}  # id -> Estacionamiento, en el orden en que se agregaron
+        self._lock = threading.Lock()
+
+    @classmethod
+    def desde_archivo(cls, ruta, crear_almacenamiento):
+        """
+        Crea el registro con los sitios de un archivo de configuración
+
+        Args:
+            ruta (str): Archivo JSON con la lista de sitios
+            crear_almacenamiento (callable): Ver __init__
+
+        Returns:
+            RegistroSitios: Registro con todos los sitios; ValueError si la
+            configuración no es válida
+        """
+        with open(ruta, 'r', encoding='utf-8') as f:
+            configuracion = json.load(f)
+        if not isinstance(configuracion, list) or not configuracion:
+            raise ValueError(f"{ruta} debe contener una lista de sitios")
+
+        registro = cls(crear_almacenamiento)
+        for sitio in configuracion:
+            exito, mensaje, _ = registro.agregar(
+                sitio.get('id'), sitio.get('nombre') or sitio.get('id'), sitio.get('capacidad', 50),
+                politica_espacios=sitio.get('politica_espacios', 'menor_primero'),
+                configuracion_espacios=sitio.get('espacios'))
+            if not exito:
+                raise ValueError(f"{ruta}: {mensaje}")
+        return registro
+
+    def agregar(self, id_sitio, nombre, capacidad_total=50, politica_espacios='menor_primero',
+                configuracion_espacios=None):
+        """
+        Crea el estacionamiento de un sitio y carga sus datos
+
+        Args:
+            id_sitio (str): Id del sitio (minúsculas, números, '-' y '_'); va en
+                las URLs y en el nombre de su fragmento de almacenamiento
+            nombre (str): Nombre del estacionamiento
+            capacidad_total (int): Número de espacios
+            politica_espacios (str): 'menor_primero' o 'rotativo'
+            configuracion_espacios (list): Bloques de espacios por nivel, zona y tipo
+
+        Returns:
+            tuple: (éxito, mensaje, estacionamiento)
+        """
+        if not isinstance(id_sitio, str) or not PATRON_ID.match(id_sitio):
+            return False, f"Id de sitio no válido: {id_sitio!r}", None
+
+        with self._lock:
+            if id_sitio in self._sitios:
+                return False, f"El sitio {id_sitio} ya existe", None
+            estacionamiento = Estacionamiento(capacidad_total=capacidad_total, nombre=nombre,
+                                              almacenamiento=self.crear_almacenamiento(id_sitio),
+                                              politica_espacios=politica_espacios,
+                                              configuracion_espacios=configuracion_espacios)
+            # Los lectores recorren el diccionario sin lock: se reemplaza por una copia
+            sitios = dict(self._sitios)
+            sitios[id_sitio] = estacionamiento
+            self._sitios = sitios
+        return True, f"Sitio {id_sitio} agregado", estacionamiento
+
+    def obtener(self, id_sitio):
+        """
+        Returns:
+            Estacionamiento: El estacionamiento del sitio, o None si no existe
+        """
+        return self._sitios.get(id_sitio)
+
+    @property
+    def principal(self):
+        """Id del primer sitio, el que atiende las URLs sin prefijo de sitio"""
+        return next(iter(self._sitios))
+
+    def items(self):
+        """Pares (id, estacionamiento) en el orden de la configuración"""
+        return self._sitios.items()
+
+    def __contains__(self, id_sitio):
+        return id_sitio in self._sitios
+
+    def __len__(self):
+        return len(self._sitios)
+
+    def resumen(self):
+        """
+        Contadores de cada sitio y su suma, sin recorrer vehículos ni historial
+
+        Returns:
+            dict: 'sitios' (id, nombre y métricas de cada uno) y 'total'
+        """
+        sitios = []
+        total = dict.fromkeys(CONTADORES_SUMADOS, 0)
+        total['por_tipo'] = {}
+        for id_sitio, estacionamiento in self._sitios.items():
+            metricas = estacionamiento.obtener_metricas()
+            sitios.append({'id': id_sitio, 'nombre': estacionamiento.nombre, 'metricas': metricas})
+            for contador in CONTADORES_SUMADOS:
+                total[contador] += metricas[contador]
+            for tipo, cantidad in metricas['por_tipo'].items():
+                total['por_tipo'][tipo] = total['por_tipo'].get(tipo, 0) + cantidad
+        total['porcentaje_ocupacion'] = (total['ocupados'] / total['capacidad_total'] * 100
+                                         if total['capacidad_total'] else 0)
+        return {'sitios': sitios, 'total': total}
+
+    def cerrar(self):
+        """Escribe los cambios pendientes de todos los sitios"""
+        for _, estacionamiento in self.items():
+            estacionamiento.cerrar()
+
+
+class DespachoSitios:
+    """
+    Middleware WSGI que atiende /sitios/<id>/... con las rutas de la aplicación
+
+    Quita el prefijo del sitio de PATH_INFO y lo pasa a SCRIPT_NAME, así las
+    URLs que genera la aplicación (url_for, redirecciones) quedan dentro del
+    mismo sitio. El id queda en environ['estacionamiento.sitio']; las URLs
+    sin prefijo corresponden al sitio principal.
+    """
+
+    PREFIJO = '/sitios/'
+    CLAVE = 'estacionamiento.sitio'
+
+    def __init__(self, aplicacion, registro):
+        """
+        Args:
+            aplicacion (callable): Aplicación WSGI
+            registro (RegistroSitios): Sitios disponibles
+        """
+        self.aplicacion = aplicacion
+        self.registro = registro
+
+    def __call__(self, environ, start_response):
+        ruta = environ.get('PATH_INFO', '')
+        if ruta.startswith(self.PREFIJO):
+            id_sitio, _, resto = ruta[len(self.PREFIJO):].partition('/')
+            if id_sitio in self.registro:
+                environ[self.CLAVE] = id_sitio
+                environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + self.PREFIJO + id_sitio
+                environ['PATH_INFO'] = '/' + resto
+        return self.aplicacion(environ, start_response)
@@ -0,0 +1,192 @@
+"""
+Snapshot binario del Sistema de Estacionamiento
+
+Alternativa compacta al snapshot JSON con el mismo contenido. Las tablas
+(vehículos, historial reciente, abonos y claves de idempotencia) se guardan
+por columnas: cada columna es un arreglo de enteros o reales empaquetado con
+el módulo array, las fechas son microsegundos desde la época y los textos se
+guardan una sola vez en una tabla de cadenas. Al leerlo, cada columna se
+recupera de un solo bloque con frombytes en lugar de analizar el JSON fila
+por fila, y las fechas se convierten con aritmética entera, sin
+datetime.fromisoformat.
+
+Formato:
+    MAGIA | orden de bytes | configuración (JSON) | cadenas (JSON) | tablas
+donde cada bloque lleva su longitud como entero sin signo de 32 bits y cada
+tabla, su cantidad de filas seguida de sus columnas.
+"""
+
+from array import array
+from datetime import datetime, timedelta
+import json
+import math
+import struct
+import sys
+
+MAGIA = b'ESTB1'
+EPOCA = datetime(1970, 1, 1)
+UN_MICROSEGUNDO = timedelta(microseconds=1)
+
+_NULO = -2**63  # Entero o fecha ausente
+_SIN_TEXTO = 2**32 - 1  # Texto ausente
+
+# Código de array de cada clase de columna
+_CODIGOS = {'texto': 'I', 'fecha': 'q', 'entero': 'q', 'logico': 'b', 'real': 'd', 'numero': 'd'}
+
+COLUMNAS_VEHICULO = (
+    ('placa', 'texto'), ('tipo_vehiculo', 'texto'), ('propietario', 'texto'),
+    ('hora_entrada', 'fecha'), ('hora_salida', 'fecha'), ('espacio_asignado', 'entero'),
+    ('tarifa_pagada', 'real'), ('version_tarifa', 'entero')
+)
+COLUMNAS_ABONO = (
+    ('placa', 'texto'), ('propietario', 'texto'), ('tipo_vehiculo', 'texto'),
+    ('telefono', 'texto'), ('email', 'texto'), ('fecha_inicio', 'fecha'),
+    ('fecha_vencimiento', 'fecha'), ('activo', 'logico'), ('monto_pagado', 'real'),
+    ('descuento_aplicado', 'real')
+)
+COLUMNAS_CLAVE = (('id_evento', 'texto'), ('tipo', 'texto'), ('placa', 'texto'), ('valor', 'numero'))
+
+# (clave del snapshot, columnas, forma: 'dict' por placa, 'lista' de dicts o 'filas' de listas)
+TABLAS = (
+    ('vehiculos_actuales', COLUMNAS_VEHICULO, 'dict'),
+    ('historial_resumido', COLUMNAS_VEHICULO, 'lista'),
+    ('abonos_mensuales', COLUMNAS_ABONO, 'dict'),
+    ('claves_aplicadas', COLUMNAS_CLAVE, 'filas'),
+)
+
+
+def a_microsegundos(fecha):
+    """Fecha (datetime o texto ISO 8601) como microsegundos desde la época, o _NULO"""
+    if not fecha:
+        return _NULO
+    if not isinstance(fecha, datetime):
+        fecha = datetime.fromisoformat(fecha)
+    return (fecha - EPOCA) // UN_MICROSEGUNDO
+
+
+def desde_microsegundos(valor):
+    """Inversa de a_microsegundos"""
+    return None if valor == _NULO else EPOCA + timedelta(0, 0, valor)
+
+
+def _bloque(datos):
+    return struct.pack('<I', len(datos)) + datos
+
+
+def _codificar(valor, clase, cadenas):
+    """Convierte un valor del snapshot JSON al entero o real de su columna"""
+    if clase == 'texto':
+        return _SIN_TEXTO if valor is None else cadenas.setdefault(valor, len(cadenas))
+    if clase == 'fecha':
+        return a_microsegundos(valor)
+    if clase == 'entero':
+        return _NULO if valor is None else int(valor)
+    if clase == 'logico':
+        return 1 if valor else 0
+    return math.nan if valor is None else float(valor)
+
+
+def _decodificar(valores, clase, cadenas):
+    """Convierte una columna leída a los valores del snapshot (fechas como datetime)"""
+    if clase == 'texto':
+        return [None if v == _SIN_TEXTO else cadenas[v] for v in valores]
+    if clase == 'fecha':
+        epoca, delta = EPOCA, timedelta
+        return [None if v == _NULO else epoca + delta(0, 0, v) for v in valores]
+    if clase == 'entero':
+        return [None if v == _NULO else v for v in valores]
+    if clase == 'logico':
+        return [bool(v) for v in valores]
+    if clase == 'numero':
+        return [None if math.isnan(v) else int(v) if v.is_integer() else v for v in valores]
+    return [None if math.isnan(v) else v for v in valores]
+
+
+def escribir_snapshot(estado):
+    """
+    Serializa un estado con el formato del snapshot JSON
+
+    Args:
+        estado (dict): Estado como el que devuelve Estacionamiento.exportar_estado
+
+    Returns:
+        bytes: Snapshot binario
+    """
+    configuracion = {clave: valor for clave, valor in estado.items()
+                     if clave not in {tabla for tabla, _, _ in TABLAS}}
+    cadenas = {}  # texto -> índice; cada texto se guarda una sola vez
+
+    tablas = []
+    for tabla, columnas, forma in TABLAS:
+        filas = estado.get(tabla)
+        if not filas:
+            filas = []
+        elif forma == 'dict':
+            filas = list(filas.values())
+        elif forma == 'filas':
+            filas = [dict(zip((nombre for nombre, _ in columnas), fila)) for fila in filas]
+
+        partes = [struct.pack('<I', len(filas))]
+        for nombre, clase in columnas:
+            columna = array(_CODIGOS[clase], (_codificar(fila.get(nombre), clase, cadenas) for fila in filas))
+            partes.append(_bloque(columna.tobytes()))
+        tablas.append(b''.join(partes))
+
+    return b''.join([
+        MAGIA,
+        sys.byteorder[0].encode('ascii'),
+        _bloque(json.dumps(configuracion, ensure_ascii=False).encode('utf-8')),
+        _bloque(json.dumps(list(cadenas), ensure_ascii=False).encode('utf-8')),
+        *tablas
+    ])
+
+
+def leer_snapshot(contenido):
+    """
+    Reconstruye el estado a partir de un snapshot binario
+
+    Args:
+        contenido (bytes): Snapshot generado por escribir_snapshot
+
+    Returns:
+        dict: Estado con el formato del snapshot JSON, con las fechas como datetime
+    """
+    if not contenido.startswith(MAGIA):
+        raise ValueError("No es un snapshot binario del estacionamiento")
+    invertir = contenido[len(MAGIA):len(MAGIA) + 1] != sys.byteorder[0].encode('ascii')
+    posicion = len(MAGIA) + 1
+
+    def leer_bloque():
+        nonlocal posicion
+        (longitud,) = struct.unpack_from('<I', contenido, posicion)
+        inicio = posicion + 4
+        posicion = inicio + longitud
+        if posicion > len(contenido):
+            raise ValueError("Snapshot binario truncado")
+        return contenido[inicio:posicion]
+
+    estado = json.loads(leer_bloque().decode('utf-8'))
+    cadenas = json.loads(leer_bloque().decode('utf-8'))
+
+    for tabla, columnas, forma in TABLAS:
+        (cantidad,) = struct.unpack_from('<I', contenido, posicion)
+        posicion += 4
+
+        valores = []
+        for _, clase in columnas:
+            columna = array(_CODIGOS[clase])
+            columna.frombytes(leer_bloque())
+            if invertir:
+                columna.byteswap()
+            if len(columna) != cantidad:
+                raise ValueError(f"Columna con largo incorrecto en {tabla}")
+            valores.append(_decodificar(columna, clase, cadenas))
+
+        if forma == 'filas':
+            estado[tabla] = [list(fila) for fila in zip(*valores)]
+            continue
+        nombres = [nombre for nombre, _ in columnas]
+        filas = list(map(dict, map(zip, [nombres] * cantidad, zip(*valores))))
+        estado[tabla] = dict(zip(valores[0], filas)) if forma == 'dict' else filas
+
+    return estado
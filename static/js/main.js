@@ -1,9 +1,14 @@
 // JavaScript principal para el Sistema de Estacionamiento
 
 // Configuración global
+const API_BASE = window.BASE_SITIO || ''; // Prefijo del sitio actual (ver base.html)
+
 const CONFIG = {
-    API_BASE: '',
-    UPDATE_INTERVAL: 30000, // 30 segundos
+    API_BASE: API_BASE,
+    UPDATE_INTERVAL: 30000, // 30 segundos (solo si no hay flujo de eventos)
+    EVENTS_URL: API_BASE + '/api/eventos',
+    EVENTS_RETRY: 60000, // Nuevo intento del flujo si el servidor lo rechazó
+    FARE_TICK: 30000, // Recalcular tiempos y tarifas en pantalla
     ANIMATION_DURATION: 300
 };
 
@@ -50,6 +55,16 @@ const Utils = {
         }, 5000);
     },
 
+    // Tarifa en un instante a partir del plan que envía el servidor:
+    // mínimo 1 hora, cada hora iniciada se cobra completa
+    calcularTarifa: (plan, ahora) => {
+        const horas = (ahora - plan.entrada) / 3600000;
+        const horasACobrar = Math.max(1, Math.ceil(horas));
+        const abonoVigente = plan.abono_vence !== null && ahora <= plan.abono_vence;
+        const factor = abonoVigente ? plan.factor_descuento : 1;
+        return horasACobrar * plan.tarifa_hora * factor;
+    },
+
     // Validar placa
     validatePlaca: (placa) => {
         const regex = /^[A-Z0-9-]{3,8}$/;
@@ -74,15 +89,110 @@ const Utils = {
 class EstacionamientoDashboard {
     constructor() {
         this.updateInterval = null;
+        this.eventSource = null;
+        this.vehiculosVersion = null; // Versión del estado que muestra la tabla
         this.init();
     }
 
     init() {
         this.bindEvents();
-        this.startAutoUpdate();
+        this.startLiveUpdates();
+        this.startFareTicker();
         this.initializeFormValidation();
     }
 
+    // El tiempo y la tarifa de cada fila se recalculan localmente con el plan
+    // de tarifa de cada vehículo, sin volver a pedirlos al servidor
+    startFareTicker() {
+        setInterval(() => this.refreshLiveFares(), CONFIG.FARE_TICK);
+    }
+
+    refreshLiveFares() {
+        let planesVencidos = false;
+        document.querySelectorAll('#tabla-vehiculos tbody tr[data-plan]').forEach(row => {
+            const plan = JSON.parse(row.dataset.plan);
+            const ahora = Date.now() + parseInt(row.dataset.desfase, 10);
+            const tiempo = row.querySelector('.celda-tiempo');
+            const tarifa = row.querySelector('.celda-tarifa .monto');
+            if (tiempo) tiempo.textContent = Utils.formatTime((ahora - plan.entrada) / 1000);
+            if (plan.tarifa_hora === null) {
+                // Tarifa con franjas o tope: el monto del servidor vale hasta proximo_cambio
+                if (plan.proximo_cambio !== null && ahora > plan.proximo_cambio) planesVencidos = true;
+            } else if (tarifa) {
+                tarifa.textContent = Utils.formatCurrency(Utils.calcularTarifa(plan, ahora));
+            }
+        });
+        if (planesVencidos) {
+            this.updateVehiculosTable();
+        }
+    }
+
+    // Recibe los cambios por Server-Sent Events; si el navegador no lo
+    // soporta o el servidor cierra el flujo, vuelve a consultar periódicamente
+    startLiveUpdates() {
+        if (!window.EventSource) {
+            this.startAutoUpdate();
+            return;
+        }
+
+        const source = new EventSource(CONFIG.EVENTS_URL);
+        this.eventSource = source;
+
+        source.addEventListener('estado', (e) => {
+            const data = JSON.parse(e.data);
+            this.updateDashboardStats(data.metricas);
+            // Completa una sola vez las tarifas y abonos de la tabla
+            if (document.getElementById('tabla-vehiculos')) {
+                this.updateVehiculosTable();
+            }
+        });
+
+        source.addEventListener('ingreso', (e) => {
+            const data = JSON.parse(e.data);
+            this.updateDashboardStats(data.metricas);
+            this.addVehiculoRow(data.datos);
+        });
+
+        source.addEventListener('egreso', (e) => {
+            const data = JSON.parse(e.data);
+            this.updateDashboardStats(data.metricas);
+            this.removeVehiculoRow(data.datos.placa);
+        });
+
+        // Cambios que afectan las tarifas mostradas, o estado de otro proceso
+        ['tarifas', 'abono', 'recarga'].forEach(tipo => {
+            source.addEventListener(tipo, (e) => {
+                const data = JSON.parse(e.data);
+                this.updateDashboardStats(data.metricas);
+                if (document.getElementById('tabla-vehiculos')) {
+                    this.updateVehiculosTable();
+                }
+            });
+        });
+
+        source.onopen = () => this.stopAutoUpdate();
+
+        source.onerror = () => {
+            // Mientras esté en CONNECTING el navegador reintenta solo. Si el
+            // servidor rechazó el flujo (503 con demasiadas pantallas) se consulta
+            // periódicamente y se vuelve a intentar el flujo más tarde
+            if (source.readyState === EventSource.CLOSED) {
+                this.eventSource = null;
+                this.updateDashboard();
+                this.startAutoUpdate();
+                setTimeout(() => this.startLiveUpdates(), CONFIG.EVENTS_RETRY);
+            }
+        };
+    }
+
+    stopLiveUpdates() {
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
+        this.stopAutoUpdate();
+    }
+
     bindEvents() {
         // Botón de actualización manual
         const btnActualizar = document.getElementById('btn-actualizar');
@@ -119,15 +229,15 @@ class EstacionamientoDashboard {
 
     async updateDashboard() {
         try {
-            const response = await fetch('/api/estado');
+            const response = await fetch(`${CONFIG.API_BASE}/api/estado`);
             if (!response.ok) throw new Error('Error al obtener datos');
             
             const data = await response.json();
             this.updateDashboardStats(data);
             
-            // Actualizar tabla de vehículos si existe
+            // Actualizar tabla de vehículos si existe (solo lo que cambió)
             if (document.getElementById('tabla-vehiculos')) {
-                await this.updateVehiculosTable();
+                await this.syncVehiculosTable();
             }
             
         } catch (error) {
@@ -137,6 +247,7 @@ class EstacionamientoDashboard {
     }
 
     updateDashboardStats(data) {
+        if (!data) return;
         // Actualizar estadísticas
         const elementos = {
             'espacios-disponibles': data.disponibles,
@@ -174,61 +285,131 @@ class EstacionamientoDashboard {
         }
     }
 
-    async updateVehiculosTable() {
+    // Pide solo las placas agregadas y quitadas desde la última versión vista
+    async syncVehiculosTable() {
+        if (this.vehiculosVersion === null) {
+            return this.updateVehiculosTable();
+        }
         try {
-            const response = await fetch('/api/vehiculos');
+            const response = await fetch(`${CONFIG.API_BASE}/api/vehiculos?since=${this.vehiculosVersion}`);
             if (!response.ok) throw new Error('Error al obtener vehículos');
             
-            const vehiculos = await response.json();
-            const tbody = document.querySelector('#tabla-vehiculos tbody');
-            
-            if (!tbody) return;
-            
-            // Limpiar tabla
-            tbody.innerHTML = '';
-            
-            if (vehiculos.length === 0) {
-                tbody.innerHTML = `
-                    <tr>
-                        <td colspan="8" class="text-center py-4">
-                            <i class="fas fa-car fa-2x text-muted mb-2"></i>
-                            <br>No hay vehículos en el estacionamiento
-                        </td>
-                    </tr>
-                `;
-                return;
+            const cambios = await response.json();
+            if (cambios.completo) {
+                this.renderVehiculosTable(cambios.vehiculos);
+            } else {
+                cambios.quitados.forEach(placa => this.removeVehiculoRow(placa));
+                cambios.agregados.forEach(vehiculo => this.addVehiculoRow(vehiculo));
             }
+            this.vehiculosVersion = cambios.version;
             
-            // Agregar vehículos
-            vehiculos.forEach(vehiculo => {
-                const abonoHtml = vehiculo.tiene_abono 
-                    ? '<span class="badge bg-success" title="Con descuento del 10%"><i class="fas fa-calendar-check"></i> Sí</span>'
-                    : '<span class="badge bg-secondary"><i class="fas fa-times"></i> No</span>';
-                
-                const tarifaHtml = vehiculo.tiene_abono 
-                    ? `<span class="badge bg-success">${Utils.formatCurrency(vehiculo.tarifa_actual)} <small class="text-muted">(-10%)</small></span>`
-                    : `<span class="badge bg-success">${Utils.formatCurrency(vehiculo.tarifa_actual)}</span>`;
-                
-                const row = document.createElement('tr');
-                row.innerHTML = `
-                    <td><strong>${vehiculo.placa}</strong></td>
-                    <td><span class="badge bg-secondary">${vehiculo.tipo}</span></td>
-                    <td>${vehiculo.propietario || 'No especificado'}</td>
-                    <td><span class="badge bg-info">${vehiculo.espacio}</span></td>
-                    <td>${vehiculo.hora_entrada}</td>
-                    <td>${vehiculo.tiempo_horas}h ${vehiculo.tiempo_minutos}m</td>
-                    <td>${abonoHtml}</td>
-                    <td>${tarifaHtml}</td>
-                `;
-                tbody.appendChild(row);
-            });
+        } catch (error) {
+            console.error('Error actualizando tabla de vehículos:', error);
+        }
+    }
+
+    async updateVehiculosTable() {
+        try {
+            const response = await fetch(`${CONFIG.API_BASE}/api/vehiculos`);
+            if (!response.ok) throw new Error('Error al obtener vehículos');
+            
+            const vehiculos = await response.json();
+            this.renderVehiculosTable(vehiculos);
+            this.vehiculosVersion = parseInt(response.headers.get('X-Version'), 10);
             
         } catch (error) {
             console.error('Error actualizando tabla de vehículos:', error);
         }
     }
 
+    renderVehiculosTable(vehiculos) {
+        const tbody = document.querySelector('#tabla-vehiculos tbody');
+        
+        if (!tbody) return;
+        
+        // Limpiar tabla
+        tbody.innerHTML = '';
+        
+        if (vehiculos.length === 0) {
+            tbody.innerHTML = `
+                <tr>
+                    <td colspan="9" class="text-center py-4">
+                        <i class="fas fa-car fa-2x text-muted mb-2"></i>
+                        <br>No hay vehículos en el estacionamiento
+                    </td>
+                </tr>
+            `;
+            return;
+        }
+        
+        // Agregar vehículos
+        vehiculos.forEach(vehiculo => {
+            tbody.appendChild(this.renderVehiculoRow(vehiculo));
+        });
+    }
+
+    renderVehiculoRow(vehiculo) {
+        const abonoHtml = vehiculo.tiene_abono 
+            ? '<span class="badge bg-success" title="Con descuento del 10%"><i class="fas fa-calendar-check"></i> Sí</span>'
+            : '<span class="badge bg-secondary"><i class="fas fa-times"></i> No</span>';
+        
+        const tarifaHtml = vehiculo.tiene_abono 
+            ? `<span class="badge bg-success"><span class="monto">${Utils.formatCurrency(vehiculo.tarifa_actual)}</span> <small class="text-muted">(-10%)</small></span>`
+            : `<span class="badge bg-success"><span class="monto">${Utils.formatCurrency(vehiculo.tarifa_actual)}</span></span>`;
+        
+        const row = document.createElement('tr');
+        row.dataset.placa = vehiculo.placa;
+        if (vehiculo.plan_tarifa && vehiculo.plan_tarifa.entrada !== null) {
+            row.dataset.plan = JSON.stringify(vehiculo.plan_tarifa);
+            // Diferencia entre el reloj del servidor y el del navegador
+            row.dataset.desfase = vehiculo.generado - Date.now();
+        }
+        row.innerHTML = `
+            <td><strong>${vehiculo.placa}</strong></td>
+            <td><span class="badge bg-secondary">${vehiculo.tipo}</span></td>
+            <td>${vehiculo.propietario || 'No especificado'}</td>
+            <td><span class="badge bg-info">${vehiculo.espacio}</span></td>
+            <td>${vehiculo.hora_entrada}</td>
+            <td class="celda-tiempo">${vehiculo.tiempo_horas}h ${vehiculo.tiempo_minutos}m</td>
+            <td>${abonoHtml}</td>
+            <td class="celda-tarifa">${tarifaHtml}</td>
+            <td>
+                <button type="button" class="btn btn-danger btn-sm btn-egresar"
+                        data-placa="${vehiculo.placa}"
+                        data-tipo="${vehiculo.tipo_vehiculo}"
+                        data-espacio="${vehiculo.espacio}"
+                        title="Egresar vehículo">
+                    <i class="fas fa-sign-out-alt"></i> Egresar
+                </button>
+            </td>
+        `;
+        return row;
+    }
+
+    addVehiculoRow(vehiculo) {
+        const tbody = document.querySelector('#tabla-vehiculos tbody');
+        if (!tbody) {
+            // La página se generó sin tabla (estacionamiento vacío)
+            location.reload();
+            return;
+        }
+        // Quitar la fila de "no hay vehículos" si estaba
+        tbody.querySelectorAll('tr:not([data-placa])').forEach(row => row.remove());
+        this.removeVehiculoRow(vehiculo.placa);
+        tbody.appendChild(this.renderVehiculoRow(vehiculo));
+    }
+
+    removeVehiculoRow(placa) {
+        const row = document.querySelector(`#tabla-vehiculos tbody tr[data-placa="${placa}"]`);
+        if (row) {
+            row.remove();
+        }
+    }
+
     startAutoUpdate() {
+        if (this.updateInterval) {
+            return;
+        }
         // Actualizar cada 30 segundos
         this.updateInterval = setInterval(() => {
             this.updateDashboard();
@@ -333,11 +514,89 @@ class TarifaSimulator {
     }
 }
 
+// Autocompletado de placas con /api/buscar (placas parciales o mal leídas)
+class BuscadorPlacas {
+    constructor(input) {
+        this.input = input;
+        this.estacionados = input.dataset.estacionados === '1';
+        this.destino = input.dataset.destino ? document.getElementById(input.dataset.destino) : null;
+        this.consulta = 0; // Las respuestas de búsquedas anteriores se descartan
+
+        this.lista = document.createElement('div');
+        this.lista.className = 'list-group position-absolute w-100 shadow-sm d-none';
+        this.lista.style.zIndex = 1000;
+        input.parentElement.classList.add('position-relative');
+        input.parentElement.appendChild(this.lista);
+
+        input.setAttribute('autocomplete', 'off');
+        input.addEventListener('input', Utils.debounce(() => this.buscar(), 150));
+        input.addEventListener('blur', () => this.ocultar());
+    }
+
+    async buscar() {
+        const texto = this.input.value.trim();
+        const numero = ++this.consulta;
+        if (texto.length < 2) {
+            this.ocultar();
+            return;
+        }
+
+        const parametros = new URLSearchParams({ q: texto });
+        if (this.estacionados) parametros.set('estacionados', '1');
+        try {
+            const response = await fetch(`${CONFIG.API_BASE}/api/buscar?${parametros}`);
+            const resultados = await response.json();
+            if (numero === this.consulta) this.mostrar(resultados);
+        } catch (error) {
+            console.error('Error buscando placas:', error);
+        }
+    }
+
+    mostrar(resultados) {
+        this.lista.innerHTML = '';
+        resultados.forEach(resultado => {
+            const item = document.createElement('button');
+            item.type = 'button';
+            item.className = 'list-group-item list-group-item-action d-flex justify-content-between';
+
+            const placa = document.createElement('strong');
+            placa.textContent = resultado.placa;
+            const detalle = document.createElement('small');
+            detalle.className = 'text-muted';
+            detalle.textContent = (resultado.estacionado ? `Espacio ${resultado.espacio}` :
+                                   resultado.abono_vigente ? 'Abono vigente' : 'Historial') +
+                                  (resultado.coincidencia === 'aproximada' ? ' · ¿quiso decir?' : '');
+            item.append(placa, detalle);
+
+            // mousedown: se elige antes de que el campo pierda el foco
+            item.addEventListener('mousedown', event => {
+                event.preventDefault();
+                this.elegir(resultado.placa);
+            });
+            this.lista.appendChild(item);
+        });
+        this.lista.classList.toggle('d-none', resultados.length === 0);
+    }
+
+    elegir(placa) {
+        this.input.value = placa;
+        if (this.destino) {
+            this.destino.value = placa;
+            this.destino.dispatchEvent(new Event('change'));
+        }
+        this.ocultar();
+    }
+
+    ocultar() {
+        this.lista.classList.add('d-none');
+    }
+}
+
 // Inicialización cuando el DOM esté listo
 document.addEventListener('DOMContentLoaded', function() {
     // Inicializar dashboard si estamos en la página principal
     if (document.getElementById('espacios-disponibles')) {
-        new EstacionamientoDashboard();
+        window.estacionamientoDashboard = new EstacionamientoDashboard();
     }
     
     // Inicializar simulador de tarifas si existe
@@ -345,6 +604,9 @@ document.addEventListener('DOMContentLoaded', function() {
         new TarifaSimulator();
     }
     
+    // Autocompletado de placas (consultar y egresar)
+    document.querySelectorAll('[data-buscar-placas]').forEach(input => new BuscadorPlacas(input));
+    
     // Inicializar tooltips de Bootstrap
     const tooltipTriggerList = [].slice.call(document.querySelectorAll('[data-bs-toggle="tooltip"]'));
     tooltipTriggerList.map(function (tooltipTriggerEl) {
@@ -381,10 +643,9 @@ document.addEventListener('visibilitychange', function() {
     const dashboard = window.estacionamientoDashboard;
     if (dashboard) {
         if (document.hidden) {
-            dashboard.stopAutoUpdate();
+            dashboard.stopLiveUpdates();
         } else {
-            dashboard.startAutoUpdate();
-            dashboard.updateDashboard(); // Actualizar inmediatamente al volver
+            dashboard.startLiveUpdates(); // El evento 'estado' trae los datos al día
         }
     }
 });
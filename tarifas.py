@@ -0,0 +1,282 @@
+"""
+Motor de tarifas del Sistema de Estacionamiento
+
+Las tarifas se organizan en versiones inmutables con fecha de vigencia. Cada
+vehículo queda ligado a la versión vigente al momento de su ingreso, así que
+cambiar las tarifas no modifica lo que pagan los vehículos que ya están
+dentro.
+
+Una versión tiene una tarifa por hora para cada tipo de vehículo, franjas
+horarias opcionales con tarifas propias (por ejemplo, tarifa nocturna) y
+topes diarios opcionales. Cada hora iniciada se cobra con la tarifa de la
+franja en la que empieza, y lo cobrado en un mismo día calendario no supera
+el tope de ese tipo de vehículo.
+
+Las franjas se compilan al crear la versión en segmentos del día con su
+tarifa. Como las horas cobradas empiezan siempre en el mismo minuto de cada
+hora, todos los días completos de una estadía cuestan lo mismo: una estadía
+de varios días se cotiza calculando solo el primer día, el último y un día
+completo, en O(franjas), sin recorrer hora por hora.
+"""
+
+from bisect import bisect_right
+from collections.abc import Mapping
+from datetime import datetime
+from types import MappingProxyType
+
+MICROSEGUNDOS_HORA = 3600 * 10**6
+MICROSEGUNDOS_DIA = 24 * MICROSEGUNDOS_HORA
+
+
+def _minutos(hora):
+    """Convierte 'HH:MM' en minutos desde la medianoche (ValueError si no es una hora)"""
+    try:
+        horas, minutos = hora.split(':')
+        horas, minutos = int(horas), int(minutos)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Hora no válida: {hora!r} (se espera HH:MM)") from None
+    if not (0 <= horas < 24 and 0 <= minutos < 60):
+        raise ValueError(f"Hora fuera de rango: {hora!r} (de 00:00 a 23:59)")
+    return horas * 60 + minutos
+
+
+def _validar_monto(monto, descripcion):
+    """Verifica que una tarifa o un tope sea un número no negativo"""
+    if isinstance(monto, bool) or not isinstance(monto, (int, float)) or not monto >= 0:
+        raise ValueError(f"{descripcion} debe ser un número no negativo: {monto!r}")
+
+
+def _techo(a, b):
+    """División entera redondeando hacia arriba"""
+    return -(-a // b)
+
+
+class TablaTarifas:
+    """Versión inmutable de las tarifas, vigente desde una fecha"""
+
+    def __init__(self, numero, vigente_desde, tarifas, franjas=(), topes_diarios=None):
+        """
+        Inicializa y compila una versión de tarifas
+
+        Args:
+            numero (int): Número de versión
+            vigente_desde (datetime): Momento desde el que se aplica a los ingresos
+            tarifas (dict): Tarifa por hora de cada tipo de vehículo
+            franjas (list): Franjas horarias como
+                {'desde': '22:00', 'hasta': '06:00', 'tarifas': {'auto': 1500}};
+                una franja puede cruzar la medianoche y no puede superponerse con otra
+            topes_diarios (dict): Máximo a cobrar por día calendario según el tipo
+        """
+        self._validar(tarifas, franjas, topes_diarios)
+        self.numero = numero
+        self.vigente_desde = vigente_desde
+        self.tarifas = MappingProxyType(dict(tarifas))
+        self.franjas = tuple(MappingProxyType({'desde': f['desde'], 'hasta': f['hasta'],
+                                               'tarifas': MappingProxyType(dict(f['tarifas']))})
+                             for f in franjas)
+        self.topes_diarios = MappingProxyType(dict(topes_diarios or {}))
+
+        self._segmentos = {tipo: self._compilar(tipo) for tipo in self.tarifas}
+
+    @staticmethod
+    def _validar(tarifas, franjas, topes_diarios):
+        """Verifica tipos y rangos de los datos de una versión (ValueError si no son válidos)"""
+        for tipo, tarifa in tarifas.items():
+            _validar_monto(tarifa, f"La tarifa de '{tipo}'")
+        if not isinstance(franjas, (list, tuple)):
+            raise ValueError("Las franjas deben ser una lista")
+        for franja in franjas:
+            if not isinstance(franja, Mapping) or not isinstance(franja.get('tarifas'), Mapping):
+                raise ValueError("Cada franja debe tener 'desde', 'hasta' y 'tarifas' por tipo de vehículo")
+            _minutos(franja.get('desde'))
+            _minutos(franja.get('hasta'))
+            for tipo, tarifa in franja['tarifas'].items():
+                _validar_monto(tarifa, f"La tarifa de '{tipo}' en la franja {franja['desde']}-{franja['hasta']}")
+        if topes_diarios is not None:
+            if not isinstance(topes_diarios, Mapping):
+                raise ValueError("Los topes diarios deben indicarse por tipo de vehículo")
+            for tipo, tope in topes_diarios.items():
+                _validar_monto(tope, f"El tope diario de '{tipo}'")
+
+    def _compilar(self, tipo):
+        """
+        Divide el día en segmentos (inicio, fin, tarifa) en microsegundos
+
+        Returns:
+            list: Segmentos ordenados que cubren todo el día
+        """
+        tramos = []  # (inicio, fin, tarifa) de las franjas, en minutos
+        for franja in self.franjas:
+            if tipo not in franja['tarifas']:
+                continue
+            desde, hasta = _minutos(franja['desde']), _minutos(franja['hasta'])
+            if desde == hasta:
+                raise ValueError(f"La franja {franja['desde']}-{franja['hasta']} está vacía")
+            if desde < hasta:
+                tramos.append((desde, hasta, franja['tarifas'][tipo]))
+            else:
+                tramos.append((desde, 24 * 60, franja['tarifas'][tipo]))
+                tramos.append((0, hasta, franja['tarifas'][tipo]))
+        tramos.sort()
+
+        segmentos = []
+        cursor = 0
+        for inicio, fin, tarifa in tramos:
+            if inicio < cursor:
+                raise ValueError(f"Las franjas de '{tipo}' se superponen")
+            if inicio > cursor:
+                segmentos.append((cursor, inicio, self.tarifas[tipo]))
+            segmentos.append((inicio, fin, tarifa))
+            cursor = fin
+        if cursor < 24 * 60:
+            segmentos.append((cursor, 24 * 60, self.tarifas[tipo]))
+
+        unidad = 60 * 10**6
+        return [(inicio * unidad, fin * unidad, tarifa) for inicio, fin, tarifa in segmentos]
+
+    def tarifa_plana(self, tipo):
+        """Tarifa por hora si el tipo no tiene franjas ni tope, o None"""
+        if len(self._segmentos.get(tipo, ())) == 1 and tipo not in self.topes_diarios:
+            return self.tarifas[tipo]
+        return None
+
+    def _cobro_dia(self, tipo, inicio, primera, ultima):
+        """
+        Cobro de las horas cuyo inicio cae en un mismo día
+
+        Args:
+            tipo (str): Tipo de vehículo
+            inicio (int): Inicio de la primera hora de la estadía, en
+                microsegundos desde la medianoche de este día (puede ser negativo)
+            primera, ultima (int): Rango de índices de hora [primera, ultima]
+                que empiezan en este día
+        """
+        total = 0
+        for desde, hasta, tarifa in self._segmentos[tipo]:
+            # Horas k con desde <= inicio + k·hora < hasta, dentro del rango del día
+            k_desde = max(primera, _techo(desde - inicio, MICROSEGUNDOS_HORA))
+            k_hasta = min(ultima + 1, _techo(hasta - inicio, MICROSEGUNDOS_HORA))
+            if k_hasta > k_desde:
+                total += (k_hasta - k_desde) * tarifa
+        tope = self.topes_diarios.get(tipo)
+        return min(total, tope) if tope is not None else total
+
+    def cobrar(self, tipo, entrada, horas):
+        """
+        Cotiza una estadía en O(franjas), sin importar cuántos días dure
+
+        Args:
+            tipo (str): Tipo de vehículo
+            entrada (datetime): Hora de entrada
+            horas (int): Horas a cobrar (cada hora iniciada cuenta completa)
+
+        Returns:
+            float: Monto sin descuentos
+        """
+        if tipo not in self._segmentos:
+            tipo = 'auto'
+        inicio = ((entrada.hour * 60 + entrada.minute) * 60 + entrada.second) * 10**6 + entrada.microsecond
+        ultimo_dia = (inicio + (horas - 1) * MICROSEGUNDOS_HORA) // MICROSEGUNDOS_DIA
+
+        def rango(dia):
+            base = dia * MICROSEGUNDOS_DIA
+            primera = max(0, _techo(base - inicio, MICROSEGUNDOS_HORA))
+            ultima = min(horas - 1, _techo(base + MICROSEGUNDOS_DIA - inicio, MICROSEGUNDOS_HORA) - 1)
+            return inicio - base, primera, ultima
+
+        total = self._cobro_dia(tipo, *rango(0))
+        if ultimo_dia > 0:
+            total += self._cobro_dia(tipo, *rango(ultimo_dia))
+        if ultimo_dia > 1:
+            # Los días intermedios tienen 24 horas que empiezan en el mismo minuto
+            dia_completo = self._cobro_dia(tipo, inicio % MICROSEGUNDOS_HORA, 0, 23)
+            total += (ultimo_dia - 1) * dia_completo
+        return total
+
+    def a_dict(self):
+        """Convierte la versión en un diccionario serializable a JSON"""
+        return {
+            'numero': self.numero,
+            'vigente_desde': self.vigente_desde.isoformat(),
+            'tarifas': dict(self.tarifas),
+            'franjas': [{'desde': f['desde'], 'hasta': f['hasta'], 'tarifas': dict(f['tarifas'])}
+                        for f in self.franjas],
+            'topes_diarios': dict(self.topes_diarios)
+        }
+
+    @classmethod
+    def desde_dict(cls, datos):
+        """Reconstruye una versión a partir de un diccionario generado por a_dict"""
+        return cls(datos['numero'], datetime.fromisoformat(datos['vigente_desde']), datos['tarifas'],
+                   datos.get('franjas', ()), datos.get('topes_diarios'))
+
+
+class MotorTarifas:
+    """Conjunto inmutable de versiones de tarifas ordenadas por vigencia"""
+
+    def __init__(self, versiones):
+        """
+        Inicializa el motor
+
+        Args:
+            versiones (list): TablaTarifas; debe haber al menos una
+        """
+        self.versiones = tuple(sorted(versiones, key=lambda v: (v.vigente_desde, v.numero)))
+        self._inicios = [v.vigente_desde for v in self.versiones]
+        self._por_numero = {v.numero: v for v in self.versiones}
+
+    @classmethod
+    def inicial(cls, tarifas):
+        """Motor con una sola versión vigente desde siempre (datos sin versiones)"""
+        return cls([TablaTarifas(1, datetime.min, tarifas)])
+
+    def vigente(self, momento=None):
+        """
+        Versión vigente en un momento
+
+        Args:
+            momento (datetime): Momento de referencia (por defecto, ahora)
+        """
+        indice = bisect_right(self._inicios, momento or datetime.now()) - 1
+        return self.versiones[max(indice, 0)]
+
+    def version(self, numero):
+        """Versión por número, o None si no existe"""
+        return self._por_numero.get(numero)
+
+    def tabla_de(self, vehiculo):
+        """Versión a la que quedó ligado un vehículo al ingresar"""
+        tabla = self._por_numero.get(vehiculo.version_tarifa)
+        return tabla if tabla is not None else self.vigente(vehiculo.hora_entrada)
+
+    def con_version(self, tarifas, vigente_desde, franjas=None, topes_diarios=None):
+        """
+        Crea un motor nuevo con una versión más; las existentes no cambian
+
+        Las franjas y topes no indicados se copian de la versión vigente en
+        esa fecha.
+
+        Args:
+            tarifas (dict): Tarifas por hora que cambian (el resto se conserva)
+            vigente_desde (datetime): Inicio de vigencia de la nueva versión
+            franjas (list): Franjas horarias de la nueva versión
+            topes_diarios (dict): Topes diarios de la nueva versión
+
+        Returns:
+            tuple: (MotorTarifas nuevo, TablaTarifas creada)
+        """
+        base = self.vigente(vigente_desde)
+        nueva = TablaTarifas(max(self._por_numero) + 1, vigente_desde,
+                             {**base.tarifas, **tarifas},
+                             base.franjas if franjas is None else franjas,
+                             base.topes_diarios if topes_diarios is None else topes_diarios)
+        return MotorTarifas(self.versiones + (nueva,)), nueva
+
+    def a_lista(self):
+        """Versiones como lista de diccionarios serializables"""
+        return [version.a_dict() for version in self.versiones]
+
+    @classmethod
+    def desde_lista(cls, datos):
+        """Reconstruye el motor a partir de la lista generada por a_lista"""
+        return cls([TablaTarifas.desde_dict(version) for version in datos])
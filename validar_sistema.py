@@ -7,6 +7,8 @@ Script para validar la configuración y estructura del sistema de estacionamient
 import os
 import json
 import sys
+import tempfile
+from datetime import datetime, timedelta
 from pathlib import Path
 
 def validar_estructura_archivos():
@@ -73,6 +75,12 @@ def validar_imports():
         print("  ❌ Flask no está instalado")
         return False
     
+    try:
+        import numpy
+        print(f"  ✅ NumPy {numpy.__version__}")
+    except ImportError:
+        print("  ⚠️  NumPy no está instalado (sin él, /api/analitica responde 501)")
+    
     try:
         from estacionamiento import Estacionamiento
         print("  ✅ Módulo estacionamiento.py")
@@ -116,6 +124,70 @@ def validar_configuracion_app():
         print(f"  ❌ Error leyendo app.py: {e}")
         return False
 
+def validar_fechas_con_zona():
+    """Valida que las fechas con zona horaria se lleven a la hora local"""
+    print("\n🕒 Validando fechas con zona horaria...")
+    
+    try:
+        from estacionamiento import Estacionamiento
+        
+        with tempfile.TemporaryDirectory() as directorio:
+            estacionamiento = Estacionamiento(archivo_datos=os.path.join(directorio, 'datos.json'),
+                                              durabilidad='sistema')
+            manana = datetime.now().astimezone() + timedelta(days=1)
+            for sufijo in ('Z', '-03:00', '+05:30'):
+                texto = manana.replace(microsecond=0, tzinfo=None).isoformat() + sufijo
+                vigente_desde = datetime.fromisoformat(texto)
+                exito, mensaje = estacionamiento.cambiar_tarifas({'auto': 3000}, vigente_desde)
+                version = max(estacionamiento.motor_tarifas.versiones, key=lambda v: v.numero)
+                esperado = vigente_desde.astimezone().replace(tzinfo=None)
+                if not exito or version.vigente_desde != esperado:
+                    print(f"  ❌ Tarifas vigentes desde {texto}: {mensaje}")
+                    return False
+                print(f"  ✅ Tarifas vigentes desde {texto} → {version.vigente_desde.isoformat()} (hora local)")
+            estacionamiento.cerrar()
+        return True
+        
+    except Exception as e:
+        print(f"  ❌ Error con fechas con zona horaria: {e}")
+        return False
+
+def validar_horas_atrasadas():
+    """Valida que se rechacen las horas de barrera fuera de la ventana sin conexión"""
+    print("\n⏪ Validando horas atrasadas de las barreras...")
+    
+    try:
+        from estacionamiento import Estacionamiento
+        
+        with tempfile.TemporaryDirectory() as directorio:
+            estacionamiento = Estacionamiento(archivo_datos=os.path.join(directorio, 'datos.json'),
+                                              durabilidad='sistema')
+            ahora = datetime.now()
+            casos = [
+                ('Ingreso de 2020', False,
+                 lambda: estacionamiento.registrar_ingreso('VAL001', 'auto', momento=datetime(2020, 1, 1))),
+                ('Ingreso de hace 3 horas', True,
+                 lambda: estacionamiento.registrar_ingreso('VAL001', 'auto', momento=ahora - timedelta(hours=3))),
+                ('Egreso de 2020', False,
+                 lambda: estacionamiento.registrar_egreso('VAL001', momento=datetime(2020, 1, 1))),
+                ('Egreso de hace 1 hora', True,
+                 lambda: estacionamiento.registrar_egreso('VAL001', momento=ahora - timedelta(hours=1))),
+                ('Ingreso anterior a la última salida', False,
+                 lambda: estacionamiento.registrar_ingreso('VAL001', 'auto', momento=ahora - timedelta(hours=2))),
+            ]
+            for descripcion, esperado, operacion in casos:
+                exito, mensaje, _ = operacion()
+                if exito != esperado:
+                    print(f"  ❌ {descripcion}: {mensaje}")
+                    return False
+                print(f"  ✅ {descripcion}: {'aceptado' if exito else 'rechazado'}")
+            estacionamiento.cerrar()
+        return True
+        
+    except Exception as e:
+        print(f"  ❌ Error con horas atrasadas: {e}")
+        return False
+
 def mostrar_comandos_ejecucion():
     """Muestra los comandos para ejecutar la aplicación"""
     print("\n🚀 Comandos para ejecutar el sistema:")
@@ -147,7 +219,9 @@ def main():
         validar_estructura_archivos(),
         validar_datos_json(),
         validar_imports(),
-        validar_configuracion_app()
+        validar_configuracion_app(),
+        validar_fechas_con_zona(),
+        validar_horas_atrasadas()
     ]
     
     print("\n📊 RESUMEN DE VALIDACIÓN")